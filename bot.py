@@ -1,158 +1,424 @@
 import asyncio
 import logging
 import os
-from datetime import datetime
-from typing import Dict, List, Set, Any, Optional
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from html import escape
+from typing import Dict, List, Any, Optional
 
+import pytz
 from dotenv import load_dotenv
-from telegram import Update, Message, Chat
+from telegram import Update, Chat, ChatMember
+from telegram.error import BadRequest, Forbidden
 from telegram.ext import (
     Application,
+    ChatMemberHandler,
     CommandHandler,
     MessageHandler,
     MessageReactionHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
 
+from log_setup import setup_logging_from_env
+
 # 加载环境变量
 load_dotenv()
 
-# 配置日志
-LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# 配置日志：记录经队列交给后台线程写入，文件按大小/时间轮转并压缩，LOG_* 环境变量见 log_setup.py
 LOG_DIR = os.getenv("LOG_DIR", "logs")
-
-# 确保日志目录存在
-os.makedirs(LOG_DIR, exist_ok=True)
-
-# 配置日志格式
-log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
-log_file = os.path.join(LOG_DIR, f"bot_{datetime.now().strftime('%Y%m%d')}.log")
-
-# 配置日志处理器
-logging.basicConfig(
-    level=getattr(logging, LOG_LEVEL),
-    format=log_format,
-    handlers=[
-        logging.FileHandler(log_file),
-        logging.StreamHandler()
-    ]
+_log_shard = os.getenv("SHARD_INDEX")
+setup_logging_from_env(
+    name="bot" if _log_shard is None else f"bot-shard-{_log_shard}",
+    static_fields=None if _log_shard is None else {"shard": int(_log_shard)}
 )
 logger = logging.getLogger(__name__)
+# 每条消息都会产生的分类日志单独归类，便于单独设置级别或采样（LOG_LEVELS / LOG_SAMPLING）
+classify_logger = logging.getLogger("bot.classify")
 
 # 从环境变量获取机器人令牌
 TOKEN = os.getenv("BOT_TOKEN")
 if not TOKEN:
     raise ValueError("未设置BOT_TOKEN环境变量。请在.env文件中设置。")
 
-import json
-import openai
-import httpx
+# 更新并发处理：不同群组并发，同一群组内保序
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "16"))
+UPDATE_MAX_BACKLOG = int(os.getenv("UPDATE_MAX_BACKLOG", "1000"))
+# 存储后端：json（默认）或 sqlite
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json").lower()
+# 更新接收方式：polling（默认）或 webhook；webhook 模式的 WEBHOOK_* 环境变量见 webhook_server.py
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling").lower()
+# 分片工作进程：由 sharding.py 的监督进程设置，只处理 chat_id 哈希到本分片的群组
+SHARD_INDEX = os.getenv("SHARD_INDEX")
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_SUPERVISOR = os.getenv("SHARD_SUPERVISOR", "")
+# 更新录制：设置目录后把收到的消息与反应更新写成 gzip 压缩的 JSONL 分段，供 loadtest.py --replay 回放
+RECORD_UPDATES_DIR = os.getenv("RECORD_UPDATES_DIR", "")
+RECORD_SEGMENT_MB = int(os.getenv("RECORD_SEGMENT_MB", "64"))
+RECORD_SEGMENT_MINUTES = int(os.getenv("RECORD_SEGMENT_MINUTES", "60"))
+RECORD_MAX_SEGMENTS = int(os.getenv("RECORD_MAX_SEGMENTS", "48"))
+# 指标：设置端口后在本机 HTTP /metrics 暴露 Prometheus 文本格式的指标；分片模式下第 i 个分片使用端口 + i
+METRICS_LISTEN = os.getenv("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = os.getenv("METRICS_PORT", "")
+# 性能剖析：PROFILE_ON_START 秒数大于 0 时启动后立即剖析一个窗口，也可用 /profile 命令临时开启；结果写入日志目录
+PROFILE_ON_START = int(os.getenv("PROFILE_ON_START", "0"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample").lower()
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+from deletion_queue import select_drain_batch
+from deletion_scheduler import DEFAULT_SCHEDULE, DeletionScheduler
+from llm_batcher import ClassificationBatcher, normalize_decision, single_system_prompt
+from llm_client import LLMClient
+from metrics import (
+    BOT_API_DURATION, BOT_API_ERRORS, BOT_API_RETRY_AFTER, BOT_API_WAIT, HANDLER_DURATION, HANDLER_ERRORS,
+    JOB_DURATION, JOB_ERRORS, LLM_DURATION, LLM_ERRORS, LLM_TOKENS, QUEUE_DEPTH, QUEUE_OLDEST_AGE, REGISTRY,
+    MetricsServer, instrument_handlers, timed_job
+)
+from local_classifier import LocalModelManager
+from permissions import AdminRosterCache, PermissionTable, is_admin_member, member_can_delete, reconcile
+from rate_limiter import PRIORITY_BATCH, PRIORITY_INTERACTIVE, PriorityRateLimiter
+from reaction_marker import ReactionMarker
+from update_processor import ALLOWED_UPDATES, BacklogQueue, PerChatUpdateProcessor
+from update_recorder import UpdateRecorder
+from near_duplicate import NearDuplicateIndex
+from profiler import MODES as PROFILE_MODES, Profiler, format_timings
+from rule_engine import ACTIONS as RULE_ACTIONS, KINDS as RULE_KINDS, RuleEngine, UNSURE
+from sharding import ShardLink, base_data_dir, run_shard_worker, shard_data_dir, verify_shard_dir
+from storage import JsonStorage, SqliteStorage, Storage, import_json_files
+from verdict_cache import VerdictCache, config_fingerprint
+from webhook_server import run_webhook, webhook_from_env
 
 # LLM 配置（可由管理员通过 /llm_config 设置，默认值）
 llm_config = {
     "base_url": "https://api.openai.com/v1",
     "model": "gpt-4o-mini",
-    "api_key": ""
+    "api_key": "",
+    # 连接池参数，仅可通过 deletion_config.json 调整
+    "timeout": 30,
+    "max_connections": 20,
+    "max_keepalive_connections": 10,
+    # 连接池已满时等待空闲连接的秒数
+    "pool_timeout": 10
+}
+# 共享的异步 LLM 客户端，按 llm_config 懒加载连接池
+llm_client = LLMClient()
+# LLM 微批处理配置：窗口内最多合并 max_batch_size 条，最多等待 max_wait_ms 毫秒
+batch_config = {
+    "enabled": False,
+    "max_batch_size": 20,
+    "max_wait_ms": 500
+}
+# 分类结论缓存配置：persist 为 true 时缓存写入 data/verdict_cache.json
+cache_config = {
+    "enabled": True,
+    "max_size": 10000,
+    "ttl_seconds": 86400,
+    "persist": False
+}
+# 近似重复检测配置：与近期 DELETE 消息的 SimHash 汉明距离不超过 max_distance 时直接判定 DELETE
+near_dup_config = {
+    "enabled": True,
+    "max_distance": 10,
+    "window_size": 500,
+    "window_seconds": 3600,
+    "min_length": 20
+}
+# 本地分类器配置：每类样本数达到 min_samples 且判定余量不低于 min_margin 时跳过 LLM。
+# 余量为两类对数得分之差除以消息的特征数，特征少或两类特征混杂的消息余量小
+local_model_config = {
+    "enabled": False,
+    "min_margin": 1.0,
+    "min_samples": 200,
+    "max_samples": 50000
+}
+# 删除期限配置：Telegram 只允许机器人删除 48 小时内的消息。
+# 距期限不足 safety_margin_seconds 的消息视为已过期；每 early_drain_interval_seconds 检查一次，
+# 在下一次定时删除之前就会过期的消息提前删除
+DELETE_WINDOW_SECONDS = 48 * 3600
+expiry_config = {
+    "safety_margin_seconds": 600,
+    "early_drain_interval_seconds": 900
+}
+# 删除队列消化方式：daily 为每天 deletion_time 集中删除；continuous 为后台每 interval_seconds 按
+# messages_per_minute 的速率持续删除。quiet_hours（如 "23:00-07:00"，按 timezone 解释，可跨午夜）内暂停，
+# 但发送时间早于 max_age_seconds 的消息无论何时都会优先删除
+drain_config = {
+    "mode": "daily",
+    "messages_per_minute": 60,
+    "interval_seconds": 30,
+    "quiet_hours": "",
+    "timezone": "Asia/Shanghai",
+    "max_age_seconds": 21600
+}
+# 删除权限对账配置：权限表由 my_chat_member 更新实时维护，
+# 每 reconcile_interval_seconds 检查一次超过 max_age_seconds 未确认的群组，最多 concurrency 个并发请求；
+# 管理员名单缓存 admin_roster_ttl_seconds 秒，收到 chat_member 更新时失效
+permission_config = {
+    "reconcile_interval_seconds": 21600,
+    "max_age_seconds": 21600,
+    "concurrency": 5,
+    "admin_roster_ttl_seconds": 600
+}
+# Bot API 出站限流配置：全局与每聊天令牌桶，群组发消息另有每分钟上限
+rate_limit_config = {
+    "overall_per_second": 30,
+    "chat_per_second": 1,
+    "chat_burst": 3,
+    "group_messages_per_minute": 20,
+    "max_retries": 3
+}
+# 待删除消息的标记反应：每个群组在后台排队发送（不阻塞该群组的后续更新），经 bot 的连接池与限流器发出，
+# 网络错误按 retry_base_delay 指数退避重试，积压超过 max_pending_per_chat 时丢弃最早的标记
+reaction_config = {
+    "enabled": True,
+    "emoji": "🙈",
+    "max_retries": 3,
+    "retry_base_delay": 1.0,
+    "max_pending_per_chat": 20
 }
-# openai 配置将由 load_deletion_config 读取并应用
 
 # 配置文件路径
-# 数据目录设置
-DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+# 数据目录设置，可用 DATA_DIR 环境变量指向其他位置（如压测使用的临时目录）；与监督进程使用同一解析
+DATA_DIR = base_data_dir()
+if SHARD_INDEX is not None:
+    # 每个分片使用自己的数据目录，由监督进程在首次启动时初始化
+    DATA_DIR = shard_data_dir(DATA_DIR, int(SHARD_INDEX))
+    verify_shard_dir(DATA_DIR, int(SHARD_INDEX), SHARD_COUNT)
 os.makedirs(DATA_DIR, exist_ok=True)
 
 # 配置文件路径
 GROUPS_CONFIG_FILE = os.path.join(DATA_DIR, 'groups.json')
 DELETION_QUEUE_FILE = os.path.join(DATA_DIR, 'deletion_queue.json')
+DELETION_JOURNAL_FILE = os.path.join(DATA_DIR, 'deletion_queue.journal')
 DELETION_CONFIG_FILE = os.path.join(DATA_DIR, 'deletion_config.json')
+VERDICT_CACHE_FILE = os.path.join(DATA_DIR, 'verdict_cache.json')
+RULES_FILE = os.path.join(DATA_DIR, 'rules.json')
+LOCAL_MODEL_FILE = os.path.join(DATA_DIR, 'local_model.json')
+TRAINING_SAMPLES_FILE = os.path.join(DATA_DIR, 'training_samples.jsonl')
+# 分片之间不能共用数据库文件，分片模式下忽略 SQLITE_PATH
+SQLITE_PATH = os.getenv("SQLITE_PATH", os.path.join(DATA_DIR, 'bot.db')) if SHARD_INDEX is None else os.path.join(DATA_DIR, 'bot.db')
+
+# 更新录制器，未设置 RECORD_UPDATES_DIR 时不录制
+update_recorder: Optional[UpdateRecorder] = UpdateRecorder(
+    RECORD_UPDATES_DIR,
+    segment_bytes=RECORD_SEGMENT_MB * 1024 * 1024,
+    segment_seconds=RECORD_SEGMENT_MINUTES * 60,
+    max_segments=RECORD_MAX_SEGMENTS
+) if RECORD_UPDATES_DIR else None
+
+# 指标服务器，未设置 METRICS_PORT 时不启动（/perf 命令仍可使用）
+metrics_server: Optional[MetricsServer] = MetricsServer(
+    REGISTRY, METRICS_LISTEN, int(METRICS_PORT) + (int(SHARD_INDEX) if SHARD_INDEX is not None else 0)
+) if METRICS_PORT else None
+
+# 剖析会话，平时只在处理器与定时任务外多一次判断
+profiler = Profiler(LOG_DIR, interval=PROFILE_INTERVAL_MS / 1000)
+_profile_job = None
+
+# 分片模式下与监督进程的连接
+shard_link: Optional[ShardLink] = ShardLink(int(SHARD_INDEX), SHARD_COUNT, SHARD_SUPERVISOR) if SHARD_INDEX is not None else None
 
 # 存储需要监控的群组
 monitored_groups: Dict[int, Dict[str, Any]] = {}
-deletion_queue: List[Dict[str, Any]] = []
 deletion_time: str = '00:00'
+deletion_timezone: str = 'Asia/Shanghai'
 classification_prompt: str = ''
+# 各群组的定时删除计划，只为最早的一个设置定时任务
+deletion_scheduler = DeletionScheduler()
+# 机器人在各群组中的删除权限
+permission_table = PermissionTable()
 # 保存定时任务引用
 _deletion_job = None
+_deletion_timer_at: Optional[float] = None
+
+
+def create_storage() -> Storage:
+    """按 STORAGE_BACKEND 选择存储后端；首次启用 SQLite 时自动导入现有 JSON 文件"""
+    json_storage = JsonStorage(GROUPS_CONFIG_FILE, DELETION_QUEUE_FILE, DELETION_JOURNAL_FILE, DELETION_CONFIG_FILE)
+    if STORAGE_BACKEND != "sqlite":
+        json_storage.load_queue()
+        return json_storage
+    sqlite_storage = SqliteStorage(SQLITE_PATH)
+    if sqlite_storage.is_empty():
+        counts = import_json_files(sqlite_storage, json_storage)
+        logger.info(f"[存储] 已从 JSON 文件导入 SQLite: {counts}")
+    json_storage.close()
+    return sqlite_storage
+
+storage = create_storage()
 
 def load_monitored_groups():
     global monitored_groups
-    try:
-        with open(GROUPS_CONFIG_FILE, 'r', encoding='utf-8') as f:
-            groups = json.load(f)
-            monitored_groups = {g['id']: {"name": g["name"]} for g in groups}
-    except Exception as e:
-        logging.warning(f"加载群组配置失败: {e}")
-        monitored_groups = {}
+    monitored_groups = storage.load_groups()
 
 def save_monitored_groups():
-    groups = [{"id": gid, "name": info["name"]} for gid, info in monitored_groups.items()]
-    try:
-        with open(GROUPS_CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(groups, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        logging.error(f"保存群组配置失败: {e}")
+    storage.save_groups(monitored_groups)
 
-def load_deletion_queue():
-    global deletion_queue
-    try:
-        with open(DELETION_QUEUE_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if isinstance(data, list):
-            deletion_queue = data
-        elif isinstance(data, dict):
-            deletion_queue = [data]
-            logging.warning("deletion_queue.json contains an object, converted to list")
-        else:
-            deletion_queue = []
-            logging.warning("deletion_queue.json unexpected format, reset to empty list")
-    except Exception as e:
-        logging.warning(f"加载删除队列失败: {e}")
-        deletion_queue = []
+def load_permission_table() -> None:
+    """从持久化的群组信息恢复权限表"""
+    for chat_id, info in monitored_groups.items():
+        if "bot_can_delete" in info:
+            permission_table.update(chat_id, info["bot_can_delete"], info.get("permission_checked_at", 0.0))
 
-def save_deletion_queue():
-    try:
-        with open(DELETION_QUEUE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(deletion_queue, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        logging.error(f"保存删除队列失败: {e}")
+def deletion_cutoff() -> float:
+    """发送时间早于该时刻的消息已无法被机器人删除"""
+    return time.time() - DELETE_WINDOW_SECONDS + expiry_config.get("safety_margin_seconds", 600)
+
+def enqueue_deletion(chat_id: int, message_id: int, reason: str, date: int = 0) -> None:
+    """加入删除队列并记录审计；已超过 48 小时删除期限的消息直接丢弃
+
+    发送时间未知（如反应到的消息不在近期缓存中）时以入队时间代替：消息不晚于此时发送，
+    过期清理最迟在入队 48 小时后丢弃它，不会永远留在队列与日志中。
+    """
+    if not date:
+        date = int(time.time())
+    elif date < deletion_cutoff():
+        logger.info(f"Skipped queueing message {message_id} from group {chat_id}: past the 48h delete window")
+        storage.log_deletions([(chat_id, message_id, "expired", reason)])
+        return
+    # 已在队列中的消息不重复记录 queued 审计
+    storage.enqueue(chat_id, message_id, date, reason)
+
+def apply_deletion_config(cfg: Dict[str, Any]) -> None:
+    global deletion_time, deletion_timezone, classification_prompt
+    deletion_time = cfg.get('deletion_time', deletion_time)
+    deletion_timezone = cfg.get('deletion_timezone', deletion_timezone)
+    classification_prompt = cfg.get('classification_prompt', classification_prompt)
+    # 新增 LLM 配置加载
+    if 'llm_config' in cfg:
+        llm_config.update(cfg['llm_config'])
+    if 'batch_config' in cfg:
+        batch_config.update(cfg['batch_config'])
+    if 'cache_config' in cfg:
+        cache_config.update(cfg['cache_config'])
+    if 'near_dup_config' in cfg:
+        near_dup_config.update(cfg['near_dup_config'])
+    if 'local_model_config' in cfg:
+        local_model_config.update(cfg['local_model_config'])
+    if 'rate_limit_config' in cfg:
+        rate_limit_config.update(cfg['rate_limit_config'])
+    if 'expiry_config' in cfg:
+        expiry_config.update(cfg['expiry_config'])
+    if 'drain_config' in cfg:
+        drain_config.update(cfg['drain_config'])
+    if 'permission_config' in cfg:
+        permission_config.update(cfg['permission_config'])
+    if 'reaction_config' in cfg:
+        reaction_config.update(cfg['reaction_config'])
 
 def load_deletion_config():
-    global deletion_time, classification_prompt, llm_config
-    try:
-        with open(DELETION_CONFIG_FILE, 'r', encoding='utf-8') as f:
-            cfg = json.load(f)
-            deletion_time = cfg.get('deletion_time', deletion_time)
-            classification_prompt = cfg.get('classification_prompt', classification_prompt)
-            # 新增 LLM 配置加载
-            if 'llm_config' in cfg:
-                llm_config.update(cfg['llm_config'])
-    except Exception as e:
-        logging.warning(f"加载删除配置失败: {e}")
-    # 应用 LLM 配置到 openai
-    openai.api_key = llm_config.get("api_key", "")
-    openai.api_base = llm_config.get("base_url", "https://api.openai.com/v1")
+    apply_deletion_config(storage.load_config())
 
 def save_deletion_config():
-    try:
-        with open(DELETION_CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump({
-                'deletion_time': deletion_time,
-                'classification_prompt': classification_prompt,
-                'llm_config': llm_config
-            }, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        logging.error(f"保存删除配置失败: {e}")
+    cfg = {
+        'deletion_time': deletion_time,
+        'deletion_timezone': deletion_timezone,
+        'classification_prompt': classification_prompt,
+        'llm_config': llm_config,
+        'batch_config': batch_config,
+        'cache_config': cache_config,
+        'near_dup_config': near_dup_config,
+        'local_model_config': local_model_config,
+        'rate_limit_config': rate_limit_config,
+        'expiry_config': expiry_config,
+        'drain_config': drain_config,
+        'permission_config': permission_config,
+        'reaction_config': reaction_config
+    }
+    storage.save_config(cfg)
+    if shard_link is not None:
+        # 全局配置经监督进程同步到其他分片
+        shard_link.publish_config(cfg)
+
+def apply_shared_config(cfg: Dict[str, Any], job_queue) -> None:
+    """应用其他分片修改的全局配置"""
+    previous = (classification_prompt, dict(llm_config))
+    apply_deletion_config(cfg)
+    storage.save_config(cfg)
+    if previous != (classification_prompt, llm_config):
+        verdict_cache.clear()
+        near_dup_index.clear()
+    build_deletion_schedule()
+    rearm_deletion_timer(job_queue)
+    logger.info("[分片] Applied global config from another shard")
 
 
 # 启动时加载配置
 def initialize_monitored_groups():
     load_monitored_groups()
-    load_deletion_queue()
     load_deletion_config()
+    load_permission_table()
 
 initialize_monitored_groups()
 
+# 各群组管理员名单缓存
+admin_roster = AdminRosterCache(ttl=permission_config.get("admin_roster_ttl_seconds", 600))
+
+# 待删除消息的标记反应
+reaction_marker = ReactionMarker(
+    emoji=reaction_config.get("emoji", "🙈"),
+    max_retries=reaction_config.get("max_retries", 3),
+    retry_base_delay=reaction_config.get("retry_base_delay", 1.0),
+    max_pending_per_chat=reaction_config.get("max_pending_per_chat", 20)
+)
+
+# 微批处理器，仅在 batch_config.enabled 时使用
+classification_batcher = ClassificationBatcher(
+    llm_client,
+    max_batch_size=batch_config.get("max_batch_size", 20),
+    max_wait=batch_config.get("max_wait_ms", 500) / 1000
+)
+
+# 分类结论缓存
+verdict_cache = VerdictCache(
+    max_size=cache_config.get("max_size", 10000),
+    ttl=cache_config.get("ttl_seconds", 86400),
+    path=VERDICT_CACHE_FILE if cache_config.get("persist") else None
+)
+verdict_cache.load()
+
+# 近似重复索引（仅保存在内存中）
+near_dup_index = NearDuplicateIndex(
+    max_distance=near_dup_config.get("max_distance", 10),
+    window_size=near_dup_config.get("window_size", 500),
+    window_seconds=near_dup_config.get("window_seconds", 3600),
+    min_length=near_dup_config.get("min_length", 20)
+)
+
+# 本地规则预过滤（关键词 + 正则），命中后无需调用 LLM
+rule_engine = RuleEngine(RULES_FILE)
+rule_engine.load()
+
+# 本地分类器：始终从 LLM 结论和人工反应中学习，local_model_config.enabled 时参与判定
+local_model = LocalModelManager(
+    LOCAL_MODEL_FILE,
+    TRAINING_SAMPLES_FILE,
+    max_samples=local_model_config.get("max_samples", 50000)
+)
+local_model.load()
+
+# 最近消息的文本与发送时间，供反应事件回溯消息内容作为训练样本、并确定删除期限（反应更新中不包含这些信息）
+RECENT_MESSAGES_LIMIT = 5000
+recent_messages: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+def remember_message(chat_id: int, message_id: int, text: str, date: int = 0) -> None:
+    recent_messages[(chat_id, message_id)] = (text, date)
+    while len(recent_messages) > RECENT_MESSAGES_LIMIT:
+        recent_messages.popitem(last=False)
+
+def recent_message_date(chat_id: int, message_id: int) -> int:
+    """最近消息的发送时间，未知时返回 0"""
+    return recent_messages.get((chat_id, message_id), ("", 0))[1]
+
+def learn_from_reaction(chat_id: int, message_id: int) -> None:
+    """把被群成员负面反应的消息作为 DELETE 样本"""
+    text = recent_messages.get((chat_id, message_id), ("", 0))[0]
+    if text:
+        local_model.learn(text, "DELETE", source="reaction")
+
 # 命令处理函数
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /start command"""
@@ -171,10 +437,17 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "  /monitor - Enable reaction monitoring in current group\n"
         "  /stopmonitor - Disable reaction monitoring in current group\n"
         "  /status - Show current group status and pending deletions\n"
-        "  /set_deletion_time HH:MM - Schedule daily deletion of 💩-marked messages at given time\n"
+        "  /set_deletion_time HH:MM [timezone] - Schedule this group's daily deletion (use 'default' to follow the global time)\n"
         "  /trigger_deletion - Manually trigger batch deletion now\n"
-        "  /set_classification_prompt [prompt text] - Set LLM classification prompt (admin only)\n\n"
+        "  /set_classification_prompt [prompt text] - Set LLM classification prompt (admin only)\n"
+        "  /add_rule delete|keep keyword|regex [pattern] - Add a local prefilter rule (admin only)\n"
+        "  /remove_rule delete|keep keyword|regex [pattern] - Remove a local prefilter rule (admin only)\n"
+        "  /list_rules - List local prefilter rules of current group\n"
+        "  /retrain_model - Retrain the local classifier from recorded decisions (admin only)\n"
+        "  /perf - Show handler, LLM, Bot API, queue and job performance metrics (admin only)\n"
+        "  /profile [seconds] [sample|cprofile] - Profile handlers and jobs for a while, report wall vs CPU time (admin only)\n\n"
         "<b>Features:</b>\n"
+        "  • Local rules: Messages matching a keep rule are skipped, messages matching a delete rule are flagged without calling the LLM.\n"
         "  • LLM-based moderation: Each message is classified by LLM. If classified as DELETE, the bot will react with 🙈 (supported Telegram reaction emoji).\n"
         "  • 💩 reaction: Messages with 1 or more 💩 reactions are deleted immediately.\n"
         "  • 👎 reaction: Messages with 👎 reactions are queued for daily batch deletion.\n"
@@ -182,6 +455,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "  • Bot must be admin with delete permissions.\n"
         "\n<b>Examples:</b>\n"
         "  /set_deletion_time 23:00\n"
+        "  /set_deletion_time 03:30 Europe/Berlin\n"
+        "  /add_rule delete keyword t.me/joinchat\n"
+        "  /add_rule delete regex (?:free|cheap)\\s+usdt\n"
         "  /status\n"
         "  /trigger_deletion\n"
         "\n<b>Environment:</b>\n"
@@ -199,21 +475,28 @@ async def monitor(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text("This command can only be used in groups.")
         return
     
-    # 检查机器人是否为管理员
-    from telegram import ChatMemberAdministrator, ChatMemberOwner
-    bot_member = await context.bot.get_chat_member(chat.id, context.bot.id)
-    if isinstance(bot_member, (ChatMemberAdministrator, ChatMemberOwner)):
-        if not bot_member.can_delete_messages:
+    # 机器人自身的删除权限以权限表为准（由 my_chat_member 更新维护），
+    # 只有未知或超过 max_age_seconds 未确认时才查询一次 get_chat_member 并记录结果
+    can_delete = permission_table.get(chat.id)
+    bot_member = None
+    if can_delete is None or permission_table.stale([chat.id], permission_config.get("max_age_seconds", 21600)):
+        bot_member = await context.bot.get_chat_member(chat.id, context.bot.id)
+        can_delete = member_can_delete(bot_member)
+        record_permission(chat.id, can_delete)
+    if not can_delete:
+        if bot_member is not None and is_admin_member(bot_member):
             await update.message.reply_text("Please ensure I have permission to delete messages!")
-            return
-    else:
-        await update.message.reply_text("Please make me an admin with delete permissions to operate properly.")
+        else:
+            await update.message.reply_text("Please make me an admin with delete permissions to operate properly.")
         return
     
     # 添加到监控列表
-    monitored_groups[chat.id] = {
-        "name": chat.title
-    }
+    # 保留该群组已有的设置（如删除时间）
+    info = monitored_groups.setdefault(chat.id, {})
+    info["name"] = chat.title
+    # 沿用权限表中的确认时间，不把缓存的结果当作刚确认过
+    info["bot_can_delete"] = True
+    info["permission_checked_at"] = permission_table.checked_at(chat.id)
     save_monitored_groups()
     await update.message.reply_text("Reaction monitoring enabled for this group.")
 
@@ -224,17 +507,22 @@ async def stop_monitor(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     if chat.id in monitored_groups:
         del monitored_groups[chat.id]
         save_monitored_groups()
+        deletion_scheduler.remove(chat.id)
+        rearm_deletion_timer(context.job_queue)
         await update.message.reply_text("Stopped reaction monitoring for this group.")
     else:
         await update.message.reply_text("This group is not currently being monitored.")
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /status command and show group status"""
-    import pytz
     from datetime import datetime as dt
     chat = update.effective_chat
-    now = dt.now(pytz.timezone("Asia/Shanghai")).strftime("%Y-%m-%d %H:%M:%S")
-    deletion_count = len([item for item in deletion_queue if item['chat_id'] == chat.id])
+    schedule = deletion_scheduler.get(chat.id) or (deletion_time, deletion_timezone)
+    tz = pytz.timezone(schedule[1])
+    now = dt.now(tz).strftime("%Y-%m-%d %H:%M:%S")
+    next_run = dt.fromtimestamp(next_deletion_run(chat.id), tz).strftime("%Y-%m-%d %H:%M")
+    deletion_count = await storage.pending_count(chat.id)
+    cache_stats = verdict_cache.stats()
     
     if chat.id in monitored_groups:
         info = monitored_groups[chat.id]
@@ -244,15 +532,37 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             f"Group ID: <code>{chat.id}</code>\n"
             f"Current Time: <code>{now}</code>\n"
             f"💩 Pending Deletions: <b>{deletion_count}</b> messages\n"
+            f"🧹 Drain Mode: <code>{drain_config.get('mode', 'daily')}</code>\n"
+            f"⏰ Deletion Time: <code>{schedule[0]} {schedule[1]}</code>, next run <code>{next_run}</code>\n"
+            f"🗂 Verdict Cache: <b>{cache_stats['hits']}</b> hits / <b>{cache_stats['misses']}</b> misses / <b>{cache_stats['coalesced']}</b> coalesced "
+            f"({cache_stats['hit_rate']:.0%}), {cache_stats['size']} entries\n"
+            f"🧬 Near-duplicate Hits: <b>{near_dup_index.hits}</b>\n"
+            f"🧠 Local Model: <b>{local_model.hits}</b> hits, {local_model.model.samples} samples\n"
         )
         await update.message.reply_text(msg, parse_mode="HTML")
     else:
         await update.message.reply_text("This group is not currently monitored.")
 
 async def set_deletion_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle /set_deletion_time command to set daily batch deletion time"""
-    if len(context.args) != 1:
-        await update.message.reply_text("Usage: /set_deletion_time HH:MM")
+    """Handle /set_deletion_time command to set daily batch deletion time and timezone
+
+    在被监控的群组中设置该群组自己的计划（`default` 恢复使用全局计划），在其他聊天中设置全局默认计划。
+    """
+    global deletion_time, deletion_timezone
+    chat = update.effective_chat
+    per_group = chat.id in monitored_groups
+    if per_group and context.args == ["default"]:
+        monitored_groups[chat.id].pop("deletion_time", None)
+        monitored_groups[chat.id].pop("timezone", None)
+        save_monitored_groups()
+        deletion_scheduler.remove(chat.id)
+        rearm_deletion_timer(context.job_queue)
+        await update.message.reply_text(
+            f"This group now uses the default deletion time {deletion_time} ({deletion_timezone})."
+        )
+        return
+    if len(context.args) not in (1, 2):
+        await update.message.reply_text("Usage: /set_deletion_time HH:MM [timezone]")
         return
     time_str = context.args[0]
     try:
@@ -260,23 +570,42 @@ async def set_deletion_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
     except ValueError:
         await update.message.reply_text("Invalid time format. Please use HH:MM (24-hour format).")
         return
+    if len(context.args) == 2:
+        tz_name = context.args[1]
+    elif per_group:
+        tz_name = monitored_groups[chat.id].get("timezone", deletion_timezone)
+    else:
+        tz_name = deletion_timezone
+    try:
+        tz = pytz.timezone(tz_name)
+    except pytz.UnknownTimeZoneError:
+        await update.message.reply_text(f"Unknown timezone: {tz_name}. Use an IANA name such as Asia/Shanghai.")
+        return
     
-    global deletion_time, _deletion_job
-    deletion_time = time_str
-    save_deletion_config()
+    if per_group:
+        monitored_groups[chat.id]["deletion_time"] = time_str
+        monitored_groups[chat.id]["timezone"] = tz_name
+        save_monitored_groups()
+        key = chat.id
+    else:
+        deletion_time = time_str
+        deletion_timezone = tz_name
+        save_deletion_config()
+        key = DEFAULT_SCHEDULE
+    next_run = deletion_scheduler.set(key, time_str, tz_name)
+    target = "this group" if per_group else "default"
     
-    # 移除旧任务
-    if _deletion_job:
-        try:
-            _deletion_job.schedule_removal()
-            logger.info(f"[定时任务] 已移除旧定时任务")
-        except Exception as e:
-            logger.warning(f"[定时任务] 移除旧定时任务失败: {e}")
+    if drain_config.get("mode") == "continuous":
+        await update.message.reply_text(
+            f"Daily deletion time ({target}) set to {time_str} {tz_name}. It takes effect when drain mode is "
+            f"switched back to daily (currently continuous)."
+        )
+        return
     
-    # 安排新任务
-    await schedule_next_deletion(context)
+    rearm_deletion_timer(context.job_queue)
     await update.message.reply_text(
-        f"Daily deletion time set to {deletion_time}. Next run at {get_next_run_time(deletion_time).strftime('%Y-%m-%d %H:%M:%S')}"
+        f"Daily deletion time ({target}) set to {time_str} {tz_name}. "
+        f"Next run at {next_run.astimezone(tz).strftime('%Y-%m-%d %H:%M:%S %Z')}"
     )
 
 async def handle_reaction(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -300,9 +629,12 @@ async def handle_reaction(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             try:
                 await context.bot.delete_message(
                     chat_id=chat_id,
-                    message_id=reaction.message_id
+                    message_id=reaction.message_id,
+                    rate_limit_args={"priority": PRIORITY_INTERACTIVE}
                 )
                 logger.info(f"Deleted message {reaction.message_id} from group {chat_id} due to 💩 reaction.")
+                storage.log_deletions([(chat_id, reaction.message_id, "deleted", "reaction")])
+                learn_from_reaction(chat_id, reaction.message_id)
             except Exception as e:
                 logger.error(f"Failed to delete message: {e}")
             return
@@ -314,8 +646,8 @@ async def handle_reaction(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             thumbs_down_count += 1
     threshold = 1
     if thumbs_down_count >= threshold:
-        deletion_queue.append({'chat_id': chat_id, 'message_id': reaction.message_id})
-        save_deletion_queue()
+        enqueue_deletion(chat_id, reaction.message_id, "reaction", recent_message_date(chat_id, reaction.message_id))
+        learn_from_reaction(chat_id, reaction.message_id)
         logger.info(f"Queued message {reaction.message_id} from group {chat_id} due to {thumbs_down_count} 👎 reactions.")
 
 async def handle_reaction_count(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -342,15 +674,18 @@ async def handle_reaction_count(update: Update, context: ContextTypes.DEFAULT_TY
     threshold = 3
     
     if thumbs_down_count >= threshold:
+        learn_from_reaction(chat_id, reaction_count.message_id)
         try:
             # 删除原始消息
             await context.bot.delete_message(
                 chat_id=chat_id,
-                message_id=reaction_count.message_id
+                message_id=reaction_count.message_id,
+                rate_limit_args={"priority": PRIORITY_INTERACTIVE}
             )
             logger.info(
                 f"Deleted message {reaction_count.message_id} from group {chat_id} due to {thumbs_down_count} anonymous 👎 reactions"
             )
+            storage.log_deletions([(chat_id, reaction_count.message_id, "deleted", "anonymous_reaction")])
             
             # 可选：发送通知
             await context.bot.send_message(
@@ -372,135 +707,329 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
             text="An error occurred while processing your request. Please try again later."
         )
 
+def record_permission(chat_id: int, can_delete: bool) -> Optional[bool]:
+    """更新权限表并写入群组信息（由调用方保存），返回之前的值"""
+    previous = permission_table.update(chat_id, can_delete)
+    info = monitored_groups.get(chat_id)
+    if info is not None:
+        info["bot_can_delete"] = can_delete
+        info["permission_checked_at"] = permission_table.checked_at(chat_id)
+    return previous
+
+def stop_monitoring_group(chat_id: int, job_queue) -> None:
+    """停止监控并持久化，重启后不会恢复"""
+    if chat_id not in monitored_groups:
+        return
+    del monitored_groups[chat_id]
+    save_monitored_groups()
+    deletion_scheduler.remove(chat_id)
+    rearm_deletion_timer(job_queue)
+    logger.info(f"Removed group {chat_id} from monitoring list")
+
+async def handle_my_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """根据 my_chat_member 更新实时维护权限表，失去删除权限或被移出群组时停止监控"""
+    change = update.my_chat_member
+    if not change:
+        return
+    chat_id = change.chat.id
+    admin_roster.invalidate(chat_id)
+    new_member = change.new_chat_member
+    can_delete = member_can_delete(new_member)
+    previous = record_permission(chat_id, can_delete)
+    if chat_id not in monitored_groups:
+        return
+    if can_delete:
+        # 权限未变化时不重写群组文件，确认时间只更新内存
+        if previous is not True:
+            save_monitored_groups()
+        return
+
+    logger.warning(f"Bot lost delete message permission in group {monitored_groups[chat_id].get('name')} (ID: {chat_id}), previous: {previous}")
+    stop_monitoring_group(chat_id, context.job_queue)
+    # 仍在群组中时才能发送通知
+    if new_member.status in (ChatMember.ADMINISTRATOR, ChatMember.MEMBER, ChatMember.RESTRICTED):
+        try:
+            await context.bot.send_message(
+                chat_id=chat_id,
+                text="I no longer have permission to delete messages. Stopping monitoring for this group.",
+                rate_limit_args={"priority": PRIORITY_BATCH}
+            )
+        except Exception as e:
+            logger.error(f"Failed to notify group {chat_id}: {e}")
+
+@timed_job
+@profiler.job
 async def check_admin_status(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """定期检查机器人在监控的群组中是否仍然具有管理员权限"""
+    """低频对账：只检查长时间没有确认过权限的群组，并发调用数有限"""
     bot = context.bot
-    groups_to_remove = []
-    
+    stale = permission_table.stale(list(monitored_groups), permission_config.get("max_age_seconds", 21600))
+    if not stale:
+        return
+
+    async def check(chat_id: int) -> bool:
+        member = await bot.get_chat_member(chat_id, bot.id, rate_limit_args={"priority": PRIORITY_BATCH})
+        return member_can_delete(member)
+
+    results = await reconcile(stale, check, permission_config.get("concurrency", 5))
+    lost_permission = []
+    left_chat = []
+    for chat_id, result in results.items():
+        if chat_id not in monitored_groups:
+            # 对账期间已被 /stopmonitor 或 my_chat_member 更新移除
+            continue
+        if isinstance(result, Forbidden) or (isinstance(result, BadRequest) and "not found" in str(result).lower()):
+            # 机器人已不在该群组中
+            left_chat.append(chat_id)
+        elif isinstance(result, Exception):
+            # 网络等临时错误不移除群组，下一次对账再检查
+            logger.error(f"Failed to check admin status for group {chat_id}: {result}")
+        else:
+            record_permission(chat_id, result)
+            if not result:
+                logger.warning(f"Bot lost delete message permission in group {monitored_groups.get(chat_id, {}).get('name')} (ID: {chat_id})")
+                lost_permission.append(chat_id)
+    save_monitored_groups()
+
+    for chat_id in lost_permission:
+        try:
+            await bot.send_message(
+                chat_id=chat_id,
+                text="I no longer have permission to delete messages. Stopping monitoring for this group.",
+                rate_limit_args={"priority": PRIORITY_BATCH}
+            )
+        except Exception as e:
+            logger.error(f"Failed to notify group {chat_id}: {e}")
+    for chat_id in left_chat:
+        permission_table.forget(chat_id)
+        stop_monitoring_group(chat_id, context.job_queue)
+    for chat_id in lost_permission:
+        stop_monitoring_group(chat_id, context.job_queue)
+    logger.info(f"[权限对账] Checked {len(stale)} groups, removed {len(lost_permission) + len(left_chat)}")
+
+def build_deletion_schedule() -> None:
+    """按全局默认与各群组的设置重建删除计划"""
+    try:
+        deletion_scheduler.set(DEFAULT_SCHEDULE, deletion_time, deletion_timezone)
+    except Exception as e:
+        logger.error(f"[定时任务] Invalid default deletion schedule {deletion_time} {deletion_timezone}: {e}")
+        deletion_scheduler.set(DEFAULT_SCHEDULE, '00:00', 'Asia/Shanghai')
     for chat_id, info in monitored_groups.items():
+        if "deletion_time" not in info:
+            continue
         try:
-            # 获取机器人在该群组中的成员信息
-            bot_member = await bot.get_chat_member(chat_id, bot.id)
-            
-            # 检查是否有删除消息的权限
-            if not bot_member.can_delete_messages:
-                logger.warning(f"Bot lost delete message permission in group {info['name']} (ID: {chat_id})")
-                groups_to_remove.append(chat_id)
-                
-                # 通知群组
-                await bot.send_message(
-                    chat_id=chat_id,
-                    text="I no longer have permission to delete messages. Stopping monitoring for this group."
-                )
+            deletion_scheduler.set(chat_id, info["deletion_time"], info.get("timezone", deletion_timezone))
+        except Exception as e:
+            logger.error(f"[定时任务] Invalid deletion schedule for group {chat_id}: {e}")
+
+def rearm_deletion_timer(job_queue) -> None:
+    """只为最早到期的计划保留一个 JobQueue 定时器"""
+    global _deletion_job, _deletion_timer_at
+    if drain_config.get("mode") == "continuous":
+        return
+    next_ts = deletion_scheduler.peek()
+    if _deletion_job is not None:
+        if next_ts == _deletion_timer_at:
+            return
+        _deletion_job.schedule_removal()
+        _deletion_job = None
+        _deletion_timer_at = None
+    if next_ts is None:
+        return
+    when = datetime.fromtimestamp(next_ts, timezone.utc)
+    _deletion_job = job_queue.run_once(run_scheduled_deletions, when=when)
+    _deletion_timer_at = next_ts
+    logger.info(f"[定时任务] Next deletion run at {when.strftime('%Y-%m-%d %H:%M:%S')} UTC")
+
+@timed_job
+@profiler.job
+async def run_scheduled_deletions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """删除定时器回调：处理所有到期的群组，然后为下一个计划重新设置定时器"""
+    global _deletion_job, _deletion_timer_at
+    _deletion_job = None
+    _deletion_timer_at = None
+    try:
+        due = deletion_scheduler.pop_due()
+        if due:
+            scheduled = set(due)
+            # 默认计划负责所有没有单独设置的群组
+            include_default = DEFAULT_SCHEDULE in scheduled
+            await process_deletion_queue(
+                context,
+                lambda chat_id: chat_id in scheduled or (include_default and chat_id not in deletion_scheduler)
+            )
+    finally:
+        rearm_deletion_timer(context.job_queue)
+
+def next_deletion_run(chat_id: int) -> float:
+    """该群组下一次定时删除的时间戳；持续删除模式下为当前时间"""
+    now = time.time()
+    if drain_config.get("mode") == "continuous":
+        return now
+    key = chat_id if chat_id in deletion_scheduler else DEFAULT_SCHEDULE
+    next_ts = deletion_scheduler.next_run(key)
+    return max(now, next_ts) if next_ts else now
+
+# deleteMessages 单次最多删除 100 条消息
+BULK_DELETE_LIMIT = 100
+
+async def delete_messages_bulk(bot, chat_id: int, message_ids: List[int]) -> tuple:
+    """按 100 条一组调用 deleteMessages，整组失败时退回逐条删除，返回 (成功数, 失败数)"""
+    deleted = 0
+    failed = 0
+    for start in range(0, len(message_ids), BULK_DELETE_LIMIT):
+        chunk = message_ids[start:start + BULK_DELETE_LIMIT]
+        try:
+            await bot.delete_messages(
+                chat_id=chat_id, message_ids=chunk, rate_limit_args={"priority": PRIORITY_BATCH}
+            )
+            deleted += len(chunk)
+            storage.log_deletions([(chat_id, message_id, "deleted", "batch") for message_id in chunk])
+            logger.info(f"[定时任务] Bulk deleted {len(chunk)} messages from group {chat_id}")
+            continue
         except Exception as e:
-            logger.error(f"Failed to check admin status for group {chat_id}: {e}")
-            groups_to_remove.append(chat_id)
-    
-    # 从监控列表中移除没有权限的群组
-    for chat_id in groups_to_remove:
-        if chat_id in monitored_groups:
-            del monitored_groups[chat_id]
-            logger.info(f"Removed group {chat_id} from monitoring list")
-
-def get_next_run_time(time_str):
-    """计算下一次运行的时间"""
-    import pytz
-    from datetime import datetime, timedelta
-    
-    # 当前时间（东八区）
-    tz = pytz.timezone('Asia/Shanghai')
-    now = datetime.now(tz)
-    
-    # 解析目标时间
-    hour, minute = map(int, time_str.split(':'))
-    target_time = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
-    
-    # 如果目标时间已过，则设置为明天同一时间
-    if target_time <= now:
-        target_time += timedelta(days=1)
-    
-    logger.info(f"[定时任务] Next run time set to: {target_time.strftime('%Y-%m-%d %H:%M:%S')}")
-    return target_time
-
-async def schedule_next_deletion(context):
-    """安排下一次删除任务"""
-    global _deletion_job
-    next_run_time = get_next_run_time(deletion_time)
-    _deletion_job = context.job_queue.run_once(
-        process_deletion_queue_wrapper,
-        when=next_run_time
+            logger.warning(f"[定时任务] Bulk delete failed for group {chat_id} ({len(chunk)} messages), falling back to single deletes: {e}")
+        # 逐条删除的节奏由 PriorityRateLimiter 的每聊天令牌桶控制
+        for message_id in chunk:
+            try:
+                await bot.delete_message(
+                    chat_id=chat_id, message_id=message_id, rate_limit_args={"priority": PRIORITY_BATCH}
+                )
+                deleted += 1
+                storage.log_deletions([(chat_id, message_id, "deleted", "batch")])
+            except Exception as e:
+                logger.error(f"[定时任务] Failed to delete message: chat_id={chat_id} message_id={message_id} error: {e}")
+                failed += 1
+                storage.log_deletions([(chat_id, message_id, "failed", "batch")])
+    return deleted, failed
+
+async def expire_deletion_queue() -> int:
+    """移出已超过 48 小时删除期限的消息（不调用 API），返回移出的条数"""
+    expired = await storage.pending_older_than(deletion_cutoff())
+    keys = [(chat_id, message_id) for chat_id, message_ids in expired.items() for message_id in message_ids]
+    if keys:
+        storage.remove_pending(keys)
+        storage.log_deletions([(chat_id, message_id, "expired", "deadline") for chat_id, message_id in keys])
+        logger.info(f"[定时任务] Dropped {len(keys)} queued messages past the 48h delete window")
+    return len(keys)
+
+@timed_job
+@profiler.job
+async def drain_expiring_deletions(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """提前删除在下一次定时删除之前就会超过删除期限的消息"""
+    await expire_deletion_queue()
+    # 多留一个检查周期的余量，避免消息恰好在两次检查之间过期
+    slack = expiry_config.get("safety_margin_seconds", 600) + expiry_config.get("early_drain_interval_seconds", 900)
+    # 下一次运行最晚在 25 小时后（含夏令时），先取出所有可能需要提前删除的群组
+    candidates = await storage.pending_older_than(time.time() + 25 * 3600 - DELETE_WINDOW_SECONDS + slack)
+    by_run: Dict[float, List[int]] = {}
+    for chat_id in candidates:
+        by_run.setdefault(next_deletion_run(chat_id), []).append(chat_id)
+    due: Dict[int, List[int]] = {}
+    for next_run_ts, chat_ids in by_run.items():
+        older = await storage.pending_older_than(next_run_ts - DELETE_WINDOW_SECONDS + slack)
+        for chat_id in chat_ids:
+            if chat_id in older:
+                due[chat_id] = older[chat_id]
+    if not due:
+        return
+    for chat_id, message_ids in due.items():
+        deleted, failed = await delete_messages_bulk(context.bot, chat_id, message_ids)
+        logger.info(f"[定时任务] Early drain for group {chat_id}: deleted {deleted}, failed {failed}")
+    storage.remove_pending(
+        (chat_id, message_id) for chat_id, message_ids in due.items() for message_id in message_ids
     )
-    logger.info(f"[定时任务] Scheduled next deletion task for {next_run_time.strftime('%Y-%m-%d %H:%M:%S')}")
-
-async def process_deletion_queue_wrapper(context):
-    """删除任务的包装器，执行完成后自动调度下一次任务"""
-    await process_deletion_queue(context)
-    await schedule_next_deletion(context)
-
-async def process_deletion_queue(context: ContextTypes.DEFAULT_TYPE) -> None:
-    global deletion_queue
-    # 过滤无效 entry
-    valid_entries = [
-        entry for entry in deletion_queue
-        if isinstance(entry, dict) and 'chat_id' in entry and 'message_id' in entry
-    ]
-    if len(valid_entries) < len(deletion_queue):
-        logger.warning(f"Found invalid entries in deletion_queue, will ignore them. Total: {len(deletion_queue)}, valid: {len(valid_entries)}")
-    deletion_queue = valid_entries
-    """批量删除待处理队列中的消息"""
+
+def in_quiet_hours(now: datetime, quiet_hours: str) -> bool:
+    """quiet_hours 形如 "23:00-07:00"，可跨午夜；为空表示没有静默时段"""
+    if not quiet_hours:
+        return False
+    start_str, end_str = quiet_hours.split("-")
+    start = datetime.strptime(start_str.strip(), "%H:%M").time()
+    end = datetime.strptime(end_str.strip(), "%H:%M").time()
+    current = now.time()
+    if start <= end:
+        return start <= current < end
+    return current >= start or current < end
+
+@timed_job
+@profiler.job
+async def continuous_drain(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """持续模式：每个周期在速率预算内删除队列中的消息，超过最大存留时间的优先"""
+    await expire_deletion_queue()
+    budget = max(1, int(drain_config.get("messages_per_minute", 60) * drain_config.get("interval_seconds", 30) / 60))
+    try:
+        now = datetime.now(pytz.timezone(drain_config.get("timezone", "Asia/Shanghai")))
+        quiet = in_quiet_hours(now, drain_config.get("quiet_hours", ""))
+    except Exception as e:
+        logger.warning(f"[持续删除] quiet_hours 配置无效，忽略: {e}")
+        quiet = False
+
+    # 超过最大存留时间的消息优先，静默时段只删除这部分
+    # 两部分都按群组轮流取，入队很快的群组不会占满预算
+    overdue = await storage.pending_older_than(time.time() - drain_config.get("max_age_seconds", 21600))
+    pending = [] if quiet else [(entry['chat_id'], entry['message_id']) for entry in await storage.select_pending(limit=budget)]
+    due = select_drain_batch(overdue, pending, budget)
+    taken = [(chat_id, message_id) for chat_id, message_ids in due.items() for message_id in message_ids]
+    count = len(taken)
+    if not count:
+        return
+
+    for chat_id, message_ids in due.items():
+        deleted, failed = await delete_messages_bulk(context.bot, chat_id, message_ids)
+        logger.debug(f"[持续删除] Group {chat_id}: deleted {deleted}, failed {failed}")
+    storage.remove_pending(taken)
+    logger.info(f"[持续删除] Drained {count} messages{' (quiet hours, overdue only)' if quiet else ''}")
+
+async def process_deletion_queue(context: ContextTypes.DEFAULT_TYPE, chat_filter=None) -> None:
+    """批量删除待处理队列中的消息，chat_filter 用于只处理到期的群组"""
     bot = context.bot
+    # 已无法删除的消息直接移出队列，不再逐条调用 API
+    await expire_deletion_queue()
+    # 队列已按群组分桶并去重
+    messages_by_chat = await storage.pending_by_chat()
+    if chat_filter is not None:
+        messages_by_chat = {chat_id: ids for chat_id, ids in messages_by_chat.items() if chat_filter(chat_id)}
+    queue_length = sum(len(message_ids) for message_ids in messages_by_chat.values())
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    logger.info("[定时任务] Running batch deletion task, current time: %s, queue length: %d", current_time, len(deletion_queue))
-    failed: List[Dict[str, Any]] = []
-    
-    # 收集需要发送通知的群组
-    chat_ids = set()
-    for entry in deletion_queue:
-        chat_ids.add(entry['chat_id'])
+    logger.info("[定时任务] Running batch deletion task, current time: %s, queue length: %d", current_time, queue_length)
     
-    if not deletion_queue:
+    if not messages_by_chat:
         logger.info("[定时任务] No messages to delete, skipping.")
         return
     
     # 开始时发送通知
-    for chat_id in chat_ids:
+    for chat_id, message_ids in messages_by_chat.items():
         if chat_id in monitored_groups:  # 只向被监控的群组发送通知
             try:
-                count = len([item for item in deletion_queue if item['chat_id'] == chat_id])
                 await bot.send_message(
                     chat_id=chat_id,
-                    text=f"Starting batch deletion of {count} messages..."
+                    text=f"Starting batch deletion of {len(message_ids)} messages...",
+                    rate_limit_args={"priority": PRIORITY_BATCH}
                 )
             except Exception as e:
                 logger.error(f"[定时任务] Failed to send start notification: {e}")
     
-    # 执行删除
-    deleted_count = 0
-    successful_deletions = []
-    for entry in deletion_queue:
-        try:
-            await bot.delete_message(chat_id=entry['chat_id'], message_id=entry['message_id'])
-            logger.info(f"[定时任务] Deleted message {entry['message_id']} from group {entry['chat_id']}")
-            deleted_count += 1
-            successful_deletions.append(entry)
-            await asyncio.sleep(1)
-        except Exception as e:
-            logger.error(f"[定时任务] Failed to delete message: chat_id={entry['chat_id']} message_id={entry['message_id']} error: {e}")
-            failed.append(entry)
+    # 执行删除：每个群组使用 deleteMessages 批量删除
+    results: Dict[int, Dict[str, int]] = {}
+    for chat_id, message_ids in messages_by_chat.items():
+        deleted, failed = await delete_messages_bulk(bot, chat_id, message_ids)
+        results[chat_id] = {"deleted": deleted, "failed": failed}
+        logger.info(f"[定时任务] Group {chat_id}: deleted {deleted}, failed {failed}")
     
-    # 更新队列 - 清除所有消息，不保留失败的消息
-    deletion_queue = []
-    save_deletion_queue()
-    logger.info("[定时任务] Batch deletion task completed, all messages cleared from queue")
+    # 更新队列 - 清除本次处理的所有消息，不保留失败的消息；删除过程中新入队的消息留到下一次处理
+    storage.remove_pending(
+        (chat_id, message_id) for chat_id, message_ids in messages_by_chat.items() for message_id in message_ids
+    )
+    logger.info("[定时任务] Batch deletion task completed, processed messages cleared from queue")
     
     # 完成时发送通知
-    for chat_id in chat_ids:
+    for chat_id, counts in results.items():
         if chat_id in monitored_groups:  # 只向被监控的群组发送通知
             try:
-                failed_count = len([item for item in failed if item['chat_id'] == chat_id])
                 await bot.send_message(
                     chat_id=chat_id,
-                    text=f"Batch deletion completed! Deleted {deleted_count} messages, failed to delete {failed_count} messages."
+                    text=f"Batch deletion completed! Deleted {counts['deleted']} messages, failed to delete {counts['failed']} messages.",
+                    rate_limit_args={"priority": PRIORITY_BATCH}
                 )
             except Exception as e:
                 logger.error(f"[定时任务] Failed to send completion notification: {e}")
@@ -511,9 +1040,7 @@ async def set_classification_prompt(update: Update, context: ContextTypes.DEFAUL
     if chat.type not in [Chat.GROUP, Chat.SUPERGROUP]:
         await update.message.reply_text("This command can only be used in groups.")
         return
-    from telegram import ChatMemberAdministrator, ChatMemberOwner
-    user_member = await context.bot.get_chat_member(chat.id, update.effective_user.id)
-    if not isinstance(user_member, (ChatMemberAdministrator, ChatMemberOwner)):
+    if not await is_chat_admin(context, chat.id, update.effective_user.id):
         await update.message.reply_text("Only group admins can set classification prompt.")
         return
     if not context.args:
@@ -522,55 +1049,171 @@ async def set_classification_prompt(update: Update, context: ContextTypes.DEFAUL
     global classification_prompt
     classification_prompt = ' '.join(context.args)
     save_deletion_config()
+    verdict_cache.clear()
+    near_dup_index.clear()
     await update.message.reply_text("Classification prompt updated.")
 
+async def request_llm_verdict(text: str) -> str:
+    """向 LLM 请求单条消息的结论，启用微批处理时合并发送"""
+    if batch_config.get("enabled"):
+        return await classification_batcher.classify(llm_config, classification_prompt, text)
+    system_msg = single_system_prompt(classification_prompt)
+    classify_logger.debug("[LLM分类] prompt: %s", system_msg)
+    response = await llm_client.complete(llm_config, system_msg, text)
+    classify_logger.debug("[LLM分类] raw response: %s", response)
+    return normalize_decision(response)
+
+async def get_verdict(chat_id: int, text: str) -> str:
+    """依次经过近似重复索引、结论缓存和 LLM，返回 DELETE 或 KEEP"""
+    async def compute() -> str:
+        if near_dup_config.get("enabled"):
+            distance = near_dup_index.find(chat_id, text)
+            if distance is not None:
+                classify_logger.info("[LLM分类] near-duplicate of recent DELETE (distance=%d), skip LLM", distance)
+                return "DELETE"
+        if local_model_config.get("enabled"):
+            label = local_model.predict(
+                text,
+                min_margin=local_model_config.get("min_margin", 1.0),
+                min_samples=local_model_config.get("min_samples", 200)
+            )
+            if label is not None:
+                classify_logger.info("[本地模型] confident %s, skip LLM", label)
+                return label
+        decision = await request_llm_verdict(text)
+        local_model.learn(text, decision, source="llm")
+        # 只记录 LLM 给出的结论，避免近似匹配链式漂移
+        if decision == "DELETE" and near_dup_config.get("enabled"):
+            near_dup_index.add(chat_id, text)
+        return decision
+
+    if cache_config.get("enabled"):
+        fingerprint = config_fingerprint(classification_prompt, llm_config.get("model", ""), llm_config.get("base_url", ""))
+        return await verdict_cache.get_or_compute(text, fingerprint, compute)
+    return await compute()
+
 async def classify_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Classify each message via LLM and flag for deletion if needed"""
+    """Classify each message via local rules and LLM, flag for deletion if needed"""
     message = update.message
     chat = message.chat
-    if chat.id not in monitored_groups or not classification_prompt or not message.text:
+    if chat.id not in monitored_groups or not message.text:
         return
+    message_date = int(message.date.timestamp()) if message.date else 0
+    remember_message(chat.id, message.message_id, message.text, message_date)
     try:
-        # 动态设置 openai 配置
-        openai.api_key = llm_config.get("api_key", "")
-        openai.api_base = llm_config.get("base_url", "https://api.openai.com/v1")
-        model = llm_config.get("model", "gpt-4o-mini")
-        system_msg = f"{classification_prompt}\n\n请只回答 'DELETE' 或 'KEEP'。"
-        logger.info(f"[LLM分类] prompt: {system_msg}")
-        logger.info(f"[LLM分类] user message: {message.text}")
-        response = openai.ChatCompletion.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_msg},
-                {"role": "user", "content": message.text}
-            ],
-            temperature=0
-        )
-        logger.info(f"[LLM分类] raw response: {response}")
-        decision = response.choices[0].message.content.strip().upper()
-        logger.info(f"[LLM分类] decision: {decision}")
+        # 本地规则优先，只有 UNSURE 才交给 LLM
+        decision, matched = rule_engine.match(chat.id, message.text)
+        if decision != UNSURE:
+            classify_logger.info("[规则引擎] %s by rule %r: message %d in %d", decision, matched, message.message_id, chat.id)
+        elif not classification_prompt:
+            return
+        else:
+            classify_logger.debug("[LLM分类] user message: %s", message.text)
+            decision = await get_verdict(chat.id, message.text)
+            classify_logger.info("[LLM分类] %s: message %d in %d", decision, message.message_id, chat.id)
         if decision.startswith("DELETE"):
-            deletion_queue.append({'chat_id': chat.id, 'message_id': message.message_id})
-            save_deletion_queue()
-            # 1. 使用 Telegram setMessageReaction API 添加 reaction
-            import os
-            import httpx
-            BOT_TOKEN = os.getenv("BOT_TOKEN")
-            reaction_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setMessageReaction"
-            payload = {
-                "chat_id": chat.id,
-                "message_id": message.message_id,
-                "reaction": [{"type": "emoji", "emoji": "🙈"}]
-            }
-            try:
-                async with httpx.AsyncClient() as client:
-                    resp = await client.post(reaction_url, json=payload)
-                    logger.info(f"[LLM分类] setMessageReaction response: {resp.text}")
-            except Exception as e:
-                logger.warning(f"[LLM分类] setMessageReaction API 调用失败: {e}")
+            enqueue_deletion(chat.id, message.message_id, "rule" if matched else "classifier", message_date)
+            # 添加标记反应：交给群组的后台队列发送，不占用该群组的处理顺序
+            if reaction_config.get("enabled", True):
+                await reaction_marker.mark(context.bot, chat.id, message.message_id)
     except Exception as e:
         logger.error(f"[LLM分类] Failed to classify message: {e}")
 
+async def retrain_model_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /retrain_model command to retrain the local classifier from recorded samples"""
+    chat = update.effective_chat
+    if chat.type not in [Chat.GROUP, Chat.SUPERGROUP]:
+        await update.message.reply_text("This command can only be used in groups.")
+        return
+    if not await is_chat_admin(context, chat.id, update.effective_user.id):
+        await update.message.reply_text("Only group admins can retrain the local model.")
+        return
+    await update.message.reply_text("Retraining local model...")
+    try:
+        # 训练为 CPU 密集型操作，放到线程中避免阻塞事件循环
+        count = await asyncio.to_thread(local_model.retrain)
+        await asyncio.to_thread(local_model.write_snapshot)
+    except Exception as e:
+        logger.error(f"[本地模型] 离线重训失败: {e}")
+        await update.message.reply_text("Failed to retrain local model.")
+        return
+    await update.message.reply_text(f"Local model retrained on {count} samples.")
+
+async def is_chat_admin(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int) -> bool:
+    """检查用户是否为群组管理员（查管理员名单缓存，过期或失效时才调用 get_chat_administrators）"""
+    return await admin_roster.is_admin(chat_id, user_id, context.bot.get_chat_administrators)
+
+async def handle_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """成员的管理员身份变化时使该群组的管理员名单缓存失效"""
+    change = update.chat_member
+    if not change:
+        return
+    if is_admin_member(change.old_chat_member) or is_admin_member(change.new_chat_member):
+        admin_roster.invalidate(change.chat.id)
+
+def _parse_rule_args(args: List[str]):
+    """解析 <delete|keep> <keyword|regex> <pattern...>，格式错误时返回 None"""
+    if len(args) < 3 or args[0].lower() not in RULE_ACTIONS or args[1].lower() not in RULE_KINDS:
+        return None
+    return args[0].lower(), args[1].lower(), ' '.join(args[2:])
+
+async def add_rule_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /add_rule command to add a local prefilter rule"""
+    chat = update.effective_chat
+    if chat.type not in [Chat.GROUP, Chat.SUPERGROUP]:
+        await update.message.reply_text("This command can only be used in groups.")
+        return
+    if not await is_chat_admin(context, chat.id, update.effective_user.id):
+        await update.message.reply_text("Only group admins can manage rules.")
+        return
+    parsed = _parse_rule_args(context.args)
+    if parsed is None:
+        await update.message.reply_text("Usage: /add_rule <delete|keep> <keyword|regex> <pattern>")
+        return
+    action, kind, pattern = parsed
+    try:
+        added = rule_engine.add_rule(chat.id, action, kind, pattern)
+    except re.error as e:
+        await update.message.reply_text(f"Invalid regex: {e}")
+        return
+    if not added:
+        await update.message.reply_text("Rule already exists.")
+        return
+    rule_engine.save()
+    await update.message.reply_text(f"Added {action} {kind} rule: {pattern}")
+
+async def remove_rule_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /remove_rule command to remove a local prefilter rule"""
+    chat = update.effective_chat
+    if chat.type not in [Chat.GROUP, Chat.SUPERGROUP]:
+        await update.message.reply_text("This command can only be used in groups.")
+        return
+    if not await is_chat_admin(context, chat.id, update.effective_user.id):
+        await update.message.reply_text("Only group admins can manage rules.")
+        return
+    parsed = _parse_rule_args(context.args)
+    if parsed is None:
+        await update.message.reply_text("Usage: /remove_rule <delete|keep> <keyword|regex> <pattern>")
+        return
+    action, kind, pattern = parsed
+    if not rule_engine.remove_rule(chat.id, action, kind, pattern):
+        await update.message.reply_text("Rule not found.")
+        return
+    rule_engine.save()
+    await update.message.reply_text(f"Removed {action} {kind} rule: {pattern}")
+
+async def list_rules_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /list_rules command to show local prefilter rules of current group"""
+    chat = update.effective_chat
+    rules = rule_engine.list_rules(chat.id)
+    lines = ["<b>Local Prefilter Rules</b>"]
+    for kind in RULE_KINDS:
+        for action in RULE_ACTIONS:
+            patterns = rules[kind][action]
+            lines.append(f"{action} {kind} ({len(patterns)}):")
+            lines.extend(f"  • <code>{escape(p)}</code>" for p in patterns)
+    await update.message.reply_text("\n".join(lines), parse_mode="HTML")
+
 async def llm_config_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """管理员设置 LLM 配置 (base_url, model, apikey)"""
     chat = update.effective_chat
@@ -578,9 +1221,7 @@ async def llm_config_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if chat.type not in [Chat.GROUP, Chat.SUPERGROUP]:
         await update.message.reply_text("This command can only be used in groups.")
         return
-    from telegram import ChatMemberAdministrator, ChatMemberOwner
-    user_member = await context.bot.get_chat_member(chat.id, user.id)
-    if not isinstance(user_member, (ChatMemberAdministrator, ChatMemberOwner)):
+    if not await is_chat_admin(context, chat.id, user.id):
         await update.message.reply_text("Only group admins can set LLM config.")
         return
     if len(context.args) != 3:
@@ -589,18 +1230,234 @@ async def llm_config_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
             "Example: /llm_config https://api.groq.com/openai/v1 llama3-70b-8192 YOUR_API_KEY"
         )
         return
-    global llm_config
     llm_config["base_url"] = context.args[0]
     llm_config["model"] = context.args[1]
     llm_config["api_key"] = context.args[2]
     save_deletion_config()
+    verdict_cache.clear()
+    near_dup_index.clear()
     await update.message.reply_text(
         f"LLM 配置已更新:\nBase URL: {llm_config['base_url']}\nModel: {llm_config['model']}\nAPI Key: {'*' * len(llm_config['api_key']) if llm_config['api_key'] else '(empty)'}"
     )
 
-if __name__ == "__main__":
-    # 创建应用程序
-    application = Application.builder().token(TOKEN).build()
+async def collect_queue_metrics() -> None:
+    """抓取指标前刷新各群组的删除队列深度与最早消息的等待时间"""
+    summary = await storage.pending_summary()
+    now = time.time()
+    QUEUE_DEPTH.clear()
+    QUEUE_OLDEST_AGE.clear()
+    for chat_id, (count, oldest) in summary.items():
+        QUEUE_DEPTH.labels(chat_id).set(count)
+        if oldest:
+            QUEUE_OLDEST_AGE.labels(chat_id).set(now - oldest)
+
+REGISTRY.add_collector(collect_queue_metrics)
+
+def _ms(seconds: float) -> str:
+    return f"{seconds * 1000:.0f}ms"
+
+def format_perf_report() -> str:
+    """/perf 的摘要：各分类的次数、p50/p99（按直方图桶插值估计）与错误数"""
+    lines = ["<b>Performance Summary</b>", "", "<b>Handlers</b> (by total time)"]
+    handlers = sorted(HANDLER_DURATION.items(), key=lambda item: item[1].sum, reverse=True)
+    for (name,), hist in handlers[:8]:
+        errors = HANDLER_ERRORS.labels(name).value
+        lines.append(
+            f"  • <code>{name}</code>: {hist.count} calls, p50 {_ms(hist.quantile(0.5))}, "
+            f"p99 {_ms(hist.quantile(0.99))}, {errors:.0f} errors"
+        )
+    if not handlers:
+        lines.append("  (no calls yet)")
+
+    llm_ok = LLM_DURATION.labels("ok")
+    lines += [
+        "", "<b>LLM</b>",
+        f"  • {llm_ok.count} ok, {LLM_ERRORS.total():.0f} failed, p50 {_ms(llm_ok.quantile(0.5))}, "
+        f"p99 {_ms(llm_ok.quantile(0.99))}",
+        f"  • Tokens: {LLM_TOKENS.labels('prompt').value:.0f} prompt / {LLM_TOKENS.labels('completion').value:.0f} completion"
+    ]
+
+    api = BOT_API_DURATION.merged()
+    wait = BOT_API_WAIT.merged()
+    lines += [
+        "", "<b>Bot API</b>",
+        f"  • {api.count} calls, p50 {_ms(api.quantile(0.5))}, p99 {_ms(api.quantile(0.99))}, "
+        f"{BOT_API_ERRORS.total():.0f} errors, {BOT_API_RETRY_AFTER.total():.0f} RetryAfter",
+        f"  • Rate limiter wait p99 {_ms(wait.quantile(0.99))}"
+    ]
+    endpoints = sorted(BOT_API_DURATION.items(), key=lambda item: item[1].count, reverse=True)
+    for (endpoint,), hist in endpoints[:5]:
+        lines.append(f"  • <code>{endpoint}</code>: {hist.count} calls, p99 {_ms(hist.quantile(0.99))}")
+
+    depths = QUEUE_DEPTH.items()
+    ages = [gauge.value for _, gauge in QUEUE_OLDEST_AGE.items()]
+    lines += [
+        "", "<b>Deletion Queue</b>",
+        f"  • {sum(gauge.value for _, gauge in depths):.0f} pending in {len(depths)} groups, "
+        f"oldest {max(ages, default=0) / 3600:.1f}h"
+    ]
+
+    lines += ["", "<b>Jobs</b>"]
+    for (name,), hist in sorted(JOB_DURATION.items()):
+        lines.append(
+            f"  • <code>{name}</code>: {hist.count} runs, avg {_ms(hist.sum / hist.count if hist.count else 0)}, "
+            f"{JOB_ERRORS.labels(name).value:.0f} errors"
+        )
+    return "\n".join(lines)
+
+async def perf_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /perf command to summarize runtime metrics (admin only)"""
+    chat = update.effective_chat
+    if chat.type not in [Chat.GROUP, Chat.SUPERGROUP]:
+        await update.message.reply_text("This command can only be used in groups.")
+        return
+    if not await is_chat_admin(context, chat.id, update.effective_user.id):
+        await update.message.reply_text("Only group admins can view performance metrics.")
+        return
+    await REGISTRY.collect()
+    await update.message.reply_text(format_perf_report(), parse_mode="HTML")
+
+def format_profile_report(report: Dict[str, Any]) -> str:
+    """剖析结果摘要：按墙钟时间排序的处理器与定时任务，以及输出文件名"""
+    lines = [
+        f"<b>Profile finished</b> ({report['mode']}, {report['seconds']:.0f}s, {report['samples']} samples)",
+        "<pre>" + escape("\n".join(format_timings(report["timings"])) or "(no handler or job calls)") + "</pre>",
+        "Files in logs: " + ", ".join(f"<code>{escape(os.path.basename(path))}</code>" for path in report["files"])
+    ]
+    return "\n".join(lines)
+
+def start_profiling(job_queue, seconds: int, mode: str, chat_id: Optional[int] = None) -> None:
+    """开始固定时长的剖析，结束后把摘要发到 chat_id（为空时只写日志）"""
+    global _profile_job
+    profiler.start(mode)
+    _profile_job = job_queue.run_once(finish_profiling, when=seconds, data=chat_id, name="profile")
+
+async def finish_profiling(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """剖析窗口结束：写出结果并通知发起的群组"""
+    global _profile_job
+    _profile_job = None
+    if not profiler.active:
+        return
+    report = await profiler.stop()
+    for line in format_timings(report["timings"]):
+        logger.info(f"[剖析] {line}")
+    chat_id = context.job.data if context.job else None
+    if chat_id is not None:
+        try:
+            await context.bot.send_message(chat_id, format_profile_report(report), parse_mode="HTML")
+        except Exception as e:
+            logger.error(f"[剖析] Failed to send profile report: {e}")
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle /profile [seconds] [sample|cprofile] | /profile stop (admin only)"""
+    global _profile_job
+    chat = update.effective_chat
+    if chat.type not in [Chat.GROUP, Chat.SUPERGROUP]:
+        await update.message.reply_text("This command can only be used in groups.")
+        return
+    if not await is_chat_admin(context, chat.id, update.effective_user.id):
+        await update.message.reply_text("Only group admins can run the profiler.")
+        return
+    args = context.args or []
+    if args[:1] == ["stop"]:
+        if not profiler.active:
+            await update.message.reply_text("No profiling session is running.")
+            return
+        if _profile_job is not None:
+            _profile_job.schedule_removal()
+            _profile_job = None
+        report = await profiler.stop()
+        await update.message.reply_text(format_profile_report(report), parse_mode="HTML")
+        return
+    try:
+        seconds = int(args[0]) if args else 60
+        mode = args[1].lower() if len(args) > 1 else PROFILE_MODE
+        if not 1 <= seconds <= 600 or mode not in PROFILE_MODES:
+            raise ValueError
+    except ValueError:
+        await update.message.reply_text(
+            "Usage: /profile [seconds 1-600] [sample|cprofile]\n/profile stop - finish the running session now"
+        )
+        return
+    if profiler.active:
+        await update.message.reply_text("A profiling session is already running.")
+        return
+    start_profiling(context.job_queue, seconds, mode, chat.id)
+    await update.message.reply_text(f"Profiling for {seconds}s ({mode}), the report will be posted here.")
+
+async def start_background_services(application: Application) -> None:
+    """启动指标服务器，按 PROFILE_ON_START 开始剖析"""
+    if metrics_server is not None:
+        await metrics_server.start()
+    if PROFILE_ON_START > 0:
+        start_profiling(application.job_queue, PROFILE_ON_START, PROFILE_MODE)
+
+async def shutdown_resources(application: Application) -> None:
+    """应用关闭时释放共享资源"""
+    if profiler.active:
+        # 关闭前仍写出已采集的结果
+        await profiler.stop()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await llm_client.close()
+    await reaction_marker.close()
+    if update_recorder is not None:
+        update_recorder.close()
+    verdict_cache.save()
+    local_model.save()
+    await storage.flush()
+    storage.close()
+
+async def record_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """在所有处理器之前录制更新"""
+    update_recorder.record(update)
+
+@timed_job
+@profiler.job
+async def save_verdict_cache(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """定期持久化结论缓存"""
+    verdict_cache.save()
+
+@timed_job
+@profiler.job
+async def flush_storage(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """定期落盘：JSON 后端批量 fsync 删除日志，SQLite 后端等待写线程提交"""
+    await storage.flush()
+
+@timed_job
+@profiler.job
+async def save_local_model(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """定期保存本地模型快照与训练样本：事件循环上只复制模型，序列化与写文件在线程中进行"""
+    await asyncio.to_thread(local_model.write_snapshot)
+
+def build_application(base_url: Optional[str] = None) -> Application:
+    """创建 Application 并注册处理器与定时任务；base_url 用于指向其他 Bot API 服务（如压测用的假服务器）"""
+    # 所有出站 Bot API 请求统一经过限流器
+    rate_limiter = PriorityRateLimiter(
+        overall_per_second=rate_limit_config.get("overall_per_second", 30),
+        chat_per_second=rate_limit_config.get("chat_per_second", 1),
+        chat_burst=rate_limit_config.get("chat_burst", 3),
+        group_messages_per_minute=rate_limit_config.get("group_messages_per_minute", 20),
+        max_retries=rate_limit_config.get("max_retries", 3)
+    )
+    update_processor = PerChatUpdateProcessor(max_workers=UPDATE_WORKERS, max_backlog=UPDATE_MAX_BACKLOG)
+    builder = Application.builder().token(TOKEN)
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = (
+        builder
+        .rate_limiter(rate_limiter)
+        .concurrent_updates(update_processor)
+        # 积压达到 UPDATE_MAX_BACKLOG 时轮询暂停，直到有更新处理完
+        .update_queue(BacklogQueue(update_processor))
+        .post_init(start_background_services)
+        .post_shutdown(shutdown_resources)
+        .build()
+    )
+    
+    # 更新录制（group=-1，先于其他处理器运行且不影响它们）
+    if update_recorder is not None:
+        application.add_handler(TypeHandler(Update, record_update), group=-1)
     
     # 添加处理器
     application.add_handler(CommandHandler("start", start))
@@ -610,6 +1467,8 @@ if __name__ == "__main__":
     application.add_handler(CommandHandler("status", status))
     application.add_handler(CommandHandler("set_deletion_time", set_deletion_time))
     application.add_handler(CommandHandler("llm_config", llm_config_command))
+    application.add_handler(CommandHandler("perf", perf_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     
     # 手动触发删除命令
     async def trigger_deletion(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -621,7 +1480,11 @@ if __name__ == "__main__":
     application.add_handler(CommandHandler("trigger_deletion", trigger_deletion))
     
     # 添加反应处理器
-    application.add_handler(MessageReactionHandler(handle_reaction))
+    # 只接收具名反应，匿名反应计数由下面的处理器处理
+    application.add_handler(MessageReactionHandler(
+        handle_reaction,
+        message_reaction_types=MessageReactionHandler.MESSAGE_REACTION_UPDATED
+    ))
     
     # 添加匿名反应计数处理器
     application.add_handler(MessageReactionHandler(
@@ -632,27 +1495,75 @@ if __name__ == "__main__":
     # 添加错误处理器
     application.add_error_handler(error_handler)
     
-    # 添加定期检查管理员状态的任务（每小时检查一次）
-    application.job_queue.run_repeating(check_admin_status, interval=3600)
+    # 机器人权限变化由 my_chat_member 更新实时维护
+    application.add_handler(ChatMemberHandler(handle_my_chat_member, ChatMemberHandler.MY_CHAT_MEMBER))
+    # 管理员身份变化使管理员名单缓存失效
+    application.add_handler(ChatMemberHandler(handle_chat_member, ChatMemberHandler.CHAT_MEMBER))
     
-    # 定时批量删除任务
-    # 使用 run_once 而不是 run_daily，并在任务执行后自动调度下一次任务
-    next_run_time = get_next_run_time(deletion_time)
-    _deletion_job = application.job_queue.run_once(
-        process_deletion_queue_wrapper,
-        when=next_run_time
+    # 低频权限对账，只检查长时间没有收到更新的群组
+    application.job_queue.run_repeating(
+        check_admin_status, interval=permission_config.get("reconcile_interval_seconds", 21600), first=300
     )
-    logger.info(f"[定时任务] Initialized scheduled deletion task for {next_run_time.strftime('%Y-%m-%d %H:%M:%S')}")
+    
+    # 持久化结论缓存（每 5 分钟）
+    if cache_config.get("persist"):
+        application.job_queue.run_repeating(save_verdict_cache, interval=300)
+    
+    # 删除日志批量 fsync 与压缩（每 5 秒）
+    application.job_queue.run_repeating(flush_storage, interval=5)
+    
+    # 提前删除即将超过 48 小时删除期限的消息
+    application.job_queue.run_repeating(
+        drain_expiring_deletions, interval=expiry_config.get("early_drain_interval_seconds", 900), first=60
+    )
+    
+    # 保存本地模型快照（每 10 分钟）
+    application.job_queue.run_repeating(save_local_model, interval=600)
+    
+    if drain_config.get("mode") == "continuous":
+        # 持续删除模式：后台按速率分散删除
+        application.job_queue.run_repeating(
+            continuous_drain, interval=drain_config.get("interval_seconds", 30), first=10
+        )
+        logger.info("[持续删除] Continuous drain mode enabled")
+    else:
+        # 定时批量删除任务：各群组的计划保存在最小堆中，只为最早到期的计划设置一个定时器
+        build_deletion_schedule()
+        rearm_deletion_timer(application.job_queue)
     
     # 新增 LLM 分类提示词设置命令
     application.add_handler(CommandHandler("set_classification_prompt", set_classification_prompt))
     
+    # 本地规则管理命令
+    application.add_handler(CommandHandler("add_rule", add_rule_command))
+    application.add_handler(CommandHandler("remove_rule", remove_rule_command))
+    application.add_handler(CommandHandler("list_rules", list_rules_command))
+    
+    # 本地模型离线重训命令
+    application.add_handler(CommandHandler("retrain_model", retrain_model_command))
+    
     # 新增 LLM 分类消息处理
+    # 分类在更新处理器的聊天通道内运行：等待 LLM 时只占用本聊天的通道与一个工作槽位，
+    # 其他聊天照常处理，且计入 UPDATE_WORKERS / UPDATE_MAX_BACKLOG 的上限
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, classify_message))
     
+    # 所有处理器按回调函数名记录耗时与异常，剖析会话中另外区分墙钟与 CPU 时间
+    profiler.instrument_handlers(application)
+    instrument_handlers(application)
+    return application
+
+if __name__ == "__main__":
+    # 创建应用程序
+    application = build_application()
+    
     logger.info("Bot started...")
     
-    # 使用内置的轮询方法启动机器人
-    application.run_polling(
-        allowed_updates=["message", "edited_channel_post", "callback_query", "message_reaction", "message_reaction_count"]
-    )
+    if shard_link is not None:
+        # 分片工作进程：更新由监督进程转发，其他分片修改的全局配置同步到本进程
+        run_shard_worker(application, shard_link, lambda cfg: apply_shared_config(cfg, application.job_queue))
+    elif UPDATE_MODE == "webhook":
+        webhook_server, webhook_url, max_connections = webhook_from_env(application, UPDATE_MAX_BACKLOG)
+        run_webhook(application, webhook_server, webhook_url, ALLOWED_UPDATES, max_connections)
+    else:
+        # 使用内置的轮询方法启动机器人
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
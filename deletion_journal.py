@@ -0,0 +1,165 @@
+"""
+删除队列的追加式日志
+
+deletion_queue.json 作为快照（沿用原有的列表格式，原子替换写入），
+每次入队/出队只向 deletion_queue.journal 追加一行 JSON 记录。
+记录写入后立即 flush 到操作系统，fsync 由定期任务批量完成；
+日志记录数超过阈值时压缩为新快照：先把当前日志改名为 .old 并开始写新日志（很快，可在事件循环上进行），
+再在线程中写快照并删除 .old，压缩期间的入队/出队照常写入新日志。
+启动时先读快照，再依次重放 .old 与当前日志（重放是幂等的），末尾被截断的记录会被忽略。
+"""
+
+import json
+import logging
+import os
+import shutil
+from typing import Any, Dict, Iterable, List, Optional, TextIO, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def _entry_key(entry: Dict[str, Any]) -> tuple:
+    return entry.get('chat_id'), entry.get('message_id')
+
+
+class DeletionJournal:
+    """删除队列快照 + 追加日志"""
+
+    def __init__(self, snapshot_path: str, journal_path: str, compact_threshold: int = 10000) -> None:
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.compact_threshold = compact_threshold
+        self.records = 0
+        self._file: Optional[TextIO] = None
+        self._unsynced = 0
+
+    @property
+    def needs_compaction(self) -> bool:
+        return self.records >= self.compact_threshold
+
+    def _read_snapshot(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.snapshot_path):
+            return []
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"[删除日志] 读取快照失败: {e}")
+            return []
+        if isinstance(data, list):
+            return data
+        if isinstance(data, dict):
+            logger.warning("deletion_queue.json contains an object, converted to list")
+            return [data]
+        logger.warning("deletion_queue.json unexpected format, reset to empty list")
+        return []
+
+    @property
+    def rotated_path(self) -> str:
+        return f"{self.journal_path}.old"
+
+    def _replay(self, path: str, entries: Dict[tuple, Dict[str, Any]]) -> int:
+        replayed = 0
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时最后一行可能只写了一半
+                    logger.warning("[删除日志] 忽略不完整的日志记录")
+                    continue
+                op = record.pop('op', None)
+                if op == 'add':
+                    entries.setdefault(_entry_key(record), record)
+                elif op == 'remove':
+                    entries.pop(_entry_key(record), None)
+                elif op == 'clear':
+                    entries.clear()
+                replayed += 1
+        return replayed
+
+    def load(self) -> List[Dict[str, Any]]:
+        """读取快照并重放日志，返回当前队列"""
+        # 按 (chat_id, message_id) 索引，出队记录的重放为 O(1)
+        entries: Dict[tuple, Dict[str, Any]] = {}
+        for entry in self._read_snapshot():
+            entries.setdefault(_entry_key(entry), entry)
+        replayed = 0
+        for path in (self.rotated_path, self.journal_path):
+            if os.path.exists(path):
+                replayed += self._replay(path, entries)
+        self.records = replayed
+        if replayed:
+            logger.info(f"[删除日志] 已重放 {replayed} 条日志记录，队列长度 {len(entries)}")
+        return list(entries.values())
+
+    def _append(self, records: List[Dict[str, Any]]) -> None:
+        if self._file is None:
+            self._file = open(self.journal_path, 'a', encoding='utf-8')
+        self._file.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+        self._file.flush()
+        self.records += len(records)
+        self._unsynced += len(records)
+
+    def record_add(self, entry: Dict[str, Any]) -> None:
+        self._append([{'op': 'add', **entry}])
+
+    def record_remove(self, entry: Dict[str, Any]) -> None:
+        self.record_removes([(entry['chat_id'], entry['message_id'])])
+
+    def record_removes(self, keys: Iterable[Tuple[int, int]]) -> None:
+        """一次写入多条出队记录"""
+        records = [{'op': 'remove', 'chat_id': chat_id, 'message_id': message_id} for chat_id, message_id in keys]
+        if records:
+            self._append(records)
+
+    def sync(self) -> None:
+        """把已写入的日志 fsync 到磁盘（可在线程中调用）"""
+        if self._file is None or not self._unsynced:
+            return
+        self._unsynced = 0
+        try:
+            os.fsync(self._file.fileno())
+        except (OSError, ValueError) as e:
+            logger.warning(f"[删除日志] fsync 失败: {e}")
+
+    def rotate(self) -> None:
+        """压缩的第一步：当前日志改名为 .old，之后的记录写入新日志"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.journal_path):
+            if os.path.exists(self.rotated_path):
+                # 上一次压缩没有完成，.old 中的记录仍需保留
+                with open(self.journal_path, 'r', encoding='utf-8') as src, \
+                        open(self.rotated_path, 'a', encoding='utf-8') as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, self.rotated_path)
+        self._file = open(self.journal_path, 'w', encoding='utf-8')
+        self.records = 0
+        self._unsynced = 0
+
+    def write_snapshot(self, entries: List[Dict[str, Any]]) -> None:
+        """压缩的第二步（可在线程中调用）：写入 rotate() 时的队列快照，然后丢弃 .old"""
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        # 快照落盘后才能丢弃旧日志
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def compact(self, entries: List[Dict[str, Any]]) -> None:
+        """把当前队列写成新快照并清空日志"""
+        self.rotate()
+        self.write_snapshot(entries)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
@@ -0,0 +1,166 @@
+"""
+按群组分桶的待删除消息队列
+
+每个群组一个 array('q') 按入队顺序保存 message_id，并行的 array('q') 保存消息发送时间
+（Unix 秒，0 表示未知），另有一个集合用于 O(1) 去重与成员判断，群组内计数直接取数组长度。
+每个群组最早的已知发送时间单独维护，汇总与按时间筛选只需遍历群组，不必扫描整个队列。
+相比每条记录一个 dict，几十万条记录时内存与 CPU 开销都保持平稳。
+按速率分批删除时各群组轮流取消息，入队很快的群组不会占满每一批的预算。
+"""
+
+import itertools
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Set, Tuple
+
+
+def round_robin(by_chat: Dict[int, Iterable[int]]) -> Iterator[Tuple[int, int]]:
+    """各群组轮流取出 (chat_id, message_id)，群组内保持原有顺序"""
+    iterators = [(chat_id, iter(message_ids)) for chat_id, message_ids in by_chat.items()]
+    while iterators:
+        remaining = []
+        for chat_id, message_ids in iterators:
+            message_id = next(message_ids, None)
+            if message_id is None:
+                continue
+            yield chat_id, message_id
+            remaining.append((chat_id, message_ids))
+        iterators = remaining
+
+
+def select_drain_batch(overdue: Dict[int, List[int]], pending: Iterable[Tuple[int, int]],
+                       budget: int) -> Dict[int, List[int]]:
+    """一批至多 budget 条：超过最大存留时间的消息按群组轮流优先，其余按 pending 的顺序补足"""
+    due: Dict[int, List[int]] = {}
+    taken: Set[Tuple[int, int]] = set()
+    for key in itertools.chain(round_robin(overdue), pending):
+        if len(taken) >= budget:
+            break
+        if key not in taken:
+            taken.add(key)
+            due.setdefault(key[0], []).append(key[1])
+    return due
+
+
+class DeletionQueue:
+    """去重的按群组分桶删除队列"""
+
+    def __init__(self) -> None:
+        self._ids: Dict[int, array] = {}
+        self._dates: Dict[int, array] = {}
+        self._members: Dict[int, Set[int]] = {}
+        # 每个群组最早的已知发送时间，没有已知时间时为 0
+        self._oldest: Dict[int, int] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        chat_id, message_id = key
+        members = self._members.get(chat_id)
+        return members is not None and message_id in members
+
+    def add(self, chat_id: int, message_id: int, date: int = 0) -> bool:
+        """入队，已在队列中时返回 False"""
+        members = self._members.get(chat_id)
+        if members is None:
+            members = self._members[chat_id] = set()
+            self._ids[chat_id] = array('q')
+            self._dates[chat_id] = array('q')
+            self._oldest[chat_id] = 0
+        elif message_id in members:
+            return False
+        date = int(date)
+        members.add(message_id)
+        self._ids[chat_id].append(message_id)
+        self._dates[chat_id].append(date)
+        if date > 0 and (self._oldest[chat_id] == 0 or date < self._oldest[chat_id]):
+            self._oldest[chat_id] = date
+        self._size += 1
+        return True
+
+    def count(self, chat_id: int) -> int:
+        ids = self._ids.get(chat_id)
+        return len(ids) if ids is not None else 0
+
+    def chats(self) -> List[int]:
+        return list(self._ids)
+
+    def message_ids(self, chat_id: int) -> List[int]:
+        ids = self._ids.get(chat_id)
+        return ids.tolist() if ids is not None else []
+
+    def oldest_date(self, chat_id: int) -> int:
+        """群组中最早的已知发送时间，没有时为 0"""
+        return self._oldest.get(chat_id, 0)
+
+    def summary(self) -> Dict[int, Tuple[int, int]]:
+        """按群组返回 (待删除条数, 最早的已知发送时间)，发送时间都未知时为 0"""
+        return {chat_id: (len(ids), self._oldest[chat_id]) for chat_id, ids in self._ids.items()}
+
+    def older_than(self, timestamp: float) -> Dict[int, List[int]]:
+        """按群组返回发送时间已知且早于 timestamp 的消息，只扫描最早时间早于 timestamp 的群组"""
+        result: Dict[int, List[int]] = {}
+        for chat_id, oldest in self._oldest.items():
+            if not 0 < oldest < timestamp:
+                continue
+            ids = self._ids[chat_id]
+            result[chat_id] = [ids[i] for i, date in enumerate(self._dates[chat_id]) if 0 < date < timestamp]
+        return result
+
+    def remove(self, keys: Iterable[Tuple[int, int]]) -> int:
+        """批量出队，每个受影响的群组只重建一次数组，返回实际移除的条数"""
+        by_chat: Dict[int, Set[int]] = {}
+        for chat_id, message_id in keys:
+            if (chat_id, message_id) in self:
+                by_chat.setdefault(chat_id, set()).add(message_id)
+        removed = 0
+        for chat_id, message_ids in by_chat.items():
+            members = self._members[chat_id]
+            members -= message_ids
+            removed += len(message_ids)
+            if not members:
+                del self._members[chat_id]
+                del self._ids[chat_id]
+                del self._dates[chat_id]
+                del self._oldest[chat_id]
+            else:
+                ids, dates = self._ids[chat_id], self._dates[chat_id]
+                keep = [i for i, m in enumerate(ids) if m not in message_ids]
+                self._ids[chat_id] = array('q', (ids[i] for i in keep))
+                self._dates[chat_id] = array('q', (dates[i] for i in keep))
+                # 重建数组时顺带更新最早时间，不增加额外的扫描
+                self._oldest[chat_id] = min((date for date in self._dates[chat_id] if date > 0), default=0)
+        self._size -= removed
+        return removed
+
+    def clear(self) -> None:
+        self._ids.clear()
+        self._dates.clear()
+        self._members.clear()
+        self._oldest.clear()
+        self._size = 0
+
+    def interleaved(self) -> Iterator[Tuple[int, int]]:
+        """各群组轮流取出 (chat_id, message_id)，群组内按入队顺序"""
+        return round_robin(dict(self._ids))
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        for chat_id, ids in self._ids.items():
+            for message_id in ids:
+                yield chat_id, message_id
+
+    def items(self) -> Iterator[Tuple[int, int, int]]:
+        """遍历 (chat_id, message_id, date)"""
+        for chat_id, ids in self._ids.items():
+            yield from ((chat_id, message_id, date) for message_id, date in zip(ids, self._dates[chat_id]))
+
+    def to_list(self) -> List[Dict[str, Any]]:
+        """转换为 deletion_queue.json 使用的列表格式，发送时间未知时不写 date 字段"""
+        entries = []
+        for chat_id, message_id, date in self.items():
+            entry = {'chat_id': chat_id, 'message_id': message_id}
+            if date:
+                entry['date'] = date
+            entries.append(entry)
+        return entries
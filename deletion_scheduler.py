@@ -0,0 +1,109 @@
+"""
+多群组定时删除调度
+
+最小堆保存 (下一次运行时间, 群组 ID)，bot.py 只为堆顶设置一个 JobQueue 定时器，
+群组数量再多也只有一个回调。修改或移除某个群组的计划时旧的堆元素不立即删除，
+出堆时与当前计划比对后丢弃。
+
+每个群组可以有自己的删除时间与时区，DEFAULT_SCHEDULE 表示全局默认计划
+（没有单独设置的群组都按它执行）。下一次运行时间按当地日历逐日计算，
+夏令时切换日同样落在当地的 HH:MM：跳过的时刻顺延到跳变之后，重复的时刻取第一次。
+"""
+
+import heapq
+from datetime import datetime, time as dtime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import pytz
+
+DEFAULT_SCHEDULE = 0
+
+
+def parse_time(time_str: str) -> dtime:
+    """解析 HH:MM，格式错误时抛出 ValueError"""
+    return datetime.strptime(time_str, "%H:%M").time()
+
+
+def next_run_after(time_str: str, tz_name: str, now: datetime) -> datetime:
+    """返回晚于 now 的第一个当地 time_str 时刻（带时区）"""
+    tz = pytz.timezone(tz_name)
+    at = parse_time(time_str)
+    local_day = now.astimezone(tz).date()
+    for offset in range(3):
+        naive = datetime.combine(local_day + timedelta(days=offset), at)
+        try:
+            candidate = tz.localize(naive, is_dst=None)
+        except pytz.NonExistentTimeError:
+            # 春季拨快跳过的时刻：按标准时间换算后规范化，即顺延到跳变之后
+            candidate = tz.normalize(tz.localize(naive, is_dst=False))
+        except pytz.AmbiguousTimeError:
+            # 秋季拨慢重复的时刻：取第一次出现
+            candidate = tz.localize(naive, is_dst=True)
+        if candidate > now:
+            return candidate
+    raise ValueError(f"无法计算 {time_str} {tz_name} 的下一次运行时间")
+
+
+class DeletionScheduler:
+    """按下一次运行时间排序的群组删除计划"""
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int]] = []
+        self._schedules: Dict[int, Tuple[str, str]] = {}
+        self._next: Dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._schedules)
+
+    def __contains__(self, key: int) -> bool:
+        return key in self._schedules
+
+    def set(self, key: int, time_str: str, tz_name: str, now: Optional[datetime] = None) -> datetime:
+        """设置或修改计划，返回下一次运行时间；时间或时区无效时抛出异常"""
+        now = now or datetime.now(timezone.utc)
+        next_run = next_run_after(time_str, tz_name, now)
+        self._schedules[key] = (time_str, tz_name)
+        self._push(key, next_run.timestamp())
+        return next_run
+
+    def remove(self, key: int) -> None:
+        self._schedules.pop(key, None)
+        self._next.pop(key, None)
+
+    def get(self, key: int) -> Optional[Tuple[str, str]]:
+        return self._schedules.get(key)
+
+    def next_run(self, key: int) -> Optional[float]:
+        """下一次运行的 Unix 时间戳"""
+        return self._next.get(key)
+
+    def _push(self, key: int, timestamp: float) -> None:
+        self._next[key] = timestamp
+        heapq.heappush(self._heap, (timestamp, key))
+
+    def _discard_stale(self) -> None:
+        while self._heap:
+            timestamp, key = self._heap[0]
+            if self._next.get(key) == timestamp:
+                return
+            heapq.heappop(self._heap)
+
+    def peek(self) -> Optional[float]:
+        """最早的下一次运行时间戳，没有计划时返回 None"""
+        self._discard_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: Optional[datetime] = None) -> List[int]:
+        """取出所有已到期的计划并排到各自的下一次运行时间"""
+        now = now or datetime.now(timezone.utc)
+        now_ts = now.timestamp()
+        due: List[int] = []
+        while True:
+            self._discard_stale()
+            if not self._heap or self._heap[0][0] > now_ts:
+                break
+            _, key = heapq.heappop(self._heap)
+            due.append(key)
+            time_str, tz_name = self._schedules[key]
+            self._push(key, next_run_after(time_str, tz_name, now).timestamp())
+        return due
@@ -0,0 +1,167 @@
+"""
+LLM 分类微批处理
+
+在短时间窗口内收集待分类消息，合并为一次结构化请求，
+按编号把每条 KEEP/DELETE 结论路由回对应的调用方。
+批量响应无法解析时，对未得到结论的消息退回逐条请求。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from llm_client import LLMClient
+
+logger = logging.getLogger(__name__)
+
+SINGLE_INSTRUCTION = "请只回答 'DELETE' 或 'KEEP'。"
+BATCH_INSTRUCTION = (
+    "你将收到一个 JSON 数组，每个元素包含 id 和 text 两个字段，代表一条待审核的消息。"
+    "请逐条按上述规则判断，只输出一个 JSON 数组，"
+    "每个元素形如 {\"id\": <id>, \"decision\": \"DELETE\" 或 \"KEEP\"}，不要输出其他内容。"
+)
+
+
+def single_system_prompt(prompt: str) -> str:
+    """单条分类使用的 system 提示词"""
+    return f"{prompt}\n\n{SINGLE_INSTRUCTION}"
+
+
+def batch_system_prompt(prompt: str) -> str:
+    """批量分类使用的 system 提示词"""
+    return f"{prompt}\n\n{BATCH_INSTRUCTION}"
+
+
+def normalize_decision(content: str) -> str:
+    """把模型的原始回答归一化为 DELETE 或 KEEP"""
+    return "DELETE" if content.strip().upper().startswith("DELETE") else "KEEP"
+
+
+class BatchParseError(ValueError):
+    """批量响应格式不符合预期"""
+
+
+def parse_batch_response(content: str, ids: List[int]) -> Dict[int, str]:
+    """解析批量响应，返回 id -> DELETE/KEEP；只包含合法的条目"""
+    text = content.strip()
+    start, end = text.find("["), text.rfind("]")
+    if start == -1 or end <= start:
+        raise BatchParseError("响应中未找到 JSON 数组")
+    try:
+        items = json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise BatchParseError(f"JSON 解析失败: {e}")
+    if not isinstance(items, list):
+        raise BatchParseError("响应不是数组")
+
+    wanted = set(ids)
+    verdicts: Dict[int, str] = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        try:
+            item_id = int(item.get("id"))
+        except (TypeError, ValueError):
+            continue
+        decision = str(item.get("decision", "")).strip().upper()
+        if item_id in wanted and decision in ("DELETE", "KEEP"):
+            verdicts[item_id] = decision
+    return verdicts
+
+
+class _PendingBatch:
+    __slots__ = ("config", "prompt", "items", "timer")
+
+    def __init__(self, config: Dict[str, Any], prompt: str) -> None:
+        self.config = dict(config)
+        self.prompt = prompt
+        self.items: List[Tuple[str, asyncio.Future]] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class ClassificationBatcher:
+    """按 (提示词, 服务地址, 模型, API key) 分组收集消息，满 max_batch_size 条或等待 max_wait 秒后发送
+
+    API key 也计入分组：只有 key 不同的两份配置不会共用一次请求（计费与授权归属各自的 key）。
+    """
+
+    def __init__(self, client: LLMClient, max_batch_size: int = 20, max_wait: float = 0.5) -> None:
+        self.client = client
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait))
+        self._pending: Dict[Tuple[str, str, str, str], _PendingBatch] = {}
+        self._tasks: set = set()
+
+    async def classify(self, config: Dict[str, Any], prompt: str, text: str) -> str:
+        """提交一条消息，返回该消息的 DELETE/KEEP 结论"""
+        loop = asyncio.get_running_loop()
+        api_key_hash = hashlib.sha256(config.get("api_key", "").encode("utf-8")).hexdigest()[:16]
+        key = (prompt, config.get("base_url", ""), config.get("model", ""), api_key_hash)
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _PendingBatch(config, prompt)
+            batch.timer = loop.call_later(self.max_wait, self._flush, key)
+
+        future = loop.create_future()
+        batch.items.append((text, future))
+        if len(batch.items) >= self.max_batch_size:
+            self._flush(key)
+        return await future
+
+    def _flush(self, key: Tuple[str, str, str, str]) -> None:
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = asyncio.ensure_future(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: _PendingBatch) -> None:
+        items = batch.items
+        if len(items) == 1:
+            await self._run_single(batch, items)
+            return
+
+        ids = list(range(1, len(items) + 1))
+        payload = json.dumps([{"id": i, "text": text} for i, (text, _) in zip(ids, items)], ensure_ascii=False)
+        try:
+            content = await self.client.complete(batch.config, batch_system_prompt(batch.prompt), payload)
+        except Exception as e:
+            logger.error(f"[LLM批量] 批量请求失败 ({len(items)} 条): {e}")
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        try:
+            verdicts = parse_batch_response(content, ids)
+        except BatchParseError as e:
+            logger.warning(f"[LLM批量] 无法解析批量响应，退回逐条请求: {e}")
+            verdicts = {}
+
+        leftovers = []
+        for item_id, (text, future) in zip(ids, items):
+            if item_id in verdicts:
+                if not future.done():
+                    future.set_result(verdicts[item_id])
+            else:
+                leftovers.append((text, future))
+        logger.info(f"[LLM批量] 批量分类 {len(items)} 条，逐条补发 {len(leftovers)} 条")
+        if leftovers:
+            await self._run_single(batch, leftovers)
+
+    async def _run_single(self, batch: _PendingBatch, items: List[Tuple[str, asyncio.Future]]) -> None:
+        async def one(text: str, future: asyncio.Future) -> None:
+            try:
+                content = await self.client.complete(batch.config, single_system_prompt(batch.prompt), text)
+                if not future.done():
+                    future.set_result(normalize_decision(content))
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+
+        await asyncio.gather(*(one(text, future) for text, future in items))
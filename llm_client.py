@@ -0,0 +1,150 @@
+"""
+异步 LLM 客户端
+
+通过共享的 httpx.AsyncClient 调用 OpenAI 兼容的 /chat/completions 接口，
+连接池与 keep-alive 参数来自 llm_config，避免同步 SDK 阻塞事件循环。
+"""
+
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from metrics import LLM_DURATION, LLM_ERRORS, LLM_TOKENS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_MODEL = "gpt-4o-mini"
+
+
+class LLMClient:
+    """OpenAI 兼容接口的异步客户端，所有分类请求共用一个连接池"""
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+        # transport 仅用于测试时注入模拟传输层
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._signature: Optional[Tuple[Any, ...]] = None
+        # 配置变更后被替换下来的客户端，其上的请求全部结束后关闭
+        self._retired: List[httpx.AsyncClient] = []
+        # 每个客户端上进行中的请求数
+        self._in_flight: Dict[httpx.AsyncClient, int] = {}
+
+    @staticmethod
+    def _config_signature(config: Dict[str, Any]) -> Tuple[Any, ...]:
+        return (
+            config.get("base_url", DEFAULT_BASE_URL),
+            config.get("api_key", ""),
+            float(config.get("timeout", 30)),
+            int(config.get("max_connections", 20)),
+            int(config.get("max_keepalive_connections", 10)),
+            float(config.get("keepalive_expiry", 30)),
+            float(config.get("pool_timeout", 10)),
+        )
+
+    def _get_client(self, config: Dict[str, Any]) -> httpx.AsyncClient:
+        """按当前 llm_config 返回共享客户端，配置变化时重建"""
+        signature = self._config_signature(config)
+        if self._client is not None and signature == self._signature:
+            return self._client
+
+        base_url, api_key, timeout, max_connections, max_keepalive, keepalive_expiry, pool_timeout = signature
+        headers = {"Content-Type": "application/json"}
+        if api_key:
+            headers["Authorization"] = f"Bearer {api_key}"
+
+        if self._client is not None:
+            # 旧连接上可能仍有请求在进行，等它们结束后再关闭
+            self._retired.append(self._client)
+        self._client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            headers=headers,
+            # 连接池已满时排队等待连接的上限，超时抛出 PoolTimeout 而不是无限等待
+            timeout=httpx.Timeout(timeout, pool=pool_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            transport=self._transport,
+        )
+        self._signature = signature
+        logger.info(f"[LLM客户端] 已创建连接池: base_url={base_url} max_connections={max_connections}")
+        return self._client
+
+    async def chat(self, config: Dict[str, Any], messages: List[Dict[str, str]], **params: Any) -> Dict[str, Any]:
+        """发送一次 chat completion 请求并返回解析后的 JSON"""
+        client = self._get_client(config)
+        self._in_flight[client] = self._in_flight.get(client, 0) + 1
+        try:
+            return await self._post(client, config, messages, params)
+        finally:
+            remaining = self._in_flight.pop(client, 1) - 1
+            if remaining:
+                self._in_flight[client] = remaining
+            await self._close_idle_retired()
+
+    async def _post(self, client: httpx.AsyncClient, config: Dict[str, Any], messages: List[Dict[str, str]],
+                    params: Dict[str, Any]) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {
+            "model": config.get("model", DEFAULT_MODEL),
+            "messages": messages,
+        }
+        payload.update(params)
+        started = time.perf_counter()
+        try:
+            resp = await client.post("/chat/completions", json=payload)
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as e:
+            LLM_DURATION.labels("error").observe(time.perf_counter() - started)
+            reason = str(e.response.status_code) if isinstance(e, httpx.HTTPStatusError) else type(e).__name__
+            LLM_ERRORS.labels(reason).inc()
+            raise
+        LLM_DURATION.labels("ok").observe(time.perf_counter() - started)
+        usage = data.get("usage") or {}
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if isinstance(usage.get(kind), int):
+                LLM_TOKENS.labels(kind[:-len("_tokens")]).inc(usage[kind])
+        return data
+
+    async def complete(self, config: Dict[str, Any], system_msg: str, user_msg: str, **params: Any) -> str:
+        """以 system + user 两条消息请求，返回首个候选的文本内容"""
+        params.setdefault("temperature", 0)
+        data = await self.chat(
+            config,
+            [
+                {"role": "system", "content": system_msg},
+                {"role": "user", "content": user_msg},
+            ],
+            **params,
+        )
+        return data["choices"][0]["message"]["content"]
+
+    async def _close_idle_retired(self) -> None:
+        """关闭已被替换且没有进行中请求的客户端"""
+        idle = [client for client in self._retired if client not in self._in_flight]
+        if not idle:
+            return
+        self._retired = [client for client in self._retired if client in self._in_flight]
+        for client in idle:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"[LLM客户端] 关闭连接池失败: {e}")
+        logger.info(f"[LLM客户端] 已关闭 {len(idle)} 个被替换的连接池")
+
+    async def close(self) -> None:
+        """关闭所有连接池"""
+        clients = self._retired + ([self._client] if self._client is not None else [])
+        self._client = None
+        self._signature = None
+        self._retired = []
+        # 不清空 _in_flight：进行中的请求会在结束时自行减计数
+        for client in clients:
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.warning(f"[LLM客户端] 关闭连接池失败: {e}")
@@ -0,0 +1,494 @@
+"""
+离线压测
+
+在本机启动假的 Telegram Bot API 服务器和 OpenAI 兼容的假 LLM 服务器（延迟、错误率、
+429 RetryAfter 均可配置），用 bot.build_application() 创建的真实 Application 处理合成的更新流
+（classify_message、handle_reaction、handle_reaction_count），最后运行 process_deletion_queue。
+报告吞吐量、各处理器与端到端延迟的 p50/p99、每条被处理消息的 Bot API 调用数、LLM 请求与
+token 数以及峰值内存。
+
+    python loadtest.py --updates 5000 --chats 50 --llm-latency 0.3 --json result.json
+
+也可以用 --replay 回放 bot.py 录制的真实更新（见 update_recorder.py），--speed 控制回放倍速：
+
+    python loadtest.py --replay recordings/ --speed 10
+
+数据与日志写入临时目录（--keep 保留），不会影响 data/。默认使用 bot.py 的真实限流配置，
+--unthrottled 可去掉出站限流以测量处理本身的上限。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+from profiler import format_timings
+from update_recorder import RECORDED_KINDS, list_segments, read_segments
+
+SPAM_TEMPLATES = [
+    "Buy cheap followers now!!! visit spam.example/{n}",
+    "💰 Crypto giveaway, send 1 BTC get 2 back #{n}",
+    "Hot singles in your area, click spam.example/{n}",
+]
+HAM_WORDS = (
+    "meeting tomorrow release notes please review the patch lunch weather build failed "
+    "thanks everyone docs updated question about config deploy tonight coffee"
+).split()
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class FakeServer:
+    """本机假服务器：按配置注入延迟、5xx 错误与 429"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, retry_after_rate: float = 0.0,
+                 retry_after: int = 1, seed: int = 0) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.base_url = ""
+        self._random = random.Random(seed)
+        self._runner: Optional[web.AppRunner] = None
+
+    def make_app(self) -> web.Application:
+        raise NotImplementedError
+
+    async def start(self, prefix: str) -> str:
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://127.0.0.1:{port}{prefix}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def inject(self, name: str) -> Optional[web.Response]:
+        """模拟延迟；需要注入故障时返回错误响应"""
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        roll = self._random.random()
+        if roll < self.retry_after_rate:
+            self.errors["429"] += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}
+            }, status=429)
+        if roll < self.retry_after_rate + self.error_rate:
+            self.errors["500"] += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"}, status=500)
+        return None
+
+
+class FakeBotAPI(FakeServer):
+    """Telegram Bot API 的最小替身，只返回机器人用到的方法所需的字段"""
+
+    BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self._message_id = 10_000_000
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if method != "getMe":
+            failure = await self.inject(method)
+            if failure is not None:
+                return failure
+        else:
+            self.calls[method] += 1
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    def result(self, method: str, params: Dict[str, str]) -> Any:
+        if method == "getMe":
+            return self.BOT_USER
+        if method == "sendMessage":
+            self._message_id += 1
+            return {
+                "message_id": self._message_id, "date": int(time.time()), "text": params.get("text", ""),
+                "chat": {"id": int(params.get("chat_id", 0)), "type": "supergroup"}
+            }
+        if method == "getChatMember":
+            return {
+                "status": "administrator", "user": self.BOT_USER, "can_be_edited": False,
+                "is_anonymous": False, "can_manage_chat": True, "can_delete_messages": True,
+                "can_manage_video_chats": False, "can_restrict_members": True, "can_promote_members": False,
+                "can_change_info": False, "can_invite_users": True, "can_post_stories": False,
+                "can_edit_stories": False, "can_delete_stories": False
+            }
+        if method == "getChatAdministrators":
+            return []
+        return True
+
+
+class FakeLLM(FakeServer):
+    """OpenAI 兼容 /chat/completions 的替身：含 spam 关键词的消息判为 DELETE，支持批量请求"""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.handle)
+        return app
+
+    @staticmethod
+    def decide(text: str) -> str:
+        lowered = text.lower()
+        return "DELETE" if "spam" in lowered or "btc" in lowered else "KEEP"
+
+    async def handle(self, request: web.Request) -> web.Response:
+        failure = await self.inject("chat.completions")
+        if failure is not None:
+            return failure
+        body = await request.json()
+        user = body["messages"][-1]["content"]
+        try:
+            items = json.loads(user)
+        except ValueError:
+            items = None
+        if isinstance(items, list):
+            content = json.dumps([{"id": item["id"], "decision": self.decide(item["text"])} for item in items])
+        else:
+            content = self.decide(user)
+        prompt_tokens = sum(len(m["content"]) for m in body["messages"]) // 4
+        completion_tokens = max(1, len(content) // 4)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        return web.json_response({
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+
+def make_updates(count: int, chats: List[int], spam_ratio: float, reaction_ratio: float,
+                 seed: int = 0) -> List[Dict[str, Any]]:
+    """合成更新流：文本消息，以及针对之前消息的 👎/💩 反应与匿名反应计数"""
+    rng = random.Random(seed)
+    now = int(time.time())
+    sent: Dict[int, List[int]] = defaultdict(list)
+    updates: List[Dict[str, Any]] = []
+    for update_id in range(1, count + 1):
+        chat_id = rng.choice(chats)
+        chat = {"id": chat_id, "type": "supergroup", "title": f"bench {chat_id}"}
+        user = {"id": 1000 + rng.randrange(500), "is_bot": False, "first_name": "user"}
+        if sent[chat_id] and rng.random() < reaction_ratio:
+            message_id = rng.choice(sent[chat_id])
+            kind = rng.random()
+            if kind < 0.2:
+                updates.append({"update_id": update_id, "message_reaction_count": {
+                    "chat": chat, "message_id": message_id, "date": now,
+                    "reactions": [{"type": {"type": "emoji", "emoji": "👎"}, "total_count": rng.randint(1, 5)}]
+                }})
+            else:
+                emoji = "💩" if kind < 0.3 else "👎"
+                updates.append({"update_id": update_id, "message_reaction": {
+                    "chat": chat, "message_id": message_id, "date": now, "user": user,
+                    "old_reaction": [], "new_reaction": [{"type": "emoji", "emoji": emoji}]
+                }})
+            continue
+        message_id = len(sent[chat_id]) + 1
+        sent[chat_id].append(message_id)
+        if rng.random() < spam_ratio:
+            text = rng.choice(SPAM_TEMPLATES).format(n=rng.randrange(1000))
+        else:
+            text = " ".join(rng.choice(HAM_WORDS) for _ in range(rng.randint(3, 12)))
+        updates.append({"update_id": update_id, "message": {
+            "message_id": message_id, "date": now, "chat": chat, "from": user, "text": text
+        }})
+    return updates
+
+
+class HandlerTimer:
+    """包装处理器回调，记录每次调用耗时与从注入到处理完成的端到端延迟"""
+
+    def __init__(self, expected: int) -> None:
+        self.expected = expected
+        self.handled = 0
+        self.injected: Dict[int, float] = {}
+        self.latency: Dict[str, List[float]] = defaultdict(list)
+        self.end_to_end: List[float] = []
+        self.done = asyncio.Event()
+
+    def wrap(self, callback: Callable) -> Callable:
+        name = callback.__name__
+
+        async def timed(update: Any, context: Any) -> Any:
+            start = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                end = time.perf_counter()
+                self.latency[name].append(end - start)
+                injected = self.injected.get(getattr(update, "update_id", None))
+                if injected is not None:
+                    self.end_to_end.append(end - injected)
+                self.handled += 1
+                if self.handled >= self.expected:
+                    self.done.set()
+
+        return timed
+
+
+def load_recording(paths: List[str]) -> Tuple[List[Dict[str, Any]], List[float]]:
+    """读取录制的分段，返回更新与相对第一条更新的接收时间偏移（秒）
+
+    更新中的 date 整体平移到当前时间附近，避免回放的消息被当作已超过删除期限。
+    """
+    files: List[str] = []
+    for path in paths:
+        files.extend(list_segments(path, include_partial=True) if os.path.isdir(path) else [path])
+    records = list(read_segments(files))
+    if not records:
+        return [], []
+    first = records[0][0]
+    payloads = [
+        update[kind] for _, update in records for kind in RECORDED_KINDS
+        if isinstance(update.get(kind), dict) and "date" in update[kind]
+    ]
+    shift = int(time.time()) - max((payload["date"] for payload in payloads), default=int(time.time()))
+    for payload in payloads:
+        payload["date"] += shift
+    return [update for _, update in records], [received_at - first for received_at, _ in records]
+
+
+def chats_of(updates: List[Dict[str, Any]]) -> List[int]:
+    chats = set()
+    for update in updates:
+        for kind in RECORDED_KINDS:
+            payload = update.get(kind)
+            if isinstance(payload, dict) and "chat" in payload:
+                chats.add(payload["chat"]["id"])
+    return sorted(chats)
+
+
+async def run_benchmark(bot: Any, args: argparse.Namespace, raw_updates: List[Dict[str, Any]],
+                        chats: List[int], offsets: Optional[List[float]] = None) -> Dict[str, Any]:
+    """offsets 为各更新相对开始的注入时间（按 args.speed 缩放），为 None 时按 args.rate 注入"""
+    from telegram import Update
+    from telegram.ext import CallbackContext
+
+    bot_api = FakeBotAPI(args.api_latency, args.api_error_rate, args.retry_after_rate, args.retry_after, args.seed)
+    llm = FakeLLM(args.llm_latency, args.llm_error_rate, 0.0, 1, args.seed + 1)
+    await bot_api.start("/bot")
+    await llm.start("/v1")
+
+    for chat_id in chats:
+        bot.monitored_groups[chat_id] = {"name": f"bench {chat_id}"}
+        bot.permission_table.update(chat_id, True)
+    bot.classification_prompt = "Delete spam and scams, keep normal conversation."
+    bot.llm_config.update({"base_url": llm.base_url, "model": "fake", "api_key": "bench"})
+    bot.batch_config["enabled"] = args.batch
+
+    application = bot.build_application(base_url=bot_api.base_url)
+    updates = [Update.de_json(data, application.bot) for data in raw_updates]
+    # 回放的更新中可能有没有处理器接收的类型（如图片消息），不计入等待数量
+    expected = sum(1 for update in updates if any(h.check_update(update) for h in application.handlers[0]))
+    timer = HandlerTimer(expected)
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = timer.wrap(handler.callback)
+
+    if args.tracemalloc:
+        tracemalloc.start()
+    report: Dict[str, Any] = {}
+    async with application:
+        await application.start()
+        if args.profile:
+            bot.profiler.output_dir = args.profile_dir
+            bot.profiler.start(args.profile)
+        interval = 1 / args.rate if args.rate else 0
+        start = time.perf_counter()
+        for index, update in enumerate(updates):
+            if offsets is not None and args.speed:
+                delay = start + offsets[index] / args.speed - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            timer.injected[update.update_id] = time.perf_counter()
+            await application.update_queue.put(update)
+            if offsets is None and interval:
+                await asyncio.sleep(interval)
+        if expected:
+            try:
+                await asyncio.wait_for(timer.done.wait(), timeout=args.timeout)
+            except asyncio.TimeoutError:
+                print(f"警告: {args.timeout}s 内只处理了 {timer.handled}/{expected} 条更新", file=sys.stderr)
+        elapsed = time.perf_counter() - start
+        # 等待标记反应等后台任务完成
+        await bot.reaction_marker.close()
+
+        immediate_deletes = bot_api.calls["deleteMessage"]
+        queued = await bot.storage.pending_count()
+        calls_before = sum(bot_api.calls.values())
+        deletion_start = time.perf_counter()
+        await bot.process_deletion_queue(CallbackContext(application))
+        deletion_elapsed = time.perf_counter() - deletion_start
+        if args.profile:
+            report["profile"] = await bot.profiler.stop()
+        await application.stop()
+    await bot.shutdown_resources(application)
+    await bot_api.stop()
+    await llm.stop()
+
+    moderated = queued + immediate_deletes
+    api_calls = sum(count for method, count in bot_api.calls.items() if method != "getMe")
+    report.update({
+        "updates": len(raw_updates),
+        "expected": expected,
+        "handled": timer.handled,
+        "elapsed_seconds": round(elapsed, 3),
+        "updates_per_second": round(timer.handled / elapsed, 1) if elapsed else 0.0,
+        "end_to_end_p50_ms": round(percentile(timer.end_to_end, 0.5) * 1000, 2),
+        "end_to_end_p99_ms": round(percentile(timer.end_to_end, 0.99) * 1000, 2),
+        "handlers": {
+            name: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 0.5) * 1000, 2),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+            }
+            for name, values in sorted(timer.latency.items())
+        },
+        "moderated_messages": moderated,
+        "queued_for_deletion": queued,
+        "deletion_seconds": round(deletion_elapsed, 3),
+        "deletion_api_calls": sum(bot_api.calls.values()) - calls_before,
+        "bot_api_calls": dict(bot_api.calls),
+        "bot_api_injected_errors": dict(bot_api.errors),
+        "api_calls_per_moderated_message": round(api_calls / moderated, 2) if moderated else None,
+        "llm_requests": sum(llm.calls.values()),
+        "llm_injected_errors": dict(llm.errors),
+        "llm_prompt_tokens": llm.prompt_tokens,
+        "llm_completion_tokens": llm.completion_tokens,
+        # Linux 上 ru_maxrss 以 KiB 为单位
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+    if args.tracemalloc:
+        report["tracemalloc_peak_mib"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+        tracemalloc.stop()
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"更新数:             {report['handled']}/{report['expected']}（共 {report['updates']}），耗时 {report['elapsed_seconds']}s")
+    print(f"吞吐量:             {report['updates_per_second']} updates/s")
+    print(f"端到端延迟:         p50 {report['end_to_end_p50_ms']}ms  p99 {report['end_to_end_p99_ms']}ms")
+    for name, stats in report["handlers"].items():
+        print(f"  {name:<22} n={stats['count']:<6} p50 {stats['p50_ms']}ms  p99 {stats['p99_ms']}ms")
+    print(f"被处理消息:         {report['moderated_messages']}（入队 {report['queued_for_deletion']}）")
+    print(f"每条消息 API 调用:  {report['api_calls_per_moderated_message']}")
+    print(f"Bot API 调用:       {report['bot_api_calls']}  注入错误 {report['bot_api_injected_errors']}")
+    print(f"批量删除:           {report['deletion_seconds']}s，{report['deletion_api_calls']} 次调用")
+    print(f"LLM 请求:           {report['llm_requests']}  tokens {report['llm_prompt_tokens']}+{report['llm_completion_tokens']}"
+          f"  注入错误 {report['llm_injected_errors']}")
+    print(f"峰值 RSS:           {report['peak_rss_mib']} MiB")
+    if "tracemalloc_peak_mib" in report:
+        print(f"tracemalloc 峰值:   {report['tracemalloc_peak_mib']} MiB")
+    if "profile" in report:
+        print(f"剖析（墙钟/CPU）:   {report['profile']['samples']} 个采样")
+        for line in format_timings(report["profile"]["timings"]):
+            print(f"  {line}")
+        for path in report["profile"]["files"]:
+            print(f"  {path}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="使用本机假 Bot API 与假 LLM 服务器压测机器人")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--spam-ratio", type=float, default=0.3)
+    parser.add_argument("--reaction-ratio", type=float, default=0.1)
+    parser.add_argument("--rate", type=float, default=0, help="每秒注入的更新数，0 表示一次性注入")
+    parser.add_argument("--replay", nargs="+", metavar="PATH", help="回放录制的分段（文件或目录），代替合成更新流")
+    parser.add_argument("--speed", type=float, default=0, help="回放速度倍数，1 为原速，0 为最快")
+    parser.add_argument("--api-latency", type=float, default=0.02)
+    parser.add_argument("--api-error-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--batch", action="store_true", help="启用 LLM 微批处理")
+    parser.add_argument("--unthrottled", action="store_true", help="去掉出站限流")
+    parser.add_argument("--storage", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--tracemalloc", action="store_true", help="统计 Python 分配峰值（有额外开销）")
+    parser.add_argument("--profile", choices=["sample", "cprofile"], help="压测期间剖析处理器与定时任务")
+    parser.add_argument("--profile-dir", default="logs", help="剖析结果的输出目录")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--keep", action="store_true", help="保留临时数据与日志目录")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bot-loadtest-")
+    os.environ.update({
+        "BOT_TOKEN": "123456:loadtest",
+        "DATA_DIR": os.path.join(workdir, "data"),
+        "LOG_DIR": os.path.join(workdir, "logs"),
+        "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING"),
+        "STORAGE_BACKEND": args.storage,
+    })
+    for name in ("SHARD_INDEX", "SQLITE_PATH", "RECORD_UPDATES_DIR", "METRICS_PORT"):
+        os.environ.pop(name, None)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import bot
+
+    if args.unthrottled:
+        bot.rate_limit_config.update({
+            "overall_per_second": 1_000_000, "chat_per_second": 1_000_000,
+            "chat_burst": 1_000_000, "group_messages_per_minute": 1_000_000
+        })
+    if args.replay:
+        raw_updates, offsets = load_recording(args.replay)
+        if not raw_updates:
+            parser.error("录制中没有可回放的更新")
+        chats = chats_of(raw_updates)
+    else:
+        chats = [-1001000000000 - i for i in range(args.chats)]
+        raw_updates = make_updates(args.updates, chats, args.spam_ratio, args.reaction_ratio, args.seed)
+        offsets = None
+    report = asyncio.run(run_benchmark(bot, args, raw_updates, chats, offsets))
+    print_report(report)
+    if args.keep:
+        print(f"数据与日志:         {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
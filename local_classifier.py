@@ -0,0 +1,297 @@
+"""
+本地轻量分类器
+
+哈希 n-gram 特征 + 多项式朴素贝叶斯，纯 Python 实现。
+从 LLM 结论与群成员的 💩/👎 反应中增量学习，判定余量足够大时替代 LLM 调用。
+朴素贝叶斯在哈希 n-gram 上的后验概率几乎总是接近 0 或 1，因此门限使用按特征数归一化的
+对数几率差（平均每个特征对结论的支持度），特征少或两类特征混杂的消息余量小，交给 LLM。
+训练样本追加写入 JSONL，超过 max_samples 一定比例后自动压缩，可离线重新训练；模型快照保存为 JSON。
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from verdict_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+LABELS = ("DELETE", "KEEP")
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_URL_RE = re.compile(r"(https?://\S+|www\.\S+|t\.me/\S+)")
+
+
+def extract_features(text: str, n_features: int) -> Dict[int, int]:
+    """词 1/2-gram 与字符 3-gram 的哈希特征计数"""
+    text = normalize_text(text)
+    text = _URL_RE.sub(" __url__ ", text)
+    tokens = _TOKEN_RE.findall(text)
+    grams: List[str] = [f"w:{t}" for t in tokens]
+    grams.extend(f"b:{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    compact = "".join(tokens)
+    grams.extend(f"c:{compact[i:i + 3]}" for i in range(max(0, len(compact) - 2)))
+
+    features: Dict[int, int] = {}
+    for gram in grams:
+        index = zlib.crc32(gram.encode("utf-8")) % n_features
+        features[index] = features.get(index, 0) + 1
+    return features
+
+
+class LocalClassifier:
+    """可增量训练的多项式朴素贝叶斯分类器"""
+
+    def __init__(self, n_features: int = 1 << 18, alpha: float = 1.0) -> None:
+        self.n_features = n_features
+        self.alpha = alpha
+        self.doc_counts: Dict[str, float] = {label: 0.0 for label in LABELS}
+        self.total_counts: Dict[str, float] = {label: 0.0 for label in LABELS}
+        self.feature_counts: Dict[str, Dict[int, float]] = {label: {} for label in LABELS}
+
+    @property
+    def samples(self) -> int:
+        return int(sum(self.doc_counts.values()))
+
+    def ready(self, min_samples: int) -> bool:
+        """每个类别都至少有 min_samples 个样本时才参与判定"""
+        return all(self.doc_counts[label] >= min_samples for label in LABELS)
+
+    def learn(self, text: str, label: str, weight: float = 1.0) -> None:
+        if label not in LABELS:
+            return
+        counts = self.feature_counts[label]
+        for index, count in extract_features(text, self.n_features).items():
+            counts[index] = counts.get(index, 0.0) + count * weight
+            self.total_counts[label] += count * weight
+        self.doc_counts[label] += weight
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """返回 (标签, 余量)，余量为两类对数得分之差除以消息的特征数"""
+        features = extract_features(text, self.n_features)
+        total_docs = sum(self.doc_counts.values())
+        scores = {}
+        for label in LABELS:
+            prior = (self.doc_counts[label] + 1) / (total_docs + len(LABELS))
+            denominator = self.total_counts[label] + self.alpha * self.n_features
+            counts = self.feature_counts[label]
+            score = math.log(prior)
+            for index, count in features.items():
+                score += count * math.log((counts.get(index, 0.0) + self.alpha) / denominator)
+            scores[label] = score
+        best = max(scores, key=scores.get)
+        runner_up = max(score for label, score in scores.items() if label != best)
+        return best, (scores[best] - runner_up) / max(1, sum(features.values()))
+
+    def to_dict(self) -> Dict:
+        return {
+            "n_features": self.n_features,
+            "alpha": self.alpha,
+            "doc_counts": dict(self.doc_counts),
+            "total_counts": dict(self.total_counts),
+            "feature_counts": {
+                label: {str(k): v for k, v in counts.items()} for label, counts in self.feature_counts.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "LocalClassifier":
+        model = cls(n_features=data["n_features"], alpha=data["alpha"])
+        model.doc_counts.update(data["doc_counts"])
+        model.total_counts.update(data["total_counts"])
+        for label, counts in data["feature_counts"].items():
+            model.feature_counts[label] = {int(k): v for k, v in counts.items()}
+        return model
+
+
+class LocalModelManager:
+    """管理在线模型、训练样本日志与磁盘快照"""
+
+    # 人工反应比 LLM 结论更可信，训练时赋予更高权重
+    SOURCE_WEIGHTS = {"llm": 1.0, "reaction": 3.0}
+    # 样本文件行数超过 max_samples 的这一比例后压缩回 max_samples
+    COMPACT_RATIO = 1.25
+
+    def __init__(self, model_path: Optional[str] = None, samples_path: Optional[str] = None,
+                 max_samples: int = 50000) -> None:
+        self.model_path = model_path
+        self.samples_path = samples_path
+        self.max_samples = max_samples
+        self.model = LocalClassifier()
+        self.hits = 0
+        self._pending: List[Dict[str, str]] = []
+        # 样本文件当前行数，首次写入时统计
+        self._sample_lines: Optional[int] = None
+        # 重训在线程中进行：_lock 保护待写样本与模型替换，_io_lock 串行化样本文件的追加与重写
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        # 重训期间新学到的样本，重训结束后补学到新模型上
+        self._learned_during_retrain: Optional[List[Dict[str, str]]] = None
+        # 写快照期间模型冻结，新样本暂存于此，复制完成后再学习；事件循环不必等待复制
+        self._deferred: Optional[List[Dict[str, str]]] = None
+
+    def learn(self, text: str, label: str, source: str = "llm") -> None:
+        """在线学习并记录样本，样本在 flush_samples 时写入磁盘"""
+        if not text or label not in LABELS:
+            return
+        sample = {"text": text, "label": label, "source": source}
+        with self._lock:
+            if self._deferred is not None:
+                self._deferred.append(sample)
+            else:
+                self.model.learn(text, label, self.SOURCE_WEIGHTS.get(source, 1.0))
+            self._pending.append(sample)
+            if self._learned_during_retrain is not None:
+                self._learned_during_retrain.append(sample)
+
+    def predict(self, text: str, min_margin: float, min_samples: int) -> Optional[str]:
+        """余量达到 min_margin 时返回标签，否则返回 None 表示需要咨询 LLM"""
+        if not self.model.ready(min_samples):
+            return None
+        label, margin = self.model.predict(text)
+        if margin < min_margin:
+            return None
+        self.hits += 1
+        return label
+
+    def _take_pending(self) -> List[Dict[str, str]]:
+        with self._lock:
+            pending, self._pending = self._pending, []
+        return pending
+
+    @staticmethod
+    def _write_samples(path: str, samples: List[Dict[str, str]], mode: str = 'a') -> None:
+        with open(path, mode, encoding='utf-8') as f:
+            for sample in samples:
+                f.write(json.dumps(sample, ensure_ascii=False) + "\n")
+
+    def _count_sample_lines(self) -> int:
+        if self._sample_lines is None:
+            self._sample_lines = 0
+            if os.path.exists(self.samples_path):
+                with open(self.samples_path, 'rb') as f:
+                    self._sample_lines = sum(1 for _ in f)
+        return self._sample_lines
+
+    def _compact_samples(self) -> List[Dict[str, str]]:
+        """去重并只保留最近 max_samples 个样本，原子替换样本文件（持有 _io_lock 时调用）"""
+        samples = list(self._read_samples().values())[-self.max_samples:]
+        if self.samples_path:
+            tmp_path = f"{self.samples_path}.tmp"
+            self._write_samples(tmp_path, samples, mode='w')
+            os.replace(tmp_path, self.samples_path)
+            self._sample_lines = len(samples)
+        return samples
+
+    def flush_samples(self) -> None:
+        """追加写出待写样本，文件过长时压缩；重训进行中时等待其完成，以免样本被重写的文件覆盖"""
+        if not self.samples_path:
+            return
+        with self._io_lock:
+            pending = self._take_pending()
+            if not pending:
+                return
+            try:
+                lines = self._count_sample_lines()
+                self._write_samples(self.samples_path, pending)
+                self._sample_lines = lines + len(pending)
+                if self._sample_lines > self.max_samples * self.COMPACT_RATIO:
+                    kept = len(self._compact_samples())
+                    logger.info(f"[本地模型] 训练样本已压缩为 {kept} 条")
+            except Exception as e:
+                self._sample_lines = None
+                logger.error(f"[本地模型] 写入训练样本失败: {e}")
+
+    def _read_samples(self) -> "OrderedDict[str, Dict[str, str]]":
+        """读取样本，同一规范化文本只保留最后一次标注"""
+        samples: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        if not self.samples_path or not os.path.exists(self.samples_path):
+            return samples
+        with open(self.samples_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    sample = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                key = normalize_text(sample.get("text", ""))
+                if not key or sample.get("label") not in LABELS:
+                    continue
+                # 人工标注不被之后的 LLM 结论覆盖
+                previous = samples.get(key)
+                if previous is not None and previous.get("source") == "reaction" and sample.get("source") != "reaction":
+                    continue
+                samples.pop(key, None)
+                samples[key] = sample
+        return samples
+
+    def retrain(self) -> int:
+        """从样本日志离线重新训练并压缩日志，返回训练样本数（在线程中调用）"""
+        with self._io_lock:
+            with self._lock:
+                # 与开始记录重训期间样本在同一临界区内取走待写样本，样本不会遗漏也不会重复
+                pending, self._pending = self._pending, []
+                self._learned_during_retrain = []
+            try:
+                if self.samples_path and pending:
+                    self._write_samples(self.samples_path, pending)
+                samples = self._compact_samples()
+                model = LocalClassifier(self.model.n_features, self.model.alpha)
+                for sample in samples:
+                    model.learn(sample["text"], sample["label"], self.SOURCE_WEIGHTS.get(sample.get("source"), 1.0))
+                with self._lock:
+                    # 重训期间学到的样本仍在待写列表中，之后照常追加到新的样本文件
+                    for sample in self._learned_during_retrain:
+                        model.learn(sample["text"], sample["label"], self.SOURCE_WEIGHTS.get(sample["source"], 1.0))
+                    self.model = model
+            finally:
+                with self._lock:
+                    self._learned_during_retrain = None
+        logger.info(f"[本地模型] 离线重训完成，样本数 {len(samples)}")
+        return len(samples)
+
+    def load(self) -> None:
+        if not self.model_path or not os.path.exists(self.model_path):
+            return
+        try:
+            with open(self.model_path, 'r', encoding='utf-8') as f:
+                self.model = LocalClassifier.from_dict(json.load(f))
+            logger.info(f"[本地模型] 已加载模型快照，样本数 {self.model.samples}")
+        except Exception as e:
+            logger.warning(f"[本地模型] 加载模型快照失败: {e}")
+
+    def write_snapshot(self) -> None:
+        """写出待写样本与模型快照（在线程中调用）
+
+        复制模型时不持有 _lock：短暂加锁冻结模型，期间 learn 只暂存样本，复制完成后补学。
+        持有 _io_lock，重训不会在此期间替换模型。
+        """
+        self.flush_samples()
+        if not self.model_path:
+            return
+        tmp_path = f"{self.model_path}.tmp"
+        with self._io_lock:
+            with self._lock:
+                self._deferred = []
+                model = self.model
+            try:
+                data = model.to_dict()
+            finally:
+                with self._lock:
+                    for sample in self._deferred:
+                        model.learn(sample["text"], sample["label"], self.SOURCE_WEIGHTS.get(sample["source"], 1.0))
+                    self._deferred = None
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.model_path)
+        except Exception as e:
+            logger.error(f"[本地模型] 保存模型快照失败: {e}")
+
+    def save(self) -> None:
+        """同步保存模型快照并写出待写样本"""
+        self.write_snapshot()
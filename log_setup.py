@@ -0,0 +1,234 @@
+"""
+日志管道
+
+所有日志记录先经 QueueHandler 放入内存队列，由 QueueListener 的后台线程完成格式化、
+写控制台与写文件，事件循环上只剩级别判断与一次字符串合并：
+- 文件为每行一个 JSON 对象（时间、级别、分类、标签、消息、异常），也可改为纯文本
+- 当前文件超过大小上限或到达轮转周期时改名并用 gzip 压缩，只保留最近的若干个
+- 分类即 logger 名称（如 bot.classify、llm_client、httpx），可分别设置级别
+- 高频分类可按比例采样，WARNING 及以上的记录不参与采样
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import shutil
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# 未单独配置时压低的高频第三方分类：httpx 每个请求、apscheduler 每次任务执行都会记一条 INFO
+DEFAULT_LEVELS = {"httpx": "WARNING", "apscheduler": "WARNING"}
+
+_TAG = re.compile(r"^\[([^\]]+)\]\s*")
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def parse_pairs(spec: str) -> Dict[str, str]:
+    """解析 "a=1,b.c=2" 形式的配置"""
+    pairs: Dict[str, str] = {}
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        if sep and name.strip() and value.strip():
+            pairs[name.strip()] = value.strip()
+    return pairs
+
+
+class JsonFormatter(logging.Formatter):
+    """每条记录一行 JSON；消息开头的 [标签] 单独放在 tag 字段"""
+
+    def __init__(self, static_fields: Optional[Dict[str, Any]] = None) -> None:
+        super().__init__()
+        self.static_fields = static_fields or {}
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        match = _TAG.match(message)
+        if match:
+            entry["tag"] = match.group(1)
+            message = message[match.end():]
+        entry["msg"] = message
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        entry.update(self.static_fields)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """按分类采样：rates 为 {logger 名前缀: 保留比例}，最长前缀优先；按计数确定性保留，不用随机数"""
+
+    def __init__(self, rates: Dict[str, float]) -> None:
+        super().__init__()
+        self.rates = {name: min(1.0, max(0.0, rate)) for name, rate in rates.items()}
+        self._credit: Dict[str, float] = {}
+        self.dropped = 0
+
+    def _rate_for(self, name: str) -> Optional[str]:
+        while name:
+            if name in self.rates:
+                return name
+            name = name.rpartition(".")[0]
+        return None
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        category = self._rate_for(record.name)
+        if category is None:
+            return True
+        # 初始额度使每个分类的第一条记录总被保留
+        credit = self._credit.get(category, 1.0 - self.rates[category]) + self.rates[category]
+        if credit >= 1.0:
+            self._credit[category] = credit - 1.0
+            return True
+        self._credit[category] = credit
+        self.dropped += 1
+        return False
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """只在事件循环上合并消息参数，格式化与异常堆栈留给写入线程"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class CompressingRotatingFileHandler(logging.handlers.BaseRotatingHandler):
+    """按大小或时间轮转的文件；轮转下来的文件以时间命名并用 gzip 压缩，超出 backup_count 的最早文件被删除"""
+
+    def __init__(self, filename: str, max_bytes: int = 50 * 1024 * 1024, interval_seconds: float = 86400,
+                 backup_count: int = 14, encoding: str = "utf-8") -> None:
+        super().__init__(filename, "a", encoding=encoding, delay=False)
+        self.max_bytes = max_bytes
+        self.interval_seconds = interval_seconds
+        self.backup_count = backup_count
+        self.rollover_at = time.time() + interval_seconds if interval_seconds > 0 else float("inf")
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.stream is None or self.stream.tell() == 0:
+            return False
+        if time.time() >= self.rollover_at:
+            return True
+        return self.max_bytes > 0 and self.stream.tell() >= self.max_bytes
+
+    def doRollover(self) -> None:
+        self.stream.close()
+        self.stream = None
+        root, ext = os.path.splitext(self.baseFilename)
+        # 带微秒的时间戳按字典序即时间顺序，同一秒内多次轮转也不会重名
+        target = f"{root}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{ext}"
+        os.replace(self.baseFilename, target)
+        with open(target, "rb") as src, gzip.open(target + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(target)
+        self._prune(root, ext)
+        if self.interval_seconds > 0:
+            self.rollover_at = time.time() + self.interval_seconds
+        self.stream = self._open()
+
+    def rotated_files(self) -> List[str]:
+        root, ext = os.path.splitext(self.baseFilename)
+        return self._rotated(root, ext)
+
+    @staticmethod
+    def _rotated(root: str, ext: str) -> List[str]:
+        directory, prefix = os.path.split(root)
+        names = sorted(
+            name for name in os.listdir(directory)
+            if name.startswith(prefix + "-") and name.endswith(ext + ".gz")
+        )
+        return [os.path.join(directory, name) for name in names]
+
+    def _prune(self, root: str, ext: str) -> None:
+        rotated = self._rotated(root, ext)
+        for path in rotated[:max(0, len(rotated) - self.backup_count)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def setup_logging(log_dir: str, name: str = "bot", level: str = "INFO", levels: Optional[Dict[str, str]] = None,
+                  sampling: Optional[Dict[str, float]] = None, max_bytes: int = 50 * 1024 * 1024,
+                  interval_seconds: float = 86400, backup_count: int = 14, file_format: str = "json",
+                  static_fields: Optional[Dict[str, Any]] = None, console: bool = True) -> SamplingFilter:
+    """替换根 logger 的处理器为队列管道，日志写入 log_dir/<name>.log；返回采样过滤器便于查看丢弃数"""
+    global _listener
+    stop_logging()
+    os.makedirs(log_dir, exist_ok=True)
+
+    file_handler = CompressingRotatingFileHandler(
+        os.path.join(log_dir, f"{name}.log"),
+        max_bytes=max_bytes, interval_seconds=interval_seconds, backup_count=backup_count
+    )
+    file_handler.setFormatter(
+        JsonFormatter(static_fields) if file_format == "json" else logging.Formatter(TEXT_FORMAT)
+    )
+    handlers: List[logging.Handler] = [file_handler]
+    if console:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(stream_handler)
+
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    sampler = SamplingFilter(sampling or {})
+    queue_handler.addFilter(sampler)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    root.setLevel(getattr(logging, level.upper()))
+    for category, category_level in dict(DEFAULT_LEVELS, **(levels or {})).items():
+        logging.getLogger(category).setLevel(getattr(logging, category_level.upper()))
+
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    return sampler
+
+
+def stop_logging() -> None:
+    """写完队列中的记录并关闭文件；进程退出时自动调用"""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
+
+
+def setup_logging_from_env(name: str = "bot", static_fields: Optional[Dict[str, Any]] = None) -> SamplingFilter:
+    """按 LOG_* 环境变量配置日志管道"""
+    return setup_logging(
+        os.getenv("LOG_DIR", "logs"),
+        name=name,
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        levels=parse_pairs(os.getenv("LOG_LEVELS", "")),
+        sampling={category: float(rate) for category, rate in parse_pairs(os.getenv("LOG_SAMPLING", "")).items()},
+        max_bytes=int(float(os.getenv("LOG_MAX_MB", "50")) * 1024 * 1024),
+        interval_seconds=float(os.getenv("LOG_ROTATE_HOURS", "24")) * 3600,
+        backup_count=int(os.getenv("LOG_BACKUPS", "14")),
+        file_format=os.getenv("LOG_FILE_FORMAT", "json").lower(),
+        static_fields=static_fields,
+    )
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,348 @@
+"""
+运行指标
+
+进程内的计数器、仪表与直方图，按 Prometheus 文本格式在本机 HTTP /metrics 暴露，
+/perf 命令读取同一份数据给出摘要。所有记录都在事件循环线程中进行，不需要加锁；
+删除队列深度这类需要查询存储的指标由采集回调在每次抓取时刷新。
+
+未安装 prometheus_client 时也能使用，输出格式与其兼容，可直接被 Prometheus 抓取。
+"""
+
+import functools
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "tgbot_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# 处理器与 Bot API 调用的延迟分布（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# LLM 请求与定时任务耗时较长
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+    def labels(self, *values: Any) -> Any:
+        """按标签值取出子指标，首次使用时创建"""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} 需要标签 {self.labelnames}，实际传入 {values}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def items(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        return list(self._children.items())
+
+    def clear(self) -> None:
+        self._children.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in sorted(self._children.items()):
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values: Tuple[str, ...], child: Any) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}"]
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def total(self) -> float:
+        return sum(child.value for child in self._children.values())
+
+
+class Gauge(_Metric):
+    """可以任意设置的当前值"""
+
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def merge(self, other: "_HistogramValue") -> None:
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q: float) -> float:
+        """按桶内线性插值估计分位数（与 PromQL histogram_quantile 相同），落在 +Inf 桶时返回最大有限边界"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(self.bounds, self.counts):
+            if bound == math.inf:
+                return lower
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return lower
+
+
+class Histogram(_Metric):
+    """按固定桶统计的分布，附带总和与次数"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets)) + (math.inf,)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def merged(self) -> _HistogramValue:
+        """所有标签合并后的分布"""
+        total = _HistogramValue(self.bounds)
+        for child in self._children.values():
+            total.merge(child)
+        return total
+
+    def _render_child(self, values: Tuple[str, ...], child: _HistogramValue) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(child.bounds, child.counts):
+            cumulative += count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    """指标集合；采集回调在每次抓取前运行，用于刷新需要查询的仪表"""
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Awaitable[None]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"指标 {metric.name} 已注册")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]) -> None:
+        self._collectors.append(collector)
+
+    async def collect(self) -> None:
+        for collector in self._collectors:
+            try:
+                await collector()
+            except Exception as e:
+                logger.error(f"[指标] Collector {getattr(collector, '__name__', collector)} failed: {e}")
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def _register(metric: _Metric) -> Any:
+    return REGISTRY.register(metric)
+
+
+HANDLER_DURATION: Histogram = _register(Histogram(
+    "handler_duration_seconds", "Time spent in update handler callbacks.", ["handler"]
+))
+HANDLER_ERRORS: Counter = _register(Counter(
+    "handler_errors_total", "Exceptions raised by update handler callbacks.", ["handler"]
+))
+LLM_DURATION: Histogram = _register(Histogram(
+    "llm_request_duration_seconds", "Latency of LLM chat completion requests.", ["outcome"], buckets=SLOW_BUCKETS
+))
+LLM_TOKENS: Counter = _register(Counter(
+    "llm_tokens_total", "Tokens reported in LLM responses.", ["kind"]
+))
+LLM_ERRORS: Counter = _register(Counter(
+    "llm_errors_total", "Failed LLM requests by reason.", ["reason"]
+))
+BOT_API_DURATION: Histogram = _register(Histogram(
+    "bot_api_request_duration_seconds", "Latency of Bot API requests, excluding rate limiter waits.", ["endpoint"]
+))
+BOT_API_WAIT: Histogram = _register(Histogram(
+    "bot_api_rate_limit_wait_seconds", "Time Bot API requests waited in the rate limiter.", ["priority"]
+))
+BOT_API_ERRORS: Counter = _register(Counter(
+    "bot_api_errors_total", "Failed Bot API requests by endpoint and error type.", ["endpoint", "error"]
+))
+BOT_API_RETRY_AFTER: Counter = _register(Counter(
+    "bot_api_retry_after_total", "RetryAfter (flood wait) responses by endpoint.", ["endpoint"]
+))
+QUEUE_DEPTH: Gauge = _register(Gauge(
+    "deletion_queue_depth", "Messages waiting for deletion per chat.", ["chat_id"]
+))
+QUEUE_OLDEST_AGE: Gauge = _register(Gauge(
+    "deletion_queue_oldest_age_seconds", "Age of the oldest pending message with a known date per chat.", ["chat_id"]
+))
+JOB_DURATION: Histogram = _register(Histogram(
+    "job_duration_seconds", "Duration of job queue callbacks.", ["job"], buckets=SLOW_BUCKETS
+))
+JOB_ERRORS: Counter = _register(Counter(
+    "job_errors_total", "Exceptions raised by job queue callbacks.", ["job"]
+))
+JOB_LAST_SUCCESS: Gauge = _register(Gauge(
+    "job_last_success_timestamp_seconds", "Unix time of the last successful run of each job.", ["job"]
+))
+
+
+def _timed(callback: Callable[..., Awaitable[Any]], name: str, duration: Histogram,
+           errors: Counter, on_success: Optional[Callable[[str], None]] = None) -> Callable[..., Awaitable[Any]]:
+    @functools.wraps(callback)
+    async def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await callback(*args, **kwargs)
+        except Exception:
+            errors.labels(name).inc()
+            raise
+        finally:
+            duration.labels(name).observe(time.perf_counter() - started)
+        if on_success is not None:
+            on_success(name)
+        return result
+
+    wrapper.__wrapped_metrics__ = True
+    return wrapper
+
+
+def instrument_handlers(application: Any) -> None:
+    """给已注册的所有处理器回调计时，按回调函数名分类"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            callback = handler.callback
+            if getattr(callback, "__wrapped_metrics__", False):
+                continue
+            handler.callback = _timed(callback, callback.__name__, HANDLER_DURATION, HANDLER_ERRORS)
+
+
+def timed_job(callback: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    """定时任务回调的装饰器：记录耗时、异常与最近一次成功时间"""
+    return _timed(
+        callback, callback.__name__, JOB_DURATION, JOB_ERRORS,
+        on_success=lambda name: JOB_LAST_SUCCESS.labels(name).set(time.time())
+    )
+
+
+class MetricsServer:
+    """本机 HTTP 服务器，GET /metrics 返回文本格式的指标"""
+
+    def __init__(self, registry: Registry = REGISTRY, listen: str = "127.0.0.1", port: int = 9464) -> None:
+        self.registry = registry
+        self.listen = listen
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        return app
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        await self.registry.collect()
+        return web.Response(body=self.registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self) -> None:
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"[指标] Serving /metrics on {self.listen}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
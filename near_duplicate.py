@@ -0,0 +1,145 @@
+"""
+近似重复消息检测
+
+对消息计算 64 位 SimHash，按群组维护最近被判定为 DELETE 的消息窗口，
+使用 LSH 分段（鸽巢原理：汉明距离 <= k 时，k+1 段中至少有一段完全相同）
+快速找出候选，再校验汉明距离。
+"""
+
+import hashlib
+import re
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from verdict_cache import normalize_text
+
+_URL_RE = re.compile(r"(https?://\S+|www\.\S+|t\.me/\S+)")
+# 去掉标点、符号与 emoji，只保留文字和数字
+_NOISE_RE = re.compile(r"[^\w]+")
+
+HASH_BITS = 64
+
+
+def _canonical(text: str) -> str:
+    text = normalize_text(text)
+    text = _URL_RE.sub(" url ", text)
+    return _NOISE_RE.sub(" ", text).strip()
+
+
+def _features(text: str, size: int = 4) -> List[str]:
+    compact = text.replace(" ", "")
+    if len(compact) <= size:
+        return [compact] if compact else []
+    return [compact[i:i + size] for i in range(len(compact) - size + 1)]
+
+
+def simhash(text: str) -> int:
+    """计算文本的 64 位 SimHash（基于字符 4-gram）"""
+    weights = [0] * HASH_BITS
+    for feature in _features(_canonical(text)):
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(HASH_BITS):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    value = 0
+    for bit in range(HASH_BITS):
+        if weights[bit] > 0:
+            value |= 1 << bit
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class _GroupWindow:
+    __slots__ = ("entries", "order", "bands", "next_id")
+
+    def __init__(self, band_count: int) -> None:
+        # entry_id -> (simhash, 加入时间)
+        self.entries: Dict[int, Tuple[int, float]] = {}
+        self.order: Deque[int] = deque()
+        self.bands: List[Dict[int, Set[int]]] = [{} for _ in range(band_count)]
+        self.next_id = 0
+
+
+class NearDuplicateIndex:
+    """按群组维护有界窗口的 SimHash 近似重复索引"""
+
+    def __init__(self, max_distance: int = 10, window_size: int = 500,
+                 window_seconds: float = 3600, min_length: int = 20) -> None:
+        self.max_distance = max(0, min(int(max_distance), 15))
+        self.window_size = max(1, int(window_size))
+        self.window_seconds = float(window_seconds)
+        self.min_length = int(min_length)
+        self.band_count = self.max_distance + 1
+        self.hits = 0
+        self._groups: Dict[int, _GroupWindow] = {}
+
+    def _band_keys(self, value: int) -> List[int]:
+        keys = []
+        for band in range(self.band_count):
+            start = band * HASH_BITS // self.band_count
+            end = (band + 1) * HASH_BITS // self.band_count
+            keys.append((value >> start) & ((1 << (end - start)) - 1))
+        return keys
+
+    def _eligible(self, text: str) -> bool:
+        return len(_canonical(text).replace(" ", "")) >= self.min_length
+
+    def _evict(self, window: _GroupWindow, now: float) -> None:
+        while window.order:
+            entry_id = window.order[0]
+            _, added_at = window.entries[entry_id]
+            if len(window.order) <= self.window_size and now - added_at <= self.window_seconds:
+                break
+            window.order.popleft()
+            value, _ = window.entries.pop(entry_id)
+            for band, key in enumerate(self._band_keys(value)):
+                bucket = window.bands[band].get(key)
+                if bucket is not None:
+                    bucket.discard(entry_id)
+                    if not bucket:
+                        del window.bands[band][key]
+
+    def add(self, chat_id: int, text: str) -> None:
+        """记录一条被判定为 DELETE 的消息"""
+        if not self._eligible(text):
+            return
+        window = self._groups.get(chat_id)
+        if window is None:
+            window = self._groups[chat_id] = _GroupWindow(self.band_count)
+        now = time.time()
+        value = simhash(text)
+        entry_id = window.next_id
+        window.next_id += 1
+        window.entries[entry_id] = (value, now)
+        window.order.append(entry_id)
+        for band, key in enumerate(self._band_keys(value)):
+            window.bands[band].setdefault(key, set()).add(entry_id)
+        self._evict(window, now)
+
+    def find(self, chat_id: int, text: str) -> Optional[int]:
+        """返回窗口内最接近的汉明距离；不存在近似重复时返回 None"""
+        window = self._groups.get(chat_id)
+        if window is None or not self._eligible(text):
+            return None
+        self._evict(window, time.time())
+        value = simhash(text)
+        candidates: Set[int] = set()
+        for band, key in enumerate(self._band_keys(value)):
+            candidates |= window.bands[band].get(key, set())
+        best = None
+        for entry_id in candidates:
+            distance = hamming_distance(value, window.entries[entry_id][0])
+            if distance <= self.max_distance and (best is None or distance < best):
+                best = distance
+        if best is not None:
+            self.hits += 1
+        return best
+
+    def clear(self) -> None:
+        self._groups.clear()
+
+    def __len__(self) -> int:
+        return sum(len(w.entries) for w in self._groups.values())
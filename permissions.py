@@ -0,0 +1,139 @@
+"""
+群组权限
+
+- PermissionTable：机器人在各群组中的删除权限，由 my_chat_member 更新实时维护，
+  低频对账任务只检查长时间没有收到更新的群组，并以有限并发调用 get_chat_member。
+- AdminRosterCache：各群组的管理员名单，来自 get_chat_administrators，带 TTL，
+  收到 chat_member 更新时失效，管理员命令的权限检查因此只需本地查表。
+  机器人自身的删除权限不查此名单，以 get_chat_member 与 my_chat_member 更新为准。
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram import ChatMember, ChatMemberAdministrator, ChatMemberOwner
+
+logger = logging.getLogger(__name__)
+
+
+def member_can_delete(member: ChatMember) -> bool:
+    """群主总能删除消息，管理员取决于 can_delete_messages，其他身份不能"""
+    if isinstance(member, ChatMemberOwner):
+        return True
+    if isinstance(member, ChatMemberAdministrator):
+        return bool(member.can_delete_messages)
+    return False
+
+
+class PermissionTable:
+    """chat_id -> (能否删除消息, 最后确认时间)"""
+
+    def __init__(self) -> None:
+        self._can_delete: Dict[int, bool] = {}
+        self._checked_at: Dict[int, float] = {}
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._can_delete
+
+    def get(self, chat_id: int) -> Optional[bool]:
+        return self._can_delete.get(chat_id)
+
+    def checked_at(self, chat_id: int) -> Optional[float]:
+        return self._checked_at.get(chat_id)
+
+    def update(self, chat_id: int, can_delete: bool, checked_at: Optional[float] = None) -> Optional[bool]:
+        """记录最新权限，返回之前的值（未知时为 None）"""
+        previous = self._can_delete.get(chat_id)
+        self._can_delete[chat_id] = can_delete
+        self._checked_at[chat_id] = time.time() if checked_at is None else checked_at
+        return previous
+
+    def forget(self, chat_id: int) -> None:
+        self._can_delete.pop(chat_id, None)
+        self._checked_at.pop(chat_id, None)
+
+    def stale(self, chat_ids: Iterable[int], max_age: float, now: Optional[float] = None) -> List[int]:
+        """超过 max_age 秒没有确认过权限的群组"""
+        now = time.time() if now is None else now
+        return [chat_id for chat_id in chat_ids if now - self._checked_at.get(chat_id, 0.0) >= max_age]
+
+
+async def reconcile(chat_ids: Iterable[int], check: Callable[[int], Awaitable[Any]],
+                    concurrency: int = 5) -> Dict[int, Any]:
+    """以最多 concurrency 个并发调用 check，返回每个群组的结果或异常"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(chat_id: int) -> Any:
+        async with semaphore:
+            try:
+                return await check(chat_id)
+            except Exception as e:
+                return e
+
+    chat_ids = list(chat_ids)
+    results = await asyncio.gather(*(run(chat_id) for chat_id in chat_ids))
+    return dict(zip(chat_ids, results))
+
+
+def is_admin_member(member: ChatMember) -> bool:
+    return isinstance(member, (ChatMemberAdministrator, ChatMemberOwner))
+
+
+class AdminRosterCache:
+    """chat_id -> ({user_id: 管理员成员信息}, 过期时间)"""
+
+    def __init__(self, ttl: float = 600) -> None:
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._rosters: Dict[int, Tuple[Dict[int, ChatMember], float]] = {}
+        # 同一群组并发的未命中只请求一次
+        self._loading: Dict[int, asyncio.Future] = {}
+
+    def invalidate(self, chat_id: int) -> None:
+        self._rosters.pop(chat_id, None)
+
+    def clear(self) -> None:
+        self._rosters.clear()
+
+    async def roster(self, chat_id: int,
+                     fetch: Callable[[int], Awaitable[Iterable[ChatMember]]]) -> Dict[int, ChatMember]:
+        cached = self._rosters.get(chat_id)
+        if cached is not None and cached[1] > time.monotonic():
+            self.hits += 1
+            return cached[0]
+        self.misses += 1
+        pending = self._loading.get(chat_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[chat_id] = future
+        try:
+            members = await fetch(chat_id)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 避免没有其他等待者时出现 "exception was never retrieved"
+            future.exception()
+            raise
+        else:
+            roster = {member.user.id: member for member in members if is_admin_member(member)}
+            self._rosters[chat_id] = (roster, time.monotonic() + self.ttl)
+            future.set_result(roster)
+            return roster
+        finally:
+            self._loading.pop(chat_id, None)
+
+    async def member(self, chat_id: int, user_id: int,
+                     fetch: Callable[[int], Awaitable[Iterable[ChatMember]]]) -> Optional[ChatMember]:
+        """用户是管理员时返回其成员信息，否则返回 None"""
+        return (await self.roster(chat_id, fetch)).get(user_id)
+
+    async def is_admin(self, chat_id: int, user_id: int,
+                       fetch: Callable[[int], Awaitable[Iterable[ChatMember]]]) -> bool:
+        return await self.member(chat_id, user_id, fetch) is not None
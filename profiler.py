@@ -0,0 +1,227 @@
+"""
+按需性能剖析
+
+平时不开启，只有在 /profile 命令或 PROFILE_ON_START 打开的固定时间窗口内才采集：
+- sample 模式（默认）：后台线程每隔 interval 秒抓取一次事件循环线程的调用栈，
+  结束时写出折叠栈文件（每行 "帧;帧;帧 次数"），可直接交给 flamegraph.pl / speedscope 生成火焰图
+- cprofile 模式：在事件循环线程上启用 cProfile，结束时写出 .prof（pstats 格式）与按累计时间排序的文本，
+  开销明显高于采样，只适合短时间使用
+- 两种模式下都按处理器与定时任务分别统计调用次数、墙钟时间与 CPU 时间：CPU 时间只计入协程自身
+  每一步的执行，等待 LLM、Bot API 或锁的时间只计入墙钟时间
+
+输出文件写入日志目录，文件名以 profile- 加开始时间为前缀。
+"""
+
+import asyncio
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter as CounterDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Generator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MODES = ("sample", "cprofile")
+# 折叠栈的最大深度，超出部分从栈底截断
+MAX_DEPTH = 128
+
+
+class _CpuTimed:
+    """逐步驱动协程，只在协程自身执行时累计线程 CPU 时间"""
+
+    __slots__ = ("coro", "cpu")
+
+    def __init__(self, coro: Awaitable[Any]) -> None:
+        self.coro = coro
+        self.cpu = 0.0
+
+    def __await__(self) -> Generator[Any, Any, Any]:
+        steps = self.coro.__await__()
+        value: Any = None
+        error: Optional[BaseException] = None
+        while True:
+            started = time.thread_time()
+            try:
+                yielded = steps.throw(error) if error is not None else steps.send(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self.cpu += time.thread_time() - started
+            value, error = None, None
+            try:
+                value = yield yielded
+            except BaseException as e:
+                error = e
+
+
+def _frame_label(frame: Any) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+class Profiler:
+    """固定时间窗口的剖析会话；同一时间只能有一个会话"""
+
+    def __init__(self, output_dir: str, interval: float = 0.005) -> None:
+        self.output_dir = output_dir
+        self.interval = interval
+        self.mode: Optional[str] = None
+        self.started_at = 0.0
+        self._stamp = ""
+        self._timings: Dict[str, Dict[str, Any]] = {}
+        self._stacks: CounterDict = CounterDict()
+        self._samples = 0
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_sampling = threading.Event()
+        self._cprofile: Optional[cProfile.Profile] = None
+
+    @property
+    def active(self) -> bool:
+        return self.mode is not None
+
+    def start(self, mode: str = "sample") -> None:
+        """开始采集（须在事件循环线程中调用）"""
+        if mode not in MODES:
+            raise ValueError(f"未知的剖析模式 {mode}，可选 {', '.join(MODES)}")
+        if self.active:
+            raise RuntimeError("已有进行中的剖析会话")
+        self.mode = mode
+        self.started_at = time.monotonic()
+        self._stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        self._timings = {}
+        self._stacks = CounterDict()
+        self._samples = 0
+        if mode == "sample":
+            self._stop_sampling.clear()
+            self._sampler = threading.Thread(
+                target=self._sample_loop, args=(threading.get_ident(),), name="profiler-sampler", daemon=True
+            )
+            self._sampler.start()
+        else:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        logger.info(f"[剖析] Started {mode} profiling")
+
+    def _sample_loop(self, thread_id: int) -> None:
+        while not self._stop_sampling.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            stack: List[str] = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            self._stacks[";".join(reversed(stack))] += 1
+            self._samples += 1
+
+    async def stop(self) -> Dict[str, Any]:
+        """结束采集并写出结果文件，返回摘要（文件路径与各处理器的计时）"""
+        if not self.active:
+            raise RuntimeError("没有进行中的剖析会话")
+        mode = self.mode
+        elapsed = time.monotonic() - self.started_at
+        profile = self._cprofile
+        if profile is not None:
+            profile.disable()
+            self._cprofile = None
+        if self._sampler is not None:
+            self._stop_sampling.set()
+            await asyncio.to_thread(self._sampler.join)
+            self._sampler = None
+        self.mode = None
+        report = {
+            "mode": mode,
+            "seconds": round(elapsed, 3),
+            "samples": self._samples,
+            "timings": self.timings(),
+        }
+        report["files"] = await asyncio.to_thread(self._write, report, profile, dict(self._stacks))
+        logger.info(f"[剖析] Finished {mode} profiling after {elapsed:.1f}s, wrote {', '.join(report['files'])}")
+        return report
+
+    def _write(self, report: Dict[str, Any], profile: Optional[cProfile.Profile],
+               stacks: Dict[str, int]) -> List[str]:
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, f"profile-{self._stamp}")
+        files = []
+        if stacks:
+            path = prefix + ".folded"
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write(f"{stack} {count}\n")
+            files.append(path)
+        if profile is not None:
+            profile.dump_stats(prefix + ".prof")
+            text = io.StringIO()
+            pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(60)
+            with open(prefix + ".txt", "w", encoding="utf-8") as f:
+                f.write(text.getvalue())
+            files += [prefix + ".prof", prefix + ".txt"]
+        path = prefix + "-timings.json"
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({key: value for key, value in report.items() if key != "files"}, f, ensure_ascii=False, indent=2)
+        files.append(path)
+        return files
+
+    def timings(self) -> Dict[str, Dict[str, Any]]:
+        return {name: dict(entry) for name, entry in self._timings.items()}
+
+    def _record(self, kind: str, name: str, wall: float, cpu: float) -> None:
+        entry = self._timings.get(name)
+        if entry is None:
+            entry = self._timings[name] = {"kind": kind, "calls": 0, "wall": 0.0, "cpu": 0.0}
+        entry["calls"] += 1
+        entry["wall"] += wall
+        entry["cpu"] += cpu
+
+    def wrap(self, callback: Callable[..., Awaitable[Any]], kind: str) -> Callable[..., Awaitable[Any]]:
+        """包装异步回调：会话进行中时记录墙钟时间与协程自身的 CPU 时间，否则直接调用"""
+        name = callback.__name__
+
+        @functools.wraps(callback)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not self.active:
+                return await callback(*args, **kwargs)
+            timed = _CpuTimed(callback(*args, **kwargs))
+            started = time.perf_counter()
+            try:
+                return await timed
+            finally:
+                if self.active:
+                    self._record(kind, name, time.perf_counter() - started, timed.cpu)
+
+        wrapper.__profiled__ = True
+        return wrapper
+
+    def job(self, callback: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+        """定时任务回调的装饰器"""
+        return self.wrap(callback, "job")
+
+    def instrument_handlers(self, application: Any) -> None:
+        """包装已注册的所有处理器回调"""
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if not getattr(handler.callback, "__profiled__", False):
+                    handler.callback = self.wrap(handler.callback, "handler")
+
+
+def format_timings(timings: Dict[str, Dict[str, Any]], limit: int = 10) -> List[str]:
+    """按墙钟时间排序的文本行：次数、墙钟与 CPU 总时间及平均值"""
+    lines = []
+    ranked = sorted(timings.items(), key=lambda item: item[1]["wall"], reverse=True)
+    for name, entry in ranked[:limit]:
+        calls = entry["calls"] or 1
+        lines.append(
+            f"{name} [{entry['kind']}]: {entry['calls']} calls, wall {entry['wall']:.3f}s "
+            f"(avg {entry['wall'] / calls * 1000:.1f}ms), cpu {entry['cpu']:.3f}s "
+            f"(avg {entry['cpu'] / calls * 1000:.1f}ms)"
+        )
+    return lines
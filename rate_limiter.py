@@ -0,0 +1,239 @@
+"""
+Bot API 出站请求限流
+
+实现 python-telegram-bot 的 BaseRateLimiter，所有经由 Application.bot 发出的请求
+都先经过这里：全局令牌桶 + 每个聊天的令牌桶（群组发消息另有每分钟上限），
+等待中的请求按优先级放行（交互式删除优先于批量任务），
+遇到 RetryAfter（flood wait）时暂停对应聊天并自动重试。
+令牌已满、未被暂停且没有请求在等待的聊天桶会定期清除，长时间运行时不会随聊天数无限增长。
+"""
+
+import asyncio
+import bisect
+import itertools
+import logging
+import time
+from datetime import timedelta
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import BOT_API_DURATION, BOT_API_ERRORS, BOT_API_RETRY_AFTER, BOT_API_WAIT
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_NORMAL: "normal", PRIORITY_BATCH: "batch"}
+
+# 计入群组发消息上限的接口
+SEND_ENDPOINTS = {"copyMessage", "copyMessages", "forwardMessage", "forwardMessages"}
+
+
+def is_send_endpoint(endpoint: str) -> bool:
+    return endpoint.startswith("send") or endpoint in SEND_ENDPOINTS
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 capacity 个"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated_at", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        # RetryAfter 期间整个桶暂停
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def delay(self, now: float) -> float:
+        """距离可以取出一个令牌还需等待的秒数"""
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        """令牌已满且没有被暂停，清除后重建的新桶与之等价"""
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class PriorityRateLimiter(BaseRateLimiter[Dict[str, Any]]):
+    """全局 + 每聊天令牌桶限流，支持优先级与 RetryAfter 自动重试
+
+    通过 ``rate_limit_args={"priority": PRIORITY_INTERACTIVE}`` 指定单个请求的优先级。
+    """
+
+    # 清除空闲聊天桶的最短间隔（秒）
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, overall_per_second: float = 30, chat_per_second: float = 1, chat_burst: float = 3,
+                 group_messages_per_minute: float = 20, max_retries: int = 3) -> None:
+        self.overall_per_second = overall_per_second
+        self.chat_per_second = chat_per_second
+        self.chat_burst = chat_burst
+        self.group_messages_per_minute = group_messages_per_minute
+        self.max_retries = max_retries
+        self.retry_after_count = 0
+
+        self._overall = TokenBucket(overall_per_second, overall_per_second)
+        self._chat_buckets: Dict[Any, TokenBucket] = {}
+        self._group_send_buckets: Dict[Any, TokenBucket] = {}
+        # 按 (优先级, 序号) 排序的等待队列
+        self._waiters: List[Tuple[int, int, asyncio.Future, List[TokenBucket]]] = []
+        self._counter = itertools.count()
+        self._last_sweep = time.monotonic()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def initialize(self) -> None:
+        """调度任务在首个请求时按需启动"""
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        for _, _, future, _ in self._waiters:
+            if not future.done():
+                future.cancel()
+        self._waiters.clear()
+
+    @property
+    def pending(self) -> int:
+        return len(self._waiters)
+
+    def _sweep(self, now: float) -> None:
+        """清除空闲的聊天桶；仍有请求在等待的桶保留"""
+        self._last_sweep = now
+        in_use = {id(bucket) for _, _, future, buckets in self._waiters if not future.done() for bucket in buckets}
+        for table in (self._chat_buckets, self._group_send_buckets):
+            idle = [key for key, bucket in table.items() if id(bucket) not in in_use and bucket.idle(now)]
+            for key in idle:
+                del table[key]
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_per_second, self.chat_burst)
+        return bucket
+
+    def _buckets_for(self, endpoint: str, data: Dict[str, Any]) -> List[TokenBucket]:
+        now = time.monotonic()
+        if now - self._last_sweep >= self.SWEEP_INTERVAL:
+            self._sweep(now)
+        buckets = [self._overall]
+        chat_id = data.get("chat_id")
+        if chat_id is None:
+            return buckets
+        buckets.append(self._chat_bucket(chat_id))
+        # 群组（负数 ID 或 @username）发消息有每分钟上限
+        is_group = not isinstance(chat_id, int) or chat_id < 0
+        if is_group and is_send_endpoint(endpoint):
+            send_bucket = self._group_send_buckets.get(chat_id)
+            if send_bucket is None:
+                rate = self.group_messages_per_minute / 60
+                send_bucket = self._group_send_buckets[chat_id] = TokenBucket(rate, self.group_messages_per_minute)
+            buckets.append(send_bucket)
+        return buckets
+
+    async def _acquire(self, buckets: List[TokenBucket], priority: int) -> None:
+        loop = asyncio.get_running_loop()
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = loop.create_task(self._dispatch())
+        future = loop.create_future()
+        bisect.insort(self._waiters, (priority, next(self._counter), future, buckets))
+        self._wakeup.set()
+        await future
+
+    async def _dispatch(self) -> None:
+        """按优先级放行可以取得全部令牌的请求，否则休眠到最早可用时间"""
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            next_wait: Optional[float] = None
+            remaining = []
+            for waiter in self._waiters:
+                _, _, future, buckets = waiter
+                if future.done():
+                    continue
+                wait = max(bucket.delay(now) for bucket in buckets)
+                if wait <= 0:
+                    for bucket in buckets:
+                        bucket.consume()
+                    future.set_result(None)
+                    continue
+                remaining.append(waiter)
+                next_wait = wait if next_wait is None else min(next_wait, wait)
+            self._waiters = remaining
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _pause(self, data: Dict[str, Any], seconds: float) -> None:
+        # 按 RetryAfter 的作用范围暂停：有聊天时暂停该聊天的桶（该聊天的所有请求都等待），否则暂停全局
+        # 请求进行期间聊天桶可能已被清除，取当前的桶（必要时重建）
+        chat_id = data.get("chat_id")
+        bucket = self._chat_bucket(chat_id) if chat_id is not None else self._overall
+        bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + seconds)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        priority = (rate_limit_args or {}).get("priority", PRIORITY_NORMAL)
+        buckets = self._buckets_for(endpoint, data)
+        attempt = 0
+        while True:
+            waited_from = time.perf_counter()
+            await self._acquire(buckets, priority)
+            started = time.perf_counter()
+            BOT_API_WAIT.labels(PRIORITY_NAMES.get(priority, priority)).observe(started - waited_from)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self.retry_after_count += 1
+                BOT_API_RETRY_AFTER.labels(endpoint).inc()
+                seconds = retry_after_seconds(e) + 0.1
+                self._pause(data, seconds)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                logger.warning(f"[限流] {endpoint} 触发 RetryAfter，{seconds:.1f}s 后第 {attempt} 次重试")
+                buckets = self._buckets_for(endpoint, data)
+            except Exception as e:
+                BOT_API_ERRORS.labels(endpoint, type(e).__name__).inc()
+                raise
+            finally:
+                BOT_API_DURATION.labels(endpoint).observe(time.perf_counter() - started)
@@ -0,0 +1,102 @@
+"""
+给待删除消息添加标记反应（setMessageReaction）
+
+请求经由 Application 的 bot 发出，复用其连接池与 PriorityRateLimiter。
+标记只入队，由每个群组的后台任务依次发送，处理器不会因限流或重试而阻塞该群组的后续更新：
+同一条消息只标记一次，洪水期间积压超过 max_pending_per_chat 时丢弃最早的标记（这些消息反正会被删除）。
+RetryAfter 由限流器负责重试；这里只对网络错误等临时失败按指数退避重试，
+消息已被删除等 BadRequest 不再重试。
+"""
+
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from rate_limiter import PRIORITY_NORMAL
+
+logger = logging.getLogger(__name__)
+
+
+class ReactionMarker:
+    """按群组后台排队发送、带重试与合并的消息标记器"""
+
+    def __init__(self, emoji: str = "🙈", max_retries: int = 3, retry_base_delay: float = 1.0,
+                 max_pending_per_chat: int = 20) -> None:
+        self.emoji = emoji
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.max_pending_per_chat = max(1, max_pending_per_chat)
+        self.marked = 0
+        self.failed = 0
+        self.dropped = 0
+        self._pending: Dict[int, "OrderedDict[int, None]"] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    async def mark(self, bot: Any, chat_id: int, message_id: int) -> None:
+        """标记消息：只入队，由群组的后台任务发送"""
+        pending = self._pending.setdefault(chat_id, OrderedDict())
+        pending[message_id] = None
+        while len(pending) > self.max_pending_per_chat:
+            pending.popitem(last=False)
+            self.dropped += 1
+        worker = self._workers.get(chat_id)
+        if worker is None or worker.done():
+            self._workers[chat_id] = asyncio.get_running_loop().create_task(self._drain(bot, chat_id))
+
+    async def _drain(self, bot: Any, chat_id: int) -> None:
+        pending = self._pending[chat_id]
+        try:
+            while pending:
+                message_id, _ = pending.popitem(last=False)
+                await self._send(bot, chat_id, message_id)
+        finally:
+            if not pending:
+                self._pending.pop(chat_id, None)
+                self._workers.pop(chat_id, None)
+
+    async def _send(self, bot: Any, chat_id: int, message_id: int) -> bool:
+        attempt = 0
+        while True:
+            try:
+                await bot.set_message_reaction(
+                    chat_id=chat_id,
+                    message_id=message_id,
+                    reaction=self.emoji,
+                    rate_limit_args={"priority": PRIORITY_NORMAL}
+                )
+                self.marked += 1
+                return True
+            except (BadRequest, Forbidden) as e:
+                # 消息已删除、反应不可用或失去权限，重试无意义
+                logger.warning(f"[标记] setMessageReaction rejected for {message_id} in {chat_id}: {e}")
+                self.failed += 1
+                return False
+            except RetryAfter as e:
+                # 限流器已按 RetryAfter 暂停并重试过，不再叠加一层重试
+                logger.warning(f"[标记] setMessageReaction flood-limited for {message_id} in {chat_id}: {e}")
+                self.failed += 1
+                return False
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    logger.warning(f"[标记] setMessageReaction failed for {message_id} in {chat_id} after {attempt + 1} attempts: {e}")
+                    self.failed += 1
+                    return False
+                delay = self.retry_base_delay * (2 ** attempt)
+                attempt += 1
+                logger.debug(f"[标记] setMessageReaction failed ({e}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def close(self) -> None:
+        workers = list(self._workers.values())
+        for worker in workers:
+            worker.cancel()
+        for worker in workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers.clear()
+        self._pending.clear()
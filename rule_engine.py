@@ -0,0 +1,224 @@
+"""
+本地规则预过滤引擎
+
+按群组维护关键词（Aho-Corasick 自动机）与正则规则，在调用 LLM 之前
+给出 DELETE / KEEP / UNSURE 结论；KEEP 规则（白名单）优先于 DELETE 规则。
+新增关键词直接插入已有 Trie，失配指针在下次匹配前按需重建；
+删除关键词只重建对应群组、对应动作的自动机。
+"""
+
+import json
+import logging
+import os
+import re
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from verdict_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+DELETE = "DELETE"
+KEEP = "KEEP"
+UNSURE = "UNSURE"
+
+ACTIONS = ("delete", "keep")
+KINDS = ("keyword", "regex")
+
+
+class AhoCorasick:
+    """多模式字符串匹配自动机，支持增量添加模式"""
+
+    def __init__(self, patterns: Optional[List[str]] = None) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[str]] = [[]]
+        # 合并了失配链输出的匹配表，由 _build 生成
+        self._matches: List[List[str]] = [[]]
+        self._dirty = False
+        for pattern in patterns or []:
+            self.add(pattern)
+
+    def add(self, pattern: str) -> None:
+        """插入模式，失配指针延迟到下次匹配前重建"""
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[node][ch] = nxt
+            node = nxt
+        if pattern not in self._output[node]:
+            self._output[node].append(pattern)
+        self._dirty = True
+
+    def _build(self) -> None:
+        # 输出链在构建时合并，匹配时无需再沿失配指针回溯
+        terminal = [list(out) for out in self._output]
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                terminal[child] = terminal[child] + [p for p in terminal[self._fail[child]] if p not in terminal[child]]
+                queue.append(child)
+        self._matches = terminal
+        self._dirty = False
+
+    def iter_matches(self, text: str) -> Iterator[str]:
+        """依次产出文本中出现的模式"""
+        if len(self._goto) == 1:
+            return
+        if self._dirty:
+            self._build()
+        goto, fail, matches = self._goto, self._fail, self._matches
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if matches[node]:
+                yield from matches[node]
+
+    def search(self, text: str) -> Optional[str]:
+        """返回第一个命中的模式，没有命中时返回 None"""
+        return next(self.iter_matches(text), None)
+
+
+class _GroupRules:
+    __slots__ = ("keywords", "regexes", "automata", "compiled")
+
+    def __init__(self) -> None:
+        self.keywords: Dict[str, List[str]] = {action: [] for action in ACTIONS}
+        self.regexes: Dict[str, List[str]] = {action: [] for action in ACTIONS}
+        self.automata: Dict[str, AhoCorasick] = {action: AhoCorasick() for action in ACTIONS}
+        self.compiled: Dict[str, Optional[re.Pattern]] = {action: None for action in ACTIONS}
+
+    def compile_regexes(self, action: str) -> None:
+        patterns = self.regexes[action]
+        self.compiled[action] = (
+            re.compile("|".join(f"(?:{p})" for p in patterns), re.IGNORECASE) if patterns else None
+        )
+
+    def to_dict(self) -> Dict[str, Dict[str, List[str]]]:
+        return {"keyword": self.keywords, "regex": self.regexes}
+
+
+class RuleEngine:
+    """按群组管理规则并给出预过滤结论"""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path
+        self.hits = {DELETE: 0, KEEP: 0}
+        self._groups: Dict[int, _GroupRules] = {}
+
+    def _group(self, chat_id: int) -> _GroupRules:
+        rules = self._groups.get(chat_id)
+        if rules is None:
+            rules = self._groups[chat_id] = _GroupRules()
+        return rules
+
+    def add_rule(self, chat_id: int, action: str, kind: str, pattern: str) -> bool:
+        """添加规则，已存在时返回 False；正则非法时抛出 re.error"""
+        rules = self._group(chat_id)
+        if kind == "keyword":
+            keyword = normalize_text(pattern)
+            if not keyword or keyword in rules.keywords[action]:
+                return False
+            rules.keywords[action].append(keyword)
+            rules.automata[action].add(keyword)
+        else:
+            re.compile(pattern)
+            if pattern in rules.regexes[action]:
+                return False
+            rules.regexes[action].append(pattern)
+            rules.compile_regexes(action)
+        return True
+
+    def remove_rule(self, chat_id: int, action: str, kind: str, pattern: str) -> bool:
+        """删除规则，不存在时返回 False"""
+        rules = self._groups.get(chat_id)
+        if rules is None:
+            return False
+        if kind == "keyword":
+            keyword = normalize_text(pattern)
+            if keyword not in rules.keywords[action]:
+                return False
+            rules.keywords[action].remove(keyword)
+            rules.automata[action] = AhoCorasick(rules.keywords[action])
+        else:
+            if pattern not in rules.regexes[action]:
+                return False
+            rules.regexes[action].remove(pattern)
+            rules.compile_regexes(action)
+        return True
+
+    def list_rules(self, chat_id: int) -> Dict[str, Dict[str, List[str]]]:
+        rules = self._groups.get(chat_id)
+        return rules.to_dict() if rules else {kind: {action: [] for action in ACTIONS} for kind in KINDS}
+
+    def match(self, chat_id: int, text: str) -> Tuple[str, Optional[str]]:
+        """返回 (结论, 命中的规则)；没有规则命中时结论为 UNSURE"""
+        rules = self._groups.get(chat_id)
+        if rules is None:
+            return UNSURE, None
+        normalized = normalize_text(text)
+        for action, verdict in (("keep", KEEP), ("delete", DELETE)):
+            keyword = rules.automata[action].search(normalized)
+            if keyword is not None:
+                self.hits[verdict] += 1
+                return verdict, keyword
+            compiled = rules.compiled[action]
+            if compiled is not None:
+                found = compiled.search(text)
+                if found:
+                    self.hits[verdict] += 1
+                    return verdict, found.group(0)
+        return UNSURE, None
+
+    def evaluate(self, chat_id: int, text: str) -> str:
+        return self.match(chat_id, text)[0]
+
+    def load(self) -> None:
+        """从磁盘加载规则，跳过非法正则"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"[规则引擎] 加载规则失败: {e}")
+            return
+        self._groups = {}
+        for chat_id, group in data.items():
+            for kind in KINDS:
+                for action in ACTIONS:
+                    for pattern in group.get(kind, {}).get(action, []):
+                        try:
+                            self.add_rule(int(chat_id), action, kind, pattern)
+                        except re.error as e:
+                            logger.warning(f"[规则引擎] 忽略非法正则 {pattern!r}: {e}")
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        data = {str(chat_id): rules.to_dict() for chat_id, rules in self._groups.items()}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"[规则引擎] 保存规则失败: {e}")
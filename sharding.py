@@ -0,0 +1,484 @@
+"""
+多进程分片
+
+监督进程（python sharding.py --shards N）负责接收更新（轮询或 webhook），按 chat_id 的哈希
+把更新路由到 N 个工作进程。工作进程就是带 SHARD_INDEX/SHARD_COUNT 环境变量启动的 bot.py，
+使用自己的数据目录 data/shard-<i>/，只持有本分片群组的删除队列、缓存与定时任务。
+
+- 首次启动时拆分 data/ 下现有的 JSON 数据：群组与删除队列按群组归属拆分，全局配置、
+  规则、本地模型与结论缓存复制到每个分片，之后各分片独立持久化
+- 进程间通过本机 TCP 连接传递换行分隔的 JSON：监督进程发给工作进程的是更新，
+  工作进程发给监督进程的是全局配置变更，由监督进程转发给其他分片
+- 工作进程退出后按指数退避重启，重启后从本分片的持久化数据恢复；离线期间发往它的更新
+  在监督进程中该分片的有界出站队列里等待，队列满时丢弃最早的更新，其他分片不受影响；
+  已转发但尚未处理完的更新会丢失
+- 每个工作进程同时处理的更新数有上限，达到上限时不再读取连接，积压经 TCP 传回监督进程
+
+分片数一经确定不能直接修改：分片数据目录记录了分片数，不一致时拒绝启动。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+import zlib
+from itertools import islice
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+from log_setup import setup_logging_from_env
+from storage import JsonStorage
+from update_processor import ALLOWED_UPDATES, PerChatUpdateProcessor
+from webhook_server import running_application, run_webhook, stop_event, webhook_from_env
+
+logger = logging.getLogger(__name__)
+
+SHARD_MARKER = "shard.json"
+# 原样复制到每个分片的文件
+SHARED_FILES = ["rules.json", "verdict_cache.json", "local_model.json", "training_samples.jsonl"]
+# 单行消息上限，远大于任何一条更新
+LINE_LIMIT = 4 * 1024 * 1024
+
+
+def shard_for(chat_id: int, count: int) -> int:
+    """chat_id 所属的分片，在所有进程中一致（不受 PYTHONHASHSEED 影响）"""
+    return zlib.crc32(str(chat_id).encode()) % count
+
+
+def base_data_dir() -> str:
+    """数据目录：DATA_DIR 环境变量，默认为代码旁的 data/；监督进程与各分片共用此解析"""
+    return os.path.abspath(os.getenv("DATA_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+
+def shard_data_dir(data_dir: str, index: int) -> str:
+    return os.path.join(data_dir, f"shard-{index}")
+
+
+def _json_storage(data_dir: str) -> JsonStorage:
+    return JsonStorage(
+        os.path.join(data_dir, 'groups.json'),
+        os.path.join(data_dir, 'deletion_queue.json'),
+        os.path.join(data_dir, 'deletion_queue.journal'),
+        os.path.join(data_dir, 'deletion_config.json'),
+    )
+
+
+def _read_marker(shard_dir: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(shard_dir, SHARD_MARKER), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def verify_shard_dir(shard_dir: str, index: int, count: int) -> None:
+    """确认分片数据目录已初始化且属于同样分片数的部署"""
+    marker = _read_marker(shard_dir)
+    if marker is None:
+        raise ValueError(f"分片数据目录 {shard_dir} 尚未初始化，请通过 sharding.py 启动")
+    if marker.get("index") != index or marker.get("count") != count:
+        raise ValueError(
+            f"分片数据目录 {shard_dir} 属于 {marker.get('count')} 个分片中的第 {marker.get('index')} 个，"
+            f"与当前的 {count} 个分片中的第 {index} 个不一致"
+        )
+
+
+def seed_shards(data_dir: str, count: int) -> Dict[int, int]:
+    """从 data_dir 的 JSON 数据初始化尚未初始化的分片，返回各新分片分到的群组数"""
+    pending: List[int] = []
+    for index in range(count):
+        marker = _read_marker(shard_data_dir(data_dir, index))
+        if marker is None:
+            pending.append(index)
+        elif marker.get("count") != count:
+            raise ValueError(
+                f"数据目录已按 {marker.get('count')} 个分片初始化，不能直接改为 {count} 个分片"
+            )
+    if not pending:
+        return {}
+
+    source = _json_storage(data_dir)
+    groups = source.load_groups()
+    config = source.load_config()
+    source.load_queue()
+    seeded: Dict[int, int] = {}
+    for index in pending:
+        shard_dir = shard_data_dir(data_dir, index)
+        os.makedirs(shard_dir, exist_ok=True)
+        target = _json_storage(shard_dir)
+        shard_groups = {chat_id: info for chat_id, info in groups.items() if shard_for(chat_id, count) == index}
+        target.save_groups(shard_groups)
+        if config:
+            target.save_config(config)
+        for chat_id, message_id, date in source.queue.items():
+            if shard_for(chat_id, count) == index:
+                target.enqueue(chat_id, message_id, date)
+        target.compact()
+        target.close()
+        for name in SHARED_FILES:
+            path = os.path.join(data_dir, name)
+            if os.path.exists(path):
+                shutil.copy2(path, os.path.join(shard_dir, name))
+        # 标记文件最后写入，中途失败的分片下次启动会重新初始化
+        with open(os.path.join(shard_dir, SHARD_MARKER), 'w', encoding='utf-8') as f:
+            json.dump({"index": index, "count": count, "seeded_at": int(time.time())}, f)
+        seeded[index] = len(shard_groups)
+    source.close()
+    return seeded
+
+
+def _encode(message: Dict[str, Any]) -> bytes:
+    return (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class ShardSupervisor:
+    """启动并看护工作进程，把更新路由到所属分片"""
+
+    def __init__(self, count: int, worker_command: Optional[List[str]] = None, host: str = "127.0.0.1",
+                 port: int = 0, restart_delay: float = 1.0, max_restart_delay: float = 60.0,
+                 max_outbound: int = 10000) -> None:
+        self.count = count
+        self.worker_command = worker_command
+        self.host = host
+        self.port = port
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.max_outbound = max(1, max_outbound)
+        self.routed = [0] * count
+        self.dropped = [0] * count
+        self.restarts = [0] * count
+        self._links: Dict[int, asyncio.StreamWriter] = {}
+        self._ready: Dict[int, asyncio.Event] = {}
+        # 每个分片的出站队列（已编码的消息），由该分片的发送任务写入连接
+        self._outbound: Dict[int, Deque[bytes]] = {index: deque() for index in range(count)}
+        self._pending: Dict[int, asyncio.Event] = {}
+        self._senders: List[asyncio.Task] = []
+        self._procs: Dict[int, asyncio.subprocess.Process] = {}
+        self._watchers: List[asyncio.Task] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._last_config: Optional[Dict[str, Any]] = None
+        self._stopping = False
+
+    async def start(self) -> None:
+        self._ready = {index: asyncio.Event() for index in range(self.count)}
+        self._pending = {index: asyncio.Event() for index in range(self.count)}
+        self._server = await asyncio.start_server(self._handle_worker, self.host, self.port, limit=LINE_LIMIT)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"[分片] Supervisor listening on {self.host}:{self.port} for {self.count} shards")
+        loop = asyncio.get_running_loop()
+        self._senders = [loop.create_task(self._pump(index)) for index in range(self.count)]
+        if self.worker_command:
+            self._watchers = [loop.create_task(self._supervise(index)) for index in range(self.count)]
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """通知工作进程退出（SIGTERM），超时后强制结束"""
+        self._stopping = True
+        for event in self._ready.values():
+            event.set()
+        procs = [proc for proc in self._procs.values() if proc.returncode is None]
+        for proc in procs:
+            proc.terminate()
+        if procs:
+            await asyncio.wait([asyncio.ensure_future(proc.wait()) for proc in procs], timeout=timeout)
+            for proc in procs:
+                if proc.returncode is None:
+                    logger.warning(f"[分片] Worker pid {proc.pid} did not exit in {timeout:.0f}s, killing it")
+                    proc.kill()
+        for task in self._watchers + self._senders:
+            task.cancel()
+        await asyncio.gather(*self._watchers, *self._senders, return_exceptions=True)
+        self._senders = []
+        unsent = sum(len(queue) for queue in self._outbound.values())
+        if unsent:
+            logger.warning(f"[分片] Discarding {unsent} unsent updates on shutdown")
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._links.values()):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _supervise(self, index: int) -> None:
+        delay = self.restart_delay
+        while not self._stopping:
+            env = dict(os.environ, SHARD_INDEX=str(index), SHARD_COUNT=str(self.count),
+                       SHARD_SUPERVISOR=f"{self.host}:{self.port}")
+            started = time.monotonic()
+            proc = await asyncio.create_subprocess_exec(*self.worker_command, env=env)
+            self._procs[index] = proc
+            logger.info(f"[分片] Started worker {index} (pid {proc.pid})")
+            code = await proc.wait()
+            if self._stopping:
+                return
+            # 正常运行一段时间后再退出的，从最短延迟重新开始退避
+            if time.monotonic() - started > self.max_restart_delay:
+                delay = self.restart_delay
+            self.restarts[index] += 1
+            logger.error(f"[分片] Worker {index} exited with code {code}, restarting in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_restart_delay)
+
+    def _drop_link(self, index: int, writer: asyncio.StreamWriter) -> None:
+        if self._links.get(index) is writer:
+            del self._links[index]
+            if not self._stopping:
+                self._ready[index].clear()
+
+    async def _handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            hello = json.loads(await reader.readline())
+            index = int(hello["shard"])
+            if not 0 <= index < self.count:
+                raise ValueError(f"shard {index} out of range")
+        except (ValueError, KeyError, TypeError) as e:
+            logger.warning(f"[分片] Rejected worker connection: {e}")
+            writer.close()
+            return
+        self._links[index] = writer
+        if self._last_config is not None:
+            # 重启的工作进程可能错过了离线期间的配置变更
+            writer.write(_encode(self._last_config))
+        self._ready[index].set()
+        logger.info(f"[分片] Worker {index} connected")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message.get("type") == "config":
+                    self._last_config = message
+                    await self.broadcast(message, exclude=index)
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"[分片] Connection to worker {index} failed: {e}")
+        finally:
+            self._drop_link(index, writer)
+            writer.close()
+        if not self._stopping:
+            logger.warning(f"[分片] Worker {index} disconnected")
+
+    def send(self, index: int, message: Dict[str, Any]) -> bool:
+        """放入指定分片的出站队列，不等待发送；队列已满时丢弃最早的一条。监督进程退出时返回 False"""
+        if self._stopping:
+            return False
+        queue = self._outbound[index]
+        if len(queue) >= self.max_outbound:
+            queue.popleft()
+            self.dropped[index] += 1
+            if self.dropped[index] == 1 or self.dropped[index] % 1000 == 0:
+                logger.warning(
+                    f"[分片] Outbound queue for worker {index} is full ({self.max_outbound}), "
+                    f"dropped {self.dropped[index]} updates so far"
+                )
+        queue.append(_encode(message))
+        if self._pending:
+            self._pending[index].set()
+        return True
+
+    @property
+    def outbound_sizes(self) -> List[int]:
+        return [len(self._outbound[index]) for index in range(self.count)]
+
+    async def _pump(self, index: int) -> None:
+        """把出站队列按顺序写入分片连接；分片离线时只有它自己的队列在积压"""
+        queue = self._outbound[index]
+        pending = self._pending[index]
+        while not self._stopping:
+            if not queue:
+                pending.clear()
+                await pending.wait()
+                continue
+            await self._ready[index].wait()
+            writer = self._links.get(index)
+            if writer is None:
+                continue
+            # 写入成功后才出队，断线时未确认的消息在重连后重发
+            batch = list(islice(queue, 100))
+            try:
+                writer.write(b"".join(batch))
+                await writer.drain()
+            except ConnectionError as e:
+                logger.warning(f"[分片] Failed to send to worker {index}: {e}")
+                self._drop_link(index, writer)
+                continue
+            # 发送期间队列满时可能已从队首丢弃了其中几条
+            for data in batch:
+                if queue and queue[0] is data:
+                    queue.popleft()
+
+    async def broadcast(self, message: Dict[str, Any], exclude: Optional[int] = None) -> None:
+        """发送给当前在线的其他分片"""
+        data = _encode(message)
+        for index, writer in list(self._links.items()):
+            if index == exclude:
+                continue
+            try:
+                writer.write(data)
+                await writer.drain()
+            except ConnectionError as e:
+                logger.warning(f"[分片] Failed to broadcast to worker {index}: {e}")
+                self._drop_link(index, writer)
+
+    async def route(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """TypeHandler 回调：把更新转发给所属分片，无法识别聊天的更新交给 0 号分片"""
+        if not isinstance(update, Update):
+            return
+        chat = update.effective_chat
+        index = shard_for(chat.id, self.count) if chat is not None else 0
+        if self.send(index, {"type": "update", "update": update.to_dict()}):
+            self.routed[index] += 1
+
+
+class ShardLink:
+    """工作进程与监督进程之间的连接"""
+
+    def __init__(self, index: int, count: int, address: str, max_in_flight: int = 1000) -> None:
+        host, _, port = address.rpartition(":")
+        self.index = index
+        self.count = count
+        self.host = host or "127.0.0.1"
+        self.port = int(port)
+        self.max_in_flight = max(1, max_in_flight)
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def owns(self, chat_id: int) -> bool:
+        return shard_for(chat_id, self.count) == self.index
+
+    def publish_config(self, config: Dict[str, Any]) -> None:
+        """把本分片修改的全局配置发给监督进程转发"""
+        if self._writer is not None and not self._writer.is_closing():
+            self._writer.write(_encode({"type": "config", "config": config}))
+
+    def close(self) -> None:
+        """断开连接，run() 处理完已接收的更新后返回"""
+        if self._writer is not None:
+            self._writer.close()
+
+    async def run(self, application: Application, on_config: Callable[[Dict[str, Any]], None]) -> None:
+        """接收并处理更新，直到连接断开"""
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=LINE_LIMIT)
+        self._writer = writer
+        writer.write(_encode({"shard": self.index}))
+        await writer.drain()
+        logger.info(f"[分片] Worker {self.index}/{self.count} connected to supervisor")
+        slots = asyncio.Semaphore(self.max_in_flight)
+        try:
+            while True:
+                await slots.acquire()
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message.get("type") == "config":
+                    slots.release()
+                    try:
+                        on_config(message["config"])
+                    except Exception as e:
+                        logger.error(f"[分片] Failed to apply shared config: {e}")
+                    continue
+                update = Update.de_json(message["update"], application.bot)
+                task = asyncio.get_running_loop().create_task(self._process(application, update, slots))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        except ConnectionError as e:
+            logger.warning(f"[分片] Lost connection to supervisor: {e}")
+        finally:
+            self._writer = None
+            writer.close()
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _process(self, application: Application, update: Update, slots: asyncio.Semaphore) -> None:
+        try:
+            await application.update_processor.process_update(update, application.process_update(update))
+        except Exception as e:
+            logger.error(f"[分片] Failed to process update {update.update_id}: {e}")
+        finally:
+            slots.release()
+
+
+async def serve_shard(application: Application, link: ShardLink,
+                      on_config: Callable[[Dict[str, Any]], None]) -> None:
+    """运行工作进程，直到收到 SIGINT/SIGTERM 或与监督进程断开"""
+    stop = stop_event()
+    async with running_application(application):
+        loop = asyncio.get_running_loop()
+        link_task = loop.create_task(link.run(application, on_config))
+        stop_task = loop.create_task(stop.wait())
+        await asyncio.wait({link_task, stop_task}, return_when=asyncio.FIRST_COMPLETED)
+        stop_task.cancel()
+        link.close()
+        await link_task
+
+
+def run_shard_worker(application: Application, link: ShardLink,
+                     on_config: Callable[[Dict[str, Any]], None]) -> Any:
+    return asyncio.run(serve_shard(application, link, on_config))
+
+
+def build_ingest_application(token: str, supervisor: ShardSupervisor, max_workers: int = 16,
+                             max_backlog: int = 1000) -> Application:
+    """监督进程的 Application：只接收更新并路由，同一聊天的更新按顺序转发"""
+
+    async def start_supervisor(application: Application) -> None:
+        await supervisor.start()
+
+    async def stop_supervisor(application: Application) -> None:
+        await supervisor.stop()
+
+    application = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerChatUpdateProcessor(max_workers=max_workers, max_backlog=max_backlog))
+        .post_init(start_supervisor)
+        .post_shutdown(stop_supervisor)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, supervisor.route))
+    return application
+
+
+def main() -> None:
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="以多进程分片方式运行机器人")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("SHARDS", str(os.cpu_count() or 2))))
+    args = parser.parse_args()
+    if args.shards < 2:
+        parser.error("--shards 至少为 2；单进程运行请直接启动 bot.py")
+
+    setup_logging_from_env(name="supervisor")
+    token = os.getenv("BOT_TOKEN")
+    if not token:
+        raise ValueError("未设置BOT_TOKEN环境变量。请在.env文件中设置。")
+
+    for index, groups in seed_shards(base_data_dir(), args.shards).items():
+        logger.info(f"[分片] Initialized shard {index} with {groups} monitored groups")
+
+    supervisor = ShardSupervisor(
+        args.shards, worker_command=[sys.executable, os.path.join(base_dir, 'bot.py')],
+        max_outbound=int(os.getenv("SHARD_OUTBOUND_QUEUE", "10000"))
+    )
+    max_backlog = int(os.getenv("UPDATE_MAX_BACKLOG", "1000"))
+    application = build_ingest_application(
+        token, supervisor, max_workers=int(os.getenv("UPDATE_WORKERS", "16")), max_backlog=max_backlog
+    )
+    if os.getenv("UPDATE_MODE", "polling").lower() == "webhook":
+        server, webhook_url, max_connections = webhook_from_env(application, max_backlog)
+        run_webhook(application, server, webhook_url, ALLOWED_UPDATES, max_connections)
+    else:
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,587 @@
+"""
+可插拔存储层
+
+- JsonStorage：沿用 data/ 下的 groups.json、deletion_queue.json（快照 + 追加日志）
+  与 deletion_config.json。
+- SqliteStorage：SQLite（WAL 模式），为监控群组、待删除消息、群组配置和删除审计
+  建立索引表。所有数据库操作都在一个专用线程中串行执行并分组提交，事件循环只
+  投递任务或等待结果，不直接接触磁盘。
+
+通过环境变量 STORAGE_BACKEND=json|sqlite 选择后端（见 bot.py）。
+直接运行本模块可把现有 JSON 文件一次性导入 SQLite：
+
+    python storage.py import-json [--db data/bot.db]
+"""
+
+import asyncio
+import concurrent.futures
+import itertools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from deletion_journal import DeletionJournal
+from deletion_queue import DeletionQueue
+
+logger = logging.getLogger(__name__)
+
+QueueKey = Tuple[int, int]
+
+
+def _valid_entry(entry: Any) -> bool:
+    return isinstance(entry, dict) and 'chat_id' in entry and 'message_id' in entry
+
+
+class Storage:
+    """存储后端接口"""
+
+    name = "base"
+
+    def load_groups(self) -> Dict[int, Dict[str, Any]]:
+        raise NotImplementedError
+
+    def save_groups(self, groups: Dict[int, Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+    def load_config(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def save_config(self, config: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    def enqueue(self, chat_id: int, message_id: int, date: int = 0, reason: Optional[str] = None) -> None:
+        """date 为消息发送时间（Unix 秒），0 表示未知
+
+        reason 不为空时为新入队的消息记录 queued 审计；已在队列中的重复入队不记录。
+        """
+        raise NotImplementedError
+
+    def remove_pending(self, keys: Iterable[QueueKey]) -> None:
+        raise NotImplementedError
+
+    async def pending_count(self, chat_id: Optional[int] = None) -> int:
+        raise NotImplementedError
+
+    async def select_pending(self, chat_id: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def pending_by_chat(self) -> Dict[int, List[int]]:
+        """按群组返回全部待删除的 message_id（按入队顺序）"""
+        raise NotImplementedError
+
+    async def pending_older_than(self, timestamp: float) -> Dict[int, List[int]]:
+        """按群组返回发送时间已知且早于 timestamp 的待删除消息"""
+        raise NotImplementedError
+
+    async def pending_summary(self) -> Dict[int, Tuple[int, int]]:
+        """按群组返回 (待删除条数, 最早的已知发送时间)，发送时间都未知时为 0"""
+        raise NotImplementedError
+
+    def log_deletions(self, records: Iterable[Tuple[int, int, str, str]]) -> None:
+        """记录删除审计 (chat_id, message_id, action, reason)"""
+
+    async def flush(self) -> None:
+        """定期调用：把缓冲的写入落盘"""
+
+    def close(self) -> None:
+        """关闭并落盘"""
+
+
+class JsonStorage(Storage):
+    """基于 JSON 文件的存储（默认）"""
+
+    name = "json"
+
+    def __init__(self, groups_path: str, queue_path: str, journal_path: str, config_path: str) -> None:
+        self.groups_path = groups_path
+        self.config_path = config_path
+        self.journal = DeletionJournal(queue_path, journal_path)
+        self.queue = DeletionQueue()
+        self._queue_loaded = False
+        self._compacting = False
+
+    def load_groups(self) -> Dict[int, Dict[str, Any]]:
+        try:
+            with open(self.groups_path, 'r', encoding='utf-8') as f:
+                groups = json.load(f)
+            return {g['id']: {k: v for k, v in g.items() if k != 'id'} for g in groups}
+        except Exception as e:
+            logger.warning(f"加载群组配置失败: {e}")
+            return {}
+
+    def save_groups(self, groups: Dict[int, Dict[str, Any]]) -> None:
+        data = [{"id": gid, **info} for gid, info in groups.items()]
+        try:
+            with open(self.groups_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            logger.error(f"保存群组配置失败: {e}")
+
+    def load_config(self) -> Dict[str, Any]:
+        try:
+            with open(self.config_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"加载删除配置失败: {e}")
+            return {}
+
+    def save_config(self, config: Dict[str, Any]) -> None:
+        try:
+            with open(self.config_path, 'w', encoding='utf-8') as f:
+                json.dump(config, f, ensure_ascii=False, indent=4)
+        except Exception as e:
+            logger.error(f"保存删除配置失败: {e}")
+
+    def load_queue(self) -> None:
+        try:
+            entries = self.journal.load()
+        except Exception as e:
+            logger.warning(f"加载删除队列失败: {e}")
+            entries = []
+        self.queue = DeletionQueue()
+        valid = 0
+        for entry in entries:
+            if _valid_entry(entry):
+                valid += 1
+                self.queue.add(entry['chat_id'], entry['message_id'], entry.get('date', 0))
+        if valid < len(entries):
+            logger.warning(f"Found invalid entries in deletion_queue, will ignore them. Total: {len(entries)}, valid: {valid}")
+        self._queue_loaded = True
+
+    def _ensure_queue(self) -> None:
+        if not self._queue_loaded:
+            self.load_queue()
+
+    def compact(self) -> None:
+        """把当前队列压缩为快照并清空日志（同步执行，用于初始化等不在事件循环上的场合）"""
+        try:
+            self.journal.compact(self.queue.to_list())
+        except Exception as e:
+            logger.error(f"保存删除队列失败: {e}")
+
+    async def _compact_in_thread(self) -> None:
+        """事件循环上只取队列快照并切换日志文件，写快照与 fsync 在线程中进行"""
+        self._compacting = True
+        try:
+            entries = self.queue.to_list()
+            self.journal.rotate()
+            await asyncio.to_thread(self.journal.write_snapshot, entries)
+        except Exception as e:
+            logger.error(f"保存删除队列失败: {e}")
+        finally:
+            self._compacting = False
+
+    def enqueue(self, chat_id: int, message_id: int, date: int = 0, reason: Optional[str] = None) -> None:
+        self._ensure_queue()
+        # 同一条消息可能同时被 LLM 判定和多次 👎，只入队一次
+        if not self.queue.add(chat_id, message_id, date):
+            return
+        if reason:
+            self.log_deletions([(chat_id, message_id, "queued", reason)])
+        entry = {'chat_id': chat_id, 'message_id': message_id}
+        if date:
+            entry['date'] = date
+        try:
+            self.journal.record_add(entry)
+        except Exception as e:
+            logger.error(f"写入删除日志失败: {e}")
+
+    def remove_pending(self, keys: Iterable[QueueKey]) -> None:
+        self._ensure_queue()
+        removed = list(dict.fromkeys(key for key in keys if key in self.queue))
+        if not removed:
+            return
+        self.queue.remove(removed)
+        try:
+            self.journal.record_removes(removed)
+        except Exception as e:
+            logger.error(f"写入删除日志失败: {e}")
+
+    async def pending_count(self, chat_id: Optional[int] = None) -> int:
+        self._ensure_queue()
+        if chat_id is None:
+            return len(self.queue)
+        return self.queue.count(chat_id)
+
+    async def select_pending(self, chat_id: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        self._ensure_queue()
+        if chat_id is None:
+            keys = self.queue.interleaved()
+        else:
+            keys = ((chat_id, message_id) for message_id in self.queue.message_ids(chat_id))
+        return [{'chat_id': c, 'message_id': m} for c, m in itertools.islice(keys, limit)]
+
+    async def pending_by_chat(self) -> Dict[int, List[int]]:
+        self._ensure_queue()
+        return {chat_id: self.queue.message_ids(chat_id) for chat_id in self.queue.chats()}
+
+    async def pending_older_than(self, timestamp: float) -> Dict[int, List[int]]:
+        self._ensure_queue()
+        return self.queue.older_than(timestamp)
+
+    async def pending_summary(self) -> Dict[int, Tuple[int, int]]:
+        self._ensure_queue()
+        return self.queue.summary()
+
+    async def flush(self) -> None:
+        await asyncio.to_thread(self.journal.sync)
+        # 只有日志记录数超过阈值时才压缩
+        if self.journal.needs_compaction and not self._compacting:
+            await self._compact_in_thread()
+
+    def close(self) -> None:
+        self.journal.close()
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS monitored_groups (
+    chat_id INTEGER PRIMARY KEY,
+    name TEXT
+);
+CREATE TABLE IF NOT EXISTS group_config (
+    chat_id INTEGER NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (chat_id, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS bot_config (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending_deletions (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    enqueued_at REAL NOT NULL,
+    message_date INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (chat_id, message_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_pending_enqueued ON pending_deletions (enqueued_at);
+CREATE INDEX IF NOT EXISTS idx_pending_chat_enqueued ON pending_deletions (chat_id, enqueued_at);
+CREATE TABLE IF NOT EXISTS deletion_audit (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    reason TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_audit_chat_time ON deletion_audit (chat_id, created_at);
+"""
+
+
+def _migrate(conn: sqlite3.Connection) -> None:
+    """为旧版本创建的数据库补齐新增列"""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(pending_deletions)")}
+    if "message_date" not in columns:
+        conn.execute("ALTER TABLE pending_deletions ADD COLUMN message_date INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pending_date ON pending_deletions (message_date)")
+
+
+class _DatabaseThread(threading.Thread):
+    """独占 SQLite 连接的后台线程，按提交顺序执行任务，每批任务提交一次事务"""
+
+    MAX_BATCH = 500
+
+    def __init__(self, path: str) -> None:
+        super().__init__(name="sqlite-writer", daemon=True)
+        self.path = path
+        self._tasks: "queue.Queue[Optional[Tuple[Callable, Optional[concurrent.futures.Future]]]]" = queue.Queue()
+        self._ready = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def run(self) -> None:
+        try:
+            conn = sqlite3.connect(self.path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            _migrate(conn)
+            conn.commit()
+        except BaseException as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        stopping = False
+        while not stopping:
+            batch = [self._tasks.get()]
+            while len(batch) < self.MAX_BATCH:
+                try:
+                    batch.append(self._tasks.get_nowait())
+                except queue.Empty:
+                    break
+            for task in batch:
+                if task is None:
+                    stopping = True
+                    continue
+                fn, future = task
+                try:
+                    result = fn(conn)
+                except Exception as e:
+                    if future is not None:
+                        future.set_exception(e)
+                    else:
+                        logger.error(f"[SQLite] 写入失败: {e}")
+                else:
+                    if future is not None:
+                        future.set_result(result)
+            try:
+                conn.commit()
+            except Exception as e:
+                logger.error(f"[SQLite] 提交失败: {e}")
+        conn.close()
+
+    def start_and_wait(self) -> None:
+        self.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def submit(self, fn: Callable[[sqlite3.Connection], Any]) -> concurrent.futures.Future:
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        self._tasks.put((fn, future))
+        return future
+
+    def post(self, fn: Callable[[sqlite3.Connection], Any]) -> None:
+        """只写入、不等待结果"""
+        self._tasks.put((fn, None))
+
+    def stop(self) -> None:
+        self._tasks.put(None)
+        self.join()
+
+
+class SqliteStorage(Storage):
+    """SQLite（WAL）存储"""
+
+    name = "sqlite"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db = _DatabaseThread(path)
+        self._db.start_and_wait()
+        # 最近一次读取或写入的群组行：gid -> (name, {key: JSON 值})，保存时只写变化的部分
+        self._saved_groups: Optional[Dict[int, Tuple[Any, Dict[str, str]]]] = None
+
+    def _call(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """同步等待结果，仅用于启动阶段"""
+        return self._db.submit(fn).result()
+
+    async def _query(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        return await asyncio.wrap_future(self._db.submit(fn))
+
+    def is_empty(self) -> bool:
+        def query(conn: sqlite3.Connection) -> bool:
+            for table in ("monitored_groups", "bot_config", "pending_deletions"):
+                if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                    return False
+            return True
+        return self._call(query)
+
+    @staticmethod
+    def _group_rows(groups: Dict[int, Dict[str, Any]]) -> Dict[int, Tuple[Any, Dict[str, str]]]:
+        return {
+            gid: (info.get("name"), {
+                key: json.dumps(value, ensure_ascii=False) for key, value in info.items() if key != "name"
+            })
+            for gid, info in groups.items()
+        }
+
+    def load_groups(self) -> Dict[int, Dict[str, Any]]:
+        def query(conn: sqlite3.Connection) -> Dict[int, Dict[str, Any]]:
+            groups = {chat_id: {"name": name} for chat_id, name in conn.execute("SELECT chat_id, name FROM monitored_groups")}
+            for chat_id, key, value in conn.execute("SELECT chat_id, key, value FROM group_config"):
+                if chat_id in groups:
+                    groups[chat_id][key] = json.loads(value)
+            return groups
+        groups = self._call(query)
+        self._saved_groups = self._group_rows(groups)
+        return groups
+
+    def save_groups(self, groups: Dict[int, Dict[str, Any]]) -> None:
+        """只写入新增或变化的群组，删除已移除的群组"""
+        if self._saved_groups is None:
+            self.load_groups()
+        saved = self._saved_groups
+        current = self._group_rows(groups)
+        removed = [(gid,) for gid in saved if gid not in current]
+        group_rows = []
+        config_rows = []
+        stale_keys = []
+        for gid, (name, config) in current.items():
+            previous = saved.get(gid)
+            if previous == (name, config):
+                continue
+            old_name, old_config = previous if previous is not None else (None, {})
+            if previous is None or old_name != name:
+                group_rows.append((gid, name))
+            config_rows.extend((gid, key, value) for key, value in config.items() if old_config.get(key) != value)
+            stale_keys.extend((gid, key) for key in old_config if key not in config)
+        self._saved_groups = current
+        if not (removed or group_rows or config_rows or stale_keys):
+            return
+
+        def write(conn: sqlite3.Connection) -> None:
+            conn.executemany("DELETE FROM monitored_groups WHERE chat_id = ?", removed)
+            conn.executemany("DELETE FROM group_config WHERE chat_id = ?", removed)
+            conn.executemany("DELETE FROM group_config WHERE chat_id = ? AND key = ?", stale_keys)
+            conn.executemany("INSERT OR REPLACE INTO monitored_groups (chat_id, name) VALUES (?, ?)", group_rows)
+            conn.executemany("INSERT OR REPLACE INTO group_config (chat_id, key, value) VALUES (?, ?, ?)", config_rows)
+        self._db.post(write)
+
+    def load_config(self) -> Dict[str, Any]:
+        def query(conn: sqlite3.Connection) -> Dict[str, Any]:
+            return {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM bot_config")}
+        return self._call(query)
+
+    def save_config(self, config: Dict[str, Any]) -> None:
+        rows = [(key, json.dumps(value, ensure_ascii=False)) for key, value in config.items()]
+
+        def write(conn: sqlite3.Connection) -> None:
+            conn.executemany("INSERT OR REPLACE INTO bot_config (key, value) VALUES (?, ?)", rows)
+        self._db.post(write)
+
+    def enqueue(self, chat_id: int, message_id: int, date: int = 0, reason: Optional[str] = None) -> None:
+        enqueued_at = time.time()
+
+        def write(conn: sqlite3.Connection) -> None:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO pending_deletions (chat_id, message_id, enqueued_at, message_date) "
+                "VALUES (?, ?, ?, ?)",
+                (chat_id, message_id, enqueued_at, int(date))
+            )
+            # 重复入队被忽略时不写审计
+            if reason and cursor.rowcount:
+                conn.execute(
+                    "INSERT INTO deletion_audit (chat_id, message_id, action, reason, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (chat_id, message_id, "queued", reason, enqueued_at)
+                )
+        self._db.post(write)
+
+    def remove_pending(self, keys: Iterable[QueueKey]) -> None:
+        rows = list(keys)
+
+        def write(conn: sqlite3.Connection) -> None:
+            conn.executemany("DELETE FROM pending_deletions WHERE chat_id = ? AND message_id = ?", rows)
+        self._db.post(write)
+
+    async def pending_count(self, chat_id: Optional[int] = None) -> int:
+        def query(conn: sqlite3.Connection) -> int:
+            if chat_id is None:
+                return conn.execute("SELECT COUNT(*) FROM pending_deletions").fetchone()[0]
+            return conn.execute("SELECT COUNT(*) FROM pending_deletions WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+        return await self._query(query)
+
+    async def select_pending(self, chat_id: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        def query(conn: sqlite3.Connection) -> List[Dict[str, Any]]:
+            params: List[Any] = []
+            if chat_id is not None:
+                sql = "SELECT chat_id, message_id FROM pending_deletions WHERE chat_id = ? ORDER BY enqueued_at"
+                params.append(chat_id)
+            else:
+                # 各群组轮流：先取每个群组最早的一条，再取第二条……
+                sql = (
+                    "SELECT chat_id, message_id FROM ("
+                    "SELECT chat_id, message_id, enqueued_at, "
+                    "ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY enqueued_at, message_id) AS turn "
+                    "FROM pending_deletions) ORDER BY turn, enqueued_at"
+                )
+            if limit is not None:
+                sql += " LIMIT ?"
+                params.append(limit)
+            return [{'chat_id': c, 'message_id': m} for c, m in conn.execute(sql, params)]
+        return await self._query(query)
+
+    async def pending_by_chat(self) -> Dict[int, List[int]]:
+        def query(conn: sqlite3.Connection) -> Dict[int, List[int]]:
+            by_chat: Dict[int, List[int]] = {}
+            for chat_id, message_id in conn.execute(
+                "SELECT chat_id, message_id FROM pending_deletions ORDER BY chat_id, enqueued_at"
+            ):
+                by_chat.setdefault(chat_id, []).append(message_id)
+            return by_chat
+        return await self._query(query)
+
+    async def pending_older_than(self, timestamp: float) -> Dict[int, List[int]]:
+        def query(conn: sqlite3.Connection) -> Dict[int, List[int]]:
+            by_chat: Dict[int, List[int]] = {}
+            for chat_id, message_id in conn.execute(
+                "SELECT chat_id, message_id FROM pending_deletions WHERE message_date > 0 AND message_date < ?",
+                (timestamp,)
+            ):
+                by_chat.setdefault(chat_id, []).append(message_id)
+            return by_chat
+        return await self._query(query)
+
+    async def pending_summary(self) -> Dict[int, Tuple[int, int]]:
+        def query(conn: sqlite3.Connection) -> Dict[int, Tuple[int, int]]:
+            return {
+                chat_id: (count, oldest or 0)
+                for chat_id, count, oldest in conn.execute(
+                    "SELECT chat_id, COUNT(*), MIN(NULLIF(message_date, 0)) FROM pending_deletions GROUP BY chat_id"
+                )
+            }
+        return await self._query(query)
+
+    def log_deletions(self, records: Iterable[Tuple[int, int, str, str]]) -> None:
+        now = time.time()
+        rows = [(chat_id, message_id, action, reason, now) for chat_id, message_id, action, reason in records]
+        if not rows:
+            return
+
+        def write(conn: sqlite3.Connection) -> None:
+            conn.executemany(
+                "INSERT INTO deletion_audit (chat_id, message_id, action, reason, created_at) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+        self._db.post(write)
+
+    async def flush(self) -> None:
+        # 等待之前投递的写入全部执行并提交
+        await self._query(lambda conn: None)
+
+    def close(self) -> None:
+        self._db.stop()
+
+
+def import_json_files(target: SqliteStorage, source: JsonStorage) -> Dict[str, int]:
+    """把 JSON 文件中的群组、配置和删除队列一次性导入 SQLite"""
+    groups = source.load_groups()
+    target.save_groups(groups)
+    config = source.load_config()
+    if config:
+        target.save_config(config)
+    source.load_queue()
+    for chat_id, message_id, date in source.queue.items():
+        target.enqueue(chat_id, message_id, date)
+    target._call(lambda conn: None)
+    return {"groups": len(groups), "config_keys": len(config), "pending": len(source.queue)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    parser = argparse.ArgumentParser(description="存储工具")
+    parser.add_argument("command", choices=["import-json"])
+    parser.add_argument("--db", default=os.path.join(data_dir, 'bot.db'))
+    parser.add_argument("--data-dir", default=data_dir)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    json_storage = JsonStorage(
+        os.path.join(args.data_dir, 'groups.json'),
+        os.path.join(args.data_dir, 'deletion_queue.json'),
+        os.path.join(args.data_dir, 'deletion_queue.journal'),
+        os.path.join(args.data_dir, 'deletion_config.json'),
+    )
+    sqlite_storage = SqliteStorage(args.db)
+    counts = import_json_files(sqlite_storage, json_storage)
+    sqlite_storage.close()
+    print(f"导入完成: {counts}")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证删除队列的追加日志、重放、压缩（含中断恢复）与旧格式兼容
+"""
+
+import json
+import os
+import tempfile
+
+from deletion_journal import DeletionJournal
+
+
+def make_journal(temp_dir, **kwargs):
+    return DeletionJournal(
+        os.path.join(temp_dir, 'deletion_queue.json'),
+        os.path.join(temp_dir, 'deletion_queue.journal'),
+        **kwargs
+    )
+
+
+def test_legacy_snapshot_and_replay():
+    """测试读取原有 deletion_queue.json 并重放追加的日志"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        legacy = [{"chat_id": -100, "message_id": 1}, {"chat_id": -100, "message_id": 2}]
+        with open(os.path.join(temp_dir, 'deletion_queue.json'), 'w', encoding='utf-8') as f:
+            json.dump(legacy, f, indent=4)
+
+        journal = make_journal(temp_dir)
+        assert journal.load() == legacy
+        journal.record_add({"chat_id": -100, "message_id": 3})
+        journal.record_remove({"chat_id": -100, "message_id": 1})
+        journal.close()
+
+        entries = make_journal(temp_dir).load()
+        assert entries == [{"chat_id": -100, "message_id": 2}, {"chat_id": -100, "message_id": 3}]
+    print("   ✅ 快照 + 日志重放正确")
+
+
+def test_truncated_tail_is_ignored():
+    """测试崩溃留下的半行日志被忽略"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        journal = make_journal(temp_dir)
+        journal.record_add({"chat_id": -100, "message_id": 7})
+        journal.close()
+        with open(os.path.join(temp_dir, 'deletion_queue.journal'), 'a', encoding='utf-8') as f:
+            f.write('{"op": "add", "chat_id": -100, "mess')
+
+        assert make_journal(temp_dir).load() == [{"chat_id": -100, "message_id": 7}]
+    print("   ✅ 不完整记录被忽略")
+
+
+def test_compaction():
+    """测试压缩后快照包含全部条目、日志被清空"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        journal = make_journal(temp_dir, compact_threshold=3)
+        entries = []
+        for i in range(3):
+            entry = {"chat_id": -100, "message_id": i}
+            entries.append(entry)
+            journal.record_add(entry)
+        assert journal.needs_compaction
+
+        journal.compact(entries)
+        assert journal.records == 0
+        assert os.path.getsize(os.path.join(temp_dir, 'deletion_queue.journal')) == 0
+        assert not os.path.exists(os.path.join(temp_dir, 'deletion_queue.json.tmp'))
+        journal.record_add({"chat_id": -200, "message_id": 9})
+        journal.close()
+
+        reloaded = make_journal(temp_dir).load()
+        assert reloaded == entries + [{"chat_id": -200, "message_id": 9}]
+    print("   ✅ 压缩正常")
+
+
+def test_interrupted_compaction_recovers():
+    """测试日志已轮转但快照未写完时，重放 .old 与新日志仍得到完整队列"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        journal = make_journal(temp_dir, compact_threshold=2)
+        for i in range(3):
+            journal.record_add({"chat_id": -100, "message_id": i})
+        journal.rotate()
+        assert journal.records == 0
+        assert os.path.exists(journal.rotated_path)
+        # 轮转后、快照写入前的操作写入新日志
+        journal.record_removes([(-100, 0), (-100, 1)])
+        journal.record_add({"chat_id": -100, "message_id": 0})
+        journal.close()
+
+        expected = [{"chat_id": -100, "message_id": 2}, {"chat_id": -100, "message_id": 0}]
+        journal = make_journal(temp_dir)
+        assert journal.load() == expected
+
+        # 再次轮转时 .old 仍在：新日志追加到 .old 之后，不丢记录
+        journal.rotate()
+        assert make_journal(temp_dir).load() == expected
+        journal.write_snapshot(expected)
+        assert not os.path.exists(journal.rotated_path)
+        journal.close()
+        assert make_journal(temp_dir).load() == expected
+    print("   ✅ 压缩中断后可恢复")
+
+
+if __name__ == "__main__":
+    test_legacy_snapshot_and_replay()
+    test_truncated_tail_is_ignored()
+    test_compaction()
+    test_interrupted_compaction_recovers()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证按群组分桶的删除队列去重、计数与批量出队
+"""
+
+from deletion_queue import DeletionQueue, select_drain_batch
+
+
+def test_dedup_and_counts():
+    """测试同一条消息重复入队只保留一条，群组计数正确"""
+    queue = DeletionQueue()
+    assert queue.add(-100, 1)
+    assert queue.add(-100, 2)
+    assert not queue.add(-100, 1)
+    assert queue.add(-200, 1)
+
+    assert len(queue) == 3
+    assert queue.count(-100) == 2
+    assert queue.count(-300) == 0
+    assert (-200, 1) in queue
+    assert (-200, 2) not in queue
+    assert queue.message_ids(-100) == [1, 2]
+
+
+def test_bulk_remove_keeps_order():
+    """测试批量出队后剩余消息保持入队顺序，空群组被移除"""
+    queue = DeletionQueue()
+    for message_id in range(10):
+        queue.add(-100, message_id)
+    queue.add(-200, 5)
+
+    removed = queue.remove([(-100, 2), (-100, 7), (-200, 5), (-300, 1), (-100, 2)])
+    assert removed == 3
+    assert len(queue) == 8
+    assert queue.message_ids(-100) == [0, 1, 3, 4, 5, 6, 8, 9]
+    assert queue.chats() == [-100]
+    # 出队后可以重新入队
+    assert queue.add(-200, 5)
+
+
+def test_to_list_format():
+    """测试转换为 deletion_queue.json 的列表格式"""
+    queue = DeletionQueue()
+    queue.add(-100, 1)
+    queue.add(-200, 2)
+    assert queue.to_list() == [{'chat_id': -100, 'message_id': 1}, {'chat_id': -200, 'message_id': 2}]
+    queue.clear()
+    assert len(queue) == 0 and queue.to_list() == []
+
+
+def test_dates_and_older_than():
+    """测试记录消息发送时间并按时间筛选，未知时间（0）不参与筛选"""
+    queue = DeletionQueue()
+    queue.add(-100, 1, 1000)
+    queue.add(-100, 2, 5000)
+    queue.add(-100, 3)
+    queue.add(-200, 4, 2000)
+
+    assert queue.older_than(3000) == {-100: [1], -200: [4]}
+    assert queue.summary() == {-100: (3, 1000), -200: (1, 2000)}
+    queue.remove([(-100, 1)])
+    assert queue.older_than(3000) == {-200: [4]}
+    # 最早的消息出队后，群组的最早时间随之更新
+    assert queue.oldest_date(-100) == 5000
+    assert queue.summary() == {-100: (2, 5000), -200: (1, 2000)}
+    assert queue.to_list() == [
+        {'chat_id': -100, 'message_id': 2, 'date': 5000},
+        {'chat_id': -100, 'message_id': 3},
+        {'chat_id': -200, 'message_id': 4, 'date': 2000},
+    ]
+
+
+def test_oldest_date_tracks_removals():
+    """测试只有未知时间的群组最早时间为 0，不参与筛选；清空后不残留"""
+    queue = DeletionQueue()
+    queue.add(-100, 1)
+    queue.add(-100, 2, 3000)
+    assert queue.oldest_date(-100) == 3000
+    queue.remove([(-100, 2)])
+    assert queue.oldest_date(-100) == 0
+    assert queue.older_than(10 ** 10) == {}
+    assert queue.summary() == {-100: (1, 0)}
+    queue.remove([(-100, 1)])
+    assert queue.summary() == {} and queue.oldest_date(-100) == 0
+    queue.add(-300, 5, 100)
+    queue.clear()
+    assert queue.summary() == {}
+
+
+def test_drain_batch_shares_budget():
+    """测试持续删除的一批在两个群组之间轮流分配，超期消息优先"""
+    overdue = {-100: [1, 2, 3, 4, 5, 6], -200: [9]}
+    due = select_drain_batch(overdue, [], 4)
+    assert due == {-100: [1, 2, 3], -200: [9]}
+
+    pending = [(-100, 10), (-200, 20), (-100, 11), (-200, 21)]
+    due = select_drain_batch({-100: [1]}, [(-100, 1)] + pending, 4)
+    assert due == {-100: [1, 10, 11], -200: [20]}
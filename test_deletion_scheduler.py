@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证多群组删除调度的堆顺序、计划修改与夏令时计算
+"""
+
+from datetime import datetime, timezone
+
+import pytz
+
+from deletion_scheduler import DEFAULT_SCHEDULE, DeletionScheduler, next_run_after
+
+NEW_YORK = pytz.timezone("America/New_York")
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def test_next_run_same_day_and_next_day():
+    """测试目标时间未到取当天，已过取次日"""
+    now = utc(2026, 1, 10, 0, 0)  # 上海 08:00
+    assert next_run_after("09:30", "Asia/Shanghai", now) == utc(2026, 1, 10, 1, 30)
+    assert next_run_after("07:00", "Asia/Shanghai", now) == utc(2026, 1, 10, 23, 0)
+
+
+def test_dst_transitions():
+    """测试夏令时切换前后仍在当地同一时刻运行，跳过的时刻顺延、重复的时刻取第一次"""
+    # 纽约 2026-03-08 02:00 拨快到 03:00
+    before = NEW_YORK.localize(datetime(2026, 3, 7, 10, 0))
+    run = next_run_after("09:00", "America/New_York", before)
+    assert run.astimezone(NEW_YORK).strftime("%Y-%m-%d %H:%M") == "2026-03-08 09:00"
+    assert run == utc(2026, 3, 8, 13, 0)
+
+    gap = next_run_after("02:30", "America/New_York", before)
+    assert gap.astimezone(NEW_YORK).strftime("%Y-%m-%d %H:%M") == "2026-03-08 03:30"
+
+    # 纽约 2026-11-01 02:00 拨慢到 01:00，01:30 出现两次
+    fall = NEW_YORK.localize(datetime(2026, 10, 31, 12, 0))
+    assert next_run_after("01:30", "America/New_York", fall) == utc(2026, 11, 1, 5, 30)
+
+
+def test_heap_order_and_pop_due():
+    """测试按最早时间出堆、到期后排到下一天"""
+    scheduler = DeletionScheduler()
+    now = utc(2026, 1, 10, 0, 0)
+    scheduler.set(DEFAULT_SCHEDULE, "00:00", "Asia/Shanghai", now)  # 16:00 UTC
+    scheduler.set(-100, "01:00", "UTC", now)
+    scheduler.set(-200, "09:00", "Asia/Tokyo", now)  # 00:00 UTC 已过，次日
+
+    assert scheduler.peek() == utc(2026, 1, 10, 1, 0).timestamp()
+    assert scheduler.pop_due(utc(2026, 1, 10, 0, 30)) == []
+    assert scheduler.pop_due(utc(2026, 1, 10, 16, 0)) == [-100, DEFAULT_SCHEDULE]
+    assert scheduler.next_run(-100) == utc(2026, 1, 11, 1, 0).timestamp()
+    assert scheduler.peek() == utc(2026, 1, 11, 0, 0).timestamp()
+
+
+def test_update_and_remove_discard_stale_entries():
+    """测试修改与移除计划后旧的堆元素不会触发"""
+    scheduler = DeletionScheduler()
+    now = utc(2026, 1, 10, 0, 0)
+    scheduler.set(-100, "01:00", "UTC", now)
+    scheduler.set(-100, "05:00", "UTC", now)
+    scheduler.set(-200, "02:00", "UTC", now)
+    scheduler.remove(-200)
+
+    assert len(scheduler) == 1
+    assert scheduler.get(-100) == ("05:00", "UTC")
+    assert scheduler.peek() == utc(2026, 1, 10, 5, 0).timestamp()
+    assert scheduler.pop_due(utc(2026, 1, 10, 3, 0)) == []
+    assert scheduler.pop_due(utc(2026, 1, 10, 5, 0)) == [-100]
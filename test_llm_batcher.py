@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证 LLM 微批处理的合并、结论路由与解析失败回退
+"""
+
+import asyncio
+import json
+
+from llm_batcher import BATCH_INSTRUCTION, ClassificationBatcher, parse_batch_response
+
+CONFIG = {"base_url": "https://llm.example/v1", "model": "m", "api_key": ""}
+
+
+class FakeClient:
+    """模拟 LLMClient.complete，批量请求按 mode 返回不同格式"""
+
+    def __init__(self, mode="json"):
+        self.mode = mode
+        self.batch_calls = 0
+        self.single_calls = 0
+
+    async def complete(self, config, system_msg, user_msg, **params):
+        await asyncio.sleep(0)
+        if BATCH_INSTRUCTION in system_msg:
+            self.batch_calls += 1
+            items = json.loads(user_msg)
+            if self.mode == "garbage":
+                return "sorry, I cannot do that"
+            if self.mode == "partial":
+                items = items[:1]
+            verdicts = [{"id": it["id"], "decision": "DELETE" if "spam" in it["text"] else "KEEP"} for it in items]
+            return "```json\n" + json.dumps(verdicts) + "\n```"
+        self.single_calls += 1
+        return "DELETE" if "spam" in user_msg else "KEEP"
+
+
+def run_batch(client, texts, max_batch_size=10, max_wait=0.01):
+    batcher = ClassificationBatcher(client, max_batch_size=max_batch_size, max_wait=max_wait)
+
+    async def run():
+        return await asyncio.gather(*[batcher.classify(CONFIG, "prompt", t) for t in texts])
+
+    return asyncio.run(run())
+
+
+def test_batch_routing():
+    """测试多条消息合并为一次请求，结论按顺序返回"""
+    client = FakeClient()
+    texts = ["hello", "spam link", "good morning", "more spam"]
+    results = run_batch(client, texts)
+    assert results == ["KEEP", "DELETE", "KEEP", "DELETE"]
+    assert client.batch_calls == 1
+    assert client.single_calls == 0
+    print("   ✅ 批量结论路由正确")
+
+
+def test_batches_split_by_api_key():
+    """测试只有 API key 不同的配置不会合并到同一次请求"""
+    client = FakeClient()
+    batcher = ClassificationBatcher(client, max_batch_size=10, max_wait=0.01)
+    other = dict(CONFIG, api_key="sk-other")
+
+    async def run():
+        return await asyncio.gather(
+            batcher.classify(CONFIG, "prompt", "hello"),
+            batcher.classify(other, "prompt", "spam link"),
+            batcher.classify(CONFIG, "prompt", "more spam"),
+        )
+
+    assert asyncio.run(run()) == ["KEEP", "DELETE", "DELETE"]
+    # 同一 key 的两条合并为一次批量请求，另一 key 的单条走逐条请求
+    assert client.batch_calls == 1 and client.single_calls == 1
+    print("   ✅ 不同 API key 分别批量请求")
+
+
+def test_max_batch_size():
+    """测试达到 max_batch_size 时立即拆分发送"""
+    client = FakeClient()
+    results = run_batch(client, [f"msg {i}" for i in range(5)], max_batch_size=2)
+    assert results == ["KEEP"] * 5
+    # 2 + 2 两个批次，剩余 1 条走单条请求
+    assert client.batch_calls == 2
+    assert client.single_calls == 1
+    print("   ✅ 批次大小上限生效")
+
+
+def test_fallback_on_unparseable():
+    """测试批量响应无法解析或缺项时退回单条请求"""
+    client = FakeClient(mode="garbage")
+    results = run_batch(client, ["spam", "ok", "spam again"])
+    assert results == ["DELETE", "KEEP", "DELETE"]
+    assert client.single_calls == 3
+
+    client = FakeClient(mode="partial")
+    results = run_batch(client, ["spam", "ok", "spam again"])
+    assert results == ["DELETE", "KEEP", "DELETE"]
+    assert client.single_calls == 2
+    print("   ✅ 解析失败回退正常")
+
+
+def test_parse_batch_response():
+    """测试解析时忽略未知 id 与非法结论"""
+    content = '[{"id": 1, "decision": "delete"}, {"id": 2, "decision": "MAYBE"}, {"id": 9, "decision": "KEEP"}]'
+    assert parse_batch_response(content, [1, 2]) == {1: "DELETE"}
+    print("   ✅ 批量响应解析正确")
+
+
+if __name__ == "__main__":
+    test_batch_routing()
+    test_batches_split_by_api_key()
+    test_max_batch_size()
+    test_fallback_on_unparseable()
+    test_parse_batch_response()
+    print("\n🎉 所有测试通过！")
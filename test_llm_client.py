@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证异步 LLM 客户端的请求格式、连接池复用与旧连接池的释放
+"""
+
+import asyncio
+import json
+
+import httpx
+
+from llm_client import LLMClient
+
+
+def make_transport(calls):
+    """模拟 OpenAI 兼容接口，记录每次请求"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        body = json.loads(request.content)
+        reply = "DELETE" if "spam" in body["messages"][-1]["content"] else "KEEP"
+        return httpx.Response(200, json={"choices": [{"message": {"content": reply}}]})
+    return httpx.MockTransport(handler)
+
+
+def test_complete_request_format():
+    """测试请求路径、鉴权头与模型参数"""
+    calls = []
+    client = LLMClient(transport=make_transport(calls))
+    config = {"base_url": "https://llm.example/v1/", "model": "test-model", "api_key": "sk-test"}
+
+    async def run():
+        try:
+            return await client.complete(config, "system prompt", "buy spam now")
+        finally:
+            await client.close()
+
+    decision = asyncio.run(run())
+    assert decision == "DELETE"
+    assert len(calls) == 1
+    request = calls[0]
+    assert str(request.url) == "https://llm.example/v1/chat/completions"
+    assert request.headers["Authorization"] == "Bearer sk-test"
+    body = json.loads(request.content)
+    assert body["model"] == "test-model"
+    assert body["temperature"] == 0
+    assert body["messages"][0] == {"role": "system", "content": "system prompt"}
+    print("   ✅ 请求格式正确")
+
+
+def test_client_reuse_and_rebuild():
+    """测试相同配置复用连接池，配置变化时重建"""
+    calls = []
+    client = LLMClient(transport=make_transport(calls))
+    config = {"base_url": "https://llm.example/v1", "model": "m", "api_key": "k1"}
+
+    async def run():
+        try:
+            results = await asyncio.gather(*[client.complete(config, "s", f"msg {i}") for i in range(5)])
+            first = client._client
+            await client.complete(config, "s", "again")
+            assert client._client is first, "相同配置应复用同一个客户端"
+            config["api_key"] = "k2"
+            await client.complete(config, "s", "after change")
+            assert client._client is not first, "配置变化后应重建客户端"
+            return results
+        finally:
+            await client.close()
+
+    results = asyncio.run(run())
+    assert results == ["KEEP"] * 5
+    assert calls[-1].headers["Authorization"] == "Bearer k2"
+    print("   ✅ 连接池复用与重建正常")
+
+
+def test_retired_client_closed_after_in_flight_requests():
+    """测试配置变化后旧连接池在其上的请求结束后关闭，连接池等待有上限"""
+    release = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if b"slow" in request.content:
+            await release.wait()
+        return httpx.Response(200, json={"choices": [{"message": {"content": "KEEP"}}]})
+
+    client = LLMClient(transport=httpx.MockTransport(handler))
+    config = {"base_url": "https://llm.example/v1", "api_key": "k1", "pool_timeout": 2}
+
+    async def run():
+        try:
+            slow = asyncio.get_running_loop().create_task(client.complete(config, "s", "slow"))
+            await asyncio.sleep(0.01)
+            first = client._client
+            assert first.timeout.pool == 2
+
+            config["api_key"] = "k2"
+            assert await client.complete(config, "s", "fast") == "KEEP"
+            # 旧连接池上仍有请求，暂不关闭
+            assert client._retired == [first] and not first.is_closed
+
+            release.set()
+            assert await slow == "KEEP"
+            assert client._retired == [] and first.is_closed
+            assert not client._client.is_closed
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    print("   ✅ 被替换的连接池按时关闭")
+
+
+def test_close_with_requests_in_flight():
+    """测试请求进行中关闭客户端时，请求结束不会因计数表被清空而抛出 KeyError"""
+    release = asyncio.Event()
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await release.wait()
+        return httpx.Response(200, json={"choices": [{"message": {"content": "KEEP"}}]})
+
+    client = LLMClient(transport=httpx.MockTransport(handler))
+    config = {"base_url": "https://llm.example/v1", "api_key": "k1"}
+
+    async def run():
+        pending = asyncio.get_running_loop().create_task(client.complete(config, "s", "slow"))
+        await asyncio.sleep(0.01)
+        await client.close()
+        release.set()
+        try:
+            await pending
+        except Exception as e:
+            assert not isinstance(e, KeyError), "请求结束时不应抛出 KeyError"
+        assert client._in_flight == {}
+
+    asyncio.run(run())
+    print("   ✅ 关闭时进行中的请求正常结束")
+
+
+if __name__ == "__main__":
+    test_complete_request_format()
+    test_client_reuse_and_rebuild()
+    test_retired_client_closed_after_in_flight_requests()
+    test_close_with_requests_in_flight()
+    print("\n🎉 所有测试通过！")
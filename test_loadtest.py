@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证压测工具的合成更新流、假服务器故障注入，以及一次小规模的完整压测
+"""
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+import httpx
+
+from loadtest import FakeBotAPI, FakeLLM, make_updates, percentile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_make_updates_mix():
+    """测试更新流包含消息与针对已发送消息的反应，且结果可复现"""
+    chats = [-100, -200]
+    updates = make_updates(500, chats, spam_ratio=0.5, reaction_ratio=0.2, seed=3)
+    assert updates == make_updates(500, chats, spam_ratio=0.5, reaction_ratio=0.2, seed=3)
+    messages = {(u["message"]["chat"]["id"], u["message"]["message_id"]) for u in updates if "message" in u}
+    reactions = [u.get("message_reaction") or u.get("message_reaction_count") for u in updates if "message" not in u]
+    assert reactions
+    assert all((r["chat"]["id"], r["message_id"]) in messages for r in reactions)
+    assert [u["update_id"] for u in updates] == list(range(1, 501))
+
+
+def test_percentile():
+    values = [i / 100 for i in range(100)]
+    assert percentile(values, 0.5) == 0.5
+    assert percentile(values, 0.99) == 0.99
+    assert percentile([], 0.5) == 0.0
+
+
+def test_fake_servers_inject_failures():
+    """测试假 Bot API 按比例返回 429，假 LLM 按关键词给出结论"""
+
+    async def run():
+        bot_api = FakeBotAPI(retry_after_rate=1.0, retry_after=2)
+        llm = FakeLLM()
+        await bot_api.start("/bot")
+        await llm.start("/v1")
+        async with httpx.AsyncClient() as client:
+            me = (await client.post(f"{bot_api.base_url}123:x/getMe")).json()
+            limited = await client.post(f"{bot_api.base_url}123:x/deleteMessage", data={"chat_id": "-1"})
+            verdict = (await client.post(f"{llm.base_url}/chat/completions", json={
+                "model": "fake", "messages": [{"role": "system", "content": "x"}, {"role": "user", "content": "spam here"}]
+            })).json()
+        await bot_api.stop()
+        await llm.stop()
+        return me, limited, verdict
+
+    me, limited, verdict = asyncio.run(run())
+    assert me["ok"] and me["result"]["is_bot"]
+    assert limited.status_code == 429
+    assert limited.json()["parameters"]["retry_after"] == 2
+    assert verdict["choices"][0]["message"]["content"] == "DELETE"
+
+
+def test_small_benchmark_run(tmp_path):
+    """测试小规模压测能跑完并输出完整报告"""
+    out = tmp_path / "result.json"
+    subprocess.run(
+        [sys.executable, os.path.join(ROOT, "loadtest.py"), "--updates", "120", "--chats", "3",
+         "--unthrottled", "--api-latency", "0", "--llm-latency", "0", "--json", str(out)],
+        check=True, capture_output=True, timeout=120
+    )
+    report = json.loads(out.read_text(encoding="utf-8"))
+    assert report["handled"] == report["updates"] == 120
+    assert report["moderated_messages"] > 0
+    assert report["llm_requests"] > 0
+    assert "classify_message" in report["handlers"]
+
+
+def test_load_recording_shifts_dates(tmp_path):
+    """测试回放读取录制分段，接收时间转为偏移，消息时间平移到当前附近"""
+    from telegram import Update
+    from update_recorder import UpdateRecorder
+    from loadtest import chats_of, load_recording
+
+    recorder = UpdateRecorder(str(tmp_path))
+    for data in make_updates(30, [-100, -200], spam_ratio=0.5, reaction_ratio=0.2, seed=1):
+        data["message" if "message" in data else next(iter(set(data) - {"update_id"}))]["date"] = 1_000_000
+        recorder.record(Update.de_json(data, None))
+    recorder.close()
+
+    updates, offsets = load_recording([str(tmp_path)])
+    assert len(updates) == 30
+    assert offsets[0] == 0 and offsets == sorted(offsets)
+    assert chats_of(updates) == [-200, -100]
+    message = next(u["message"] for u in updates if "message" in u)
+    assert message["date"] > 1_000_000 + 10 ** 9
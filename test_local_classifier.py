@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证本地朴素贝叶斯分类器的增量学习、余量门限、样本压缩与离线重训
+"""
+
+import json
+import os
+import tempfile
+import threading
+
+from local_classifier import LocalClassifier, LocalModelManager
+
+SPAM = [
+    "Earn 500 USDT daily, join our VIP signals group t.me/vip{}",
+    "Free crypto airdrop, claim now at www.claim{}.com",
+    "Investment opportunity, guaranteed profit {}x, DM admin",
+]
+HAM = [
+    "Does anyone know when the meetup {} starts tomorrow?",
+    "Thanks for sharing the slides from talk {}",
+    "I pushed a fix for issue {} please review",
+]
+
+
+def train(model_or_manager, rounds=30):
+    for i in range(rounds):
+        for template in SPAM:
+            model_or_manager.learn(template.format(i), "DELETE")
+        for template in HAM:
+            model_or_manager.learn(template.format(i), "KEEP")
+
+
+def test_predict_after_training():
+    """测试训练后能正确区分两类消息"""
+    model = LocalClassifier(n_features=1 << 14)
+    train(model)
+    label, margin = model.predict("Join the VIP signals group, earn USDT daily t.me/vip999")
+    assert label == "DELETE" and margin > 1.0
+    label, margin = model.predict("When does the meetup start? Thanks for the slides")
+    assert label == "KEEP" and margin > 1.0
+    print("   ✅ 训练后预测正确")
+
+
+def test_ambiguous_text_falls_through_to_llm():
+    """测试后验概率接近 1 但特征不相关的消息余量不足，仍交给 LLM"""
+    manager = LocalModelManager()
+    train(manager)
+    text = "lol nice weather today everyone"
+    assert manager.predict(text, min_margin=1.0, min_samples=10) is None
+    assert manager.predict("ok", min_margin=1.0, min_samples=10) is None
+    assert manager.predict("Free crypto airdrop claim now", min_margin=1.0, min_samples=10) == "DELETE"
+    assert manager.hits == 1
+    print("   ✅ 模糊消息交给 LLM")
+
+
+def test_manager_threshold_and_snapshot():
+    """测试样本不足时不给结论、快照可恢复"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manager = LocalModelManager(os.path.join(temp_dir, 'model.json'), os.path.join(temp_dir, 'samples.jsonl'))
+        manager.learn(SPAM[0].format(1), "DELETE")
+        assert manager.predict(SPAM[0].format(2), min_margin=0.5, min_samples=10) is None, "样本不足时应交给 LLM"
+
+        train(manager)
+        assert manager.predict("Free crypto airdrop claim now", min_margin=1.0, min_samples=10) == "DELETE"
+        assert manager.predict("Free crypto airdrop claim now", min_margin=10.0, min_samples=10) is None
+        manager.save()
+
+        restored = LocalModelManager(os.path.join(temp_dir, 'model.json'))
+        restored.load()
+        assert restored.model.samples == manager.model.samples
+        assert restored.model.predict("Free crypto airdrop")[0] == "DELETE"
+    print("   ✅ 余量门限与快照正常")
+
+
+def test_retrain_compacts_samples():
+    """测试离线重训去重样本，人工标注优先于 LLM 结论"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        samples_path = os.path.join(temp_dir, 'samples.jsonl')
+        manager = LocalModelManager(samples_path=samples_path)
+        manager.learn("buy followers cheap", "DELETE", source="reaction")
+        manager.learn("Buy  followers CHEAP", "KEEP", source="llm")
+        manager.learn("hello there", "KEEP", source="llm")
+        manager.learn("hello there", "KEEP", source="llm")
+
+        count = manager.retrain()
+        assert count == 2
+        with open(samples_path, 'r', encoding='utf-8') as f:
+            samples = [json.loads(line) for line in f]
+        labels = {s["text"].lower(): s["label"] for s in samples}
+        assert labels["buy followers cheap"] == "DELETE"
+        assert manager.model.doc_counts["DELETE"] == LocalModelManager.SOURCE_WEIGHTS["reaction"]
+    print("   ✅ 离线重训与样本压缩正常")
+
+
+def test_samples_learned_during_retrain_are_kept():
+    """测试重训期间在线学到的样本不会被重写的样本文件覆盖，也会补学到新模型上"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        samples_path = os.path.join(temp_dir, 'samples.jsonl')
+        manager = LocalModelManager(os.path.join(temp_dir, 'model.json'), samples_path)
+        manager.learn("old message", "KEEP")
+        manager.flush_samples()
+        manager.learn("pending message", "KEEP")
+
+        read_samples = manager._read_samples
+
+        def read_while_learning():
+            samples = read_samples()
+            # 模拟重训线程读取样本后、重写文件前事件循环上又学到新样本
+            manager.learn("arrived mid retrain", "DELETE")
+            return samples
+
+        manager._read_samples = read_while_learning
+        assert manager.retrain() == 2
+        manager._read_samples = read_samples
+        assert manager.model.doc_counts == {"DELETE": 1.0, "KEEP": 2.0}
+
+        manager.write_snapshot()
+        with open(samples_path, 'r', encoding='utf-8') as f:
+            texts = [json.loads(line)["text"] for line in f]
+        assert texts == ["old message", "pending message", "arrived mid retrain"]
+        restored = LocalModelManager(os.path.join(temp_dir, 'model.json'))
+        restored.load()
+        assert restored.model.samples == 3
+    print("   ✅ 重训期间的样本不丢失")
+
+
+def test_samples_file_compacted_past_max_samples():
+    """测试样本文件超过 max_samples 一定比例后自动压缩，不会无限增长"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        samples_path = os.path.join(temp_dir, 'samples.jsonl')
+        manager = LocalModelManager(samples_path=samples_path, max_samples=20)
+        for i in range(30):
+            manager.learn(f"message number {i}", "KEEP")
+            manager.flush_samples()
+            with open(samples_path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+            assert len(lines) <= 20 * LocalModelManager.COMPACT_RATIO
+        assert json.loads(lines[-1])["text"] == "message number 29"
+        # 压缩只影响样本文件，在线模型保留全部样本
+        assert manager.model.samples == 30
+    print("   ✅ 样本文件自动压缩")
+
+
+def test_learn_not_blocked_by_snapshot_copy():
+    """测试写快照复制模型期间在线学习不会等待，复制完成后补学"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        manager = LocalModelManager(os.path.join(temp_dir, 'model.json'))
+        manager.learn("hello there", "KEEP")
+        to_dict = manager.model.to_dict
+
+        def copy_while_learning():
+            learner = threading.Thread(target=manager.learn, args=("free usdt now", "DELETE"))
+            learner.start()
+            learner.join(timeout=1)
+            assert not learner.is_alive(), "复制模型期间 learn 不应被阻塞"
+            return to_dict()
+
+        manager.model.to_dict = copy_while_learning
+        manager.write_snapshot()
+        assert manager.model.doc_counts == {"DELETE": 1.0, "KEEP": 1.0}
+        restored = LocalModelManager(os.path.join(temp_dir, 'model.json'))
+        restored.load()
+        assert restored.model.doc_counts == {"DELETE": 0.0, "KEEP": 1.0}
+    print("   ✅ 写快照不阻塞在线学习")
+
+
+if __name__ == "__main__":
+    test_predict_after_training()
+    test_ambiguous_text_falls_through_to_llm()
+    test_manager_threshold_and_snapshot()
+    test_retrain_compacts_samples()
+    test_samples_learned_during_retrain_are_kept()
+    test_samples_file_compacted_past_max_samples()
+    test_learn_not_blocked_by_snapshot_copy()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证结构化日志格式、按分类采样与级别、文件轮转压缩，以及队列管道的后台写入
+"""
+
+import gzip
+import json
+import logging
+import os
+
+import pytest
+
+from log_setup import (
+    CompressingRotatingFileHandler, JsonFormatter, SamplingFilter, parse_pairs, setup_logging, stop_logging
+)
+
+
+def make_record(name="bot.classify", level=logging.INFO, msg="[LLM分类] KEEP: message %d", args=(7,), exc_info=None):
+    return logging.LogRecord(name, level, __file__, 1, msg, args, exc_info)
+
+
+def test_json_formatter_splits_tag_and_keeps_exception():
+    """测试每条记录一行 JSON，[标签] 放在 tag 字段，异常堆栈与固定字段一并输出"""
+    formatter = JsonFormatter({"shard": 2})
+    entry = json.loads(formatter.format(make_record()))
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == "bot.classify"
+    assert entry["tag"] == "LLM分类"
+    assert entry["msg"] == "KEEP: message 7"
+    assert entry["shard"] == 2
+
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        import sys
+        record = make_record(level=logging.ERROR, msg="no tag here", args=None, exc_info=sys.exc_info())
+    entry = json.loads(formatter.format(record))
+    assert "tag" not in entry
+    assert "ValueError: bad" in entry["exc"]
+
+
+def test_sampling_filter_keeps_fraction_and_all_warnings():
+    """测试按最长前缀匹配的分类采样，WARNING 及以上不采样，未配置的分类全部保留"""
+    sampler = SamplingFilter({"bot.classify": 0.25, "bot": 1.0})
+    kept = sum(sampler.filter(make_record()) for _ in range(100))
+    assert kept == 25
+    assert sampler.dropped == 75
+    assert all(sampler.filter(make_record(level=logging.WARNING)) for _ in range(10))
+    assert all(sampler.filter(make_record(name="bot")) for _ in range(10))
+    assert all(sampler.filter(make_record(name="storage")) for _ in range(10))
+    assert parse_pairs("bot.classify=0.1, httpx=WARNING,,bad") == {"bot.classify": "0.1", "httpx": "WARNING"}
+
+
+def test_rotation_compresses_and_prunes(tmp_path):
+    """测试超过大小上限时轮转为 gzip 文件，只保留 backup_count 个"""
+    handler = CompressingRotatingFileHandler(
+        str(tmp_path / "bot.log"), max_bytes=200, interval_seconds=0, backup_count=2
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    for n in range(40):
+        handler.emit(make_record(msg=f"line {n:03d} " + "x" * 40, args=None))
+    handler.close()
+
+    rotated = handler.rotated_files()
+    assert len(rotated) == 2
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".log") and name != "bot.log"]
+    with gzip.open(rotated[-1], "rt", encoding="utf-8") as f:
+        last_rotated = f.read().splitlines()
+    with open(tmp_path / "bot.log", encoding="utf-8") as f:
+        current = f.read().splitlines()
+    # 最新的轮转文件紧接在当前文件之前
+    assert int(last_rotated[-1].split()[1]) + 1 == int(current[0].split()[1])
+    assert current[-1].startswith("line 039")
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    names = ["bot.classify", "httpx", "apscheduler"]
+    levels = {name: logging.getLogger(name).level for name in names}
+    yield
+    stop_logging()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    for name, value in levels.items():
+        logging.getLogger(name).setLevel(value)
+
+
+def test_setup_logging_pipeline(tmp_path, restore_logging):
+    """测试经队列写入 JSON 文件：按分类设置级别、采样高频分类、默认压低 httpx"""
+    sampler = setup_logging(
+        str(tmp_path), name="bot", level="INFO", levels={"bot.classify": "DEBUG"},
+        sampling={"bot.classify": 0.5}, console=False
+    )
+    classify = logging.getLogger("bot.classify")
+    for n in range(10):
+        classify.debug("[LLM分类] prompt %d", n)
+    logging.getLogger("httpx").info("HTTP Request: POST /getUpdates")
+    logging.getLogger("storage").info("[存储] flushed %s", {"rows": 3})
+    logging.getLogger("storage").debug("hidden")
+    classify.warning("[LLM分类] failed")
+    stop_logging()
+
+    with open(tmp_path / "bot.log", encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    classify_entries = [e for e in entries if e["logger"] == "bot.classify"]
+    assert len([e for e in classify_entries if e["level"] == "DEBUG"]) == 5
+    assert classify_entries[-1]["level"] == "WARNING"
+    assert sampler.dropped == 5
+    assert not [e for e in entries if e["logger"] == "httpx"]
+    assert [e["msg"] for e in entries if e["logger"] == "storage"] == ["flushed {'rows': 3}"]
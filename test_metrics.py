@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证指标的文本格式输出、直方图分位数估计、处理器与定时任务计时，以及 /metrics 接口
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from metrics import (
+    HANDLER_DURATION, HANDLER_ERRORS, JOB_DURATION, JOB_ERRORS, JOB_LAST_SUCCESS,
+    Counter, Gauge, Histogram, MetricsServer, Registry, instrument_handlers, timed_job
+)
+
+
+def test_render_text_format():
+    """测试计数器、仪表与直方图按 Prometheus 文本格式输出，标签值被转义"""
+    registry = Registry()
+    counter = registry.register(Counter("requests_total", "Requests.", ["endpoint"]))
+    gauge = registry.register(Gauge("depth", "Depth."))
+    histogram = registry.register(Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0)))
+    counter.labels('say "hi"\n').inc(2)
+    gauge.set(7)
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value)
+
+    text = registry.render()
+    assert '# TYPE tgbot_requests_total counter' in text
+    assert 'tgbot_requests_total{endpoint="say \\"hi\\"\\n"} 2' in text
+    assert 'tgbot_depth 7' in text
+    assert 'tgbot_latency_seconds_bucket{le="0.1"} 1' in text
+    assert 'tgbot_latency_seconds_bucket{le="1"} 2' in text
+    assert 'tgbot_latency_seconds_bucket{le="+Inf"} 3' in text
+    assert 'tgbot_latency_seconds_sum 5.55' in text
+    assert 'tgbot_latency_seconds_count 3' in text
+    assert text.endswith("\n")
+
+    with pytest.raises(ValueError):
+        counter.labels()
+    with pytest.raises(ValueError):
+        registry.register(Gauge("depth", "Duplicate."))
+
+
+def test_histogram_quantile_interpolates_buckets():
+    """测试分位数在桶内线性插值，合并后的分布包含所有标签"""
+    histogram = Histogram("q_seconds", "Q.", ["name"], buckets=(1.0, 2.0, 4.0))
+    for _ in range(50):
+        histogram.labels("a").observe(0.5)
+    for _ in range(50):
+        histogram.labels("b").observe(3.0)
+    assert histogram.labels("a").quantile(0.5) == pytest.approx(0.5)
+    merged = histogram.merged()
+    assert merged.count == 100
+    assert merged.quantile(0.5) == pytest.approx(1.0)
+    assert merged.quantile(0.99) == pytest.approx(2.0 + 2.0 * 49 / 50)
+    # 超出最大边界的观测值只能估计为最大有限边界
+    histogram.labels("c").observe(100)
+    assert histogram.labels("c").quantile(0.5) == 4.0
+    assert Histogram("empty_seconds", "E.").merged().quantile(0.99) == 0.0
+
+
+def test_instrument_handlers_and_timed_job():
+    """测试处理器按回调名计时、异常计数后继续抛出，定时任务记录最近一次成功时间"""
+
+    async def fast_handler(update, context):
+        return "ok"
+
+    async def failing_handler(update, context):
+        raise RuntimeError("boom")
+
+    handlers = [SimpleNamespace(callback=fast_handler), SimpleNamespace(callback=failing_handler)]
+    application = SimpleNamespace(handlers={0: handlers})
+    instrument_handlers(application)
+    wrapped = handlers[0].callback
+    instrument_handlers(application)
+    assert handlers[0].callback is wrapped
+    assert wrapped.__name__ == "fast_handler"
+
+    @timed_job
+    async def nightly_job(context):
+        await asyncio.sleep(0)
+
+    @timed_job
+    async def broken_job(context):
+        raise RuntimeError("boom")
+
+    async def run():
+        assert await handlers[0].callback(None, None) == "ok"
+        with pytest.raises(RuntimeError):
+            await handlers[1].callback(None, None)
+        await nightly_job(None)
+        with pytest.raises(RuntimeError):
+            await broken_job(None)
+
+    asyncio.run(run())
+    assert HANDLER_DURATION.labels("fast_handler").count == 1
+    assert HANDLER_DURATION.labels("failing_handler").count == 1
+    assert HANDLER_ERRORS.labels("failing_handler").value == 1
+    assert HANDLER_ERRORS.labels("fast_handler").value == 0
+    assert JOB_DURATION.labels("nightly_job").count == 1
+    assert JOB_LAST_SUCCESS.labels("nightly_job").value > 0
+    assert JOB_ERRORS.labels("broken_job").value == 1
+    assert JOB_LAST_SUCCESS.labels("broken_job").value == 0
+
+
+def test_metrics_endpoint_runs_collectors():
+    """测试 /metrics 在输出前运行采集回调，失败的回调不影响输出"""
+    registry = Registry()
+    depth = registry.register(Gauge("queue_depth", "Depth.", ["chat_id"]))
+    calls = []
+
+    async def collect_depth():
+        calls.append(1)
+        depth.clear()
+        depth.labels(-100).set(len(calls))
+
+    async def broken_collector():
+        raise RuntimeError("storage closed")
+
+    registry.add_collector(collect_depth)
+    registry.add_collector(broken_collector)
+
+    async def run():
+        server = MetricsServer(registry)
+        async with TestClient(TestServer(server.make_app())) as client:
+            first = await (await client.get("/metrics")).text()
+            resp = await client.get("/metrics")
+            return first, resp.status, resp.headers["Content-Type"], await resp.text()
+
+    first, status, content_type, second = asyncio.run(run())
+    assert 'tgbot_queue_depth{chat_id="-100"} 1' in first
+    assert status == 200
+    assert content_type.startswith("text/plain; version=0.0.4")
+    assert 'tgbot_queue_depth{chat_id="-100"} 2' in second
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证 SimHash 近似重复检测与按群组的有界窗口
+"""
+
+import time
+
+from near_duplicate import NearDuplicateIndex, hamming_distance, simhash
+
+SPAM = "🔥🔥 Earn 500 USDT daily with our trading signals! Join now https://t.me/scamgroup123 limited spots available, contact admin for details"
+SPAM_VARIANT = "🚀 Earn 500 USDT daily with our tradinq signals!! Join now https://t.me/otherscam99 limited spots available, contact admin for detail"
+NORMAL = "Hey everyone, does anyone know a good restaurant near the central station? Looking for something vegetarian friendly tonight"
+
+
+def test_simhash_distance():
+    """测试变体距离近、无关消息距离远"""
+    assert simhash(SPAM) == simhash(SPAM)
+    assert hamming_distance(simhash(SPAM), simhash(SPAM_VARIANT)) <= 10
+    assert hamming_distance(simhash(SPAM), simhash(NORMAL)) > 10
+    print("   ✅ SimHash 距离符合预期")
+
+
+def test_index_per_group():
+    """测试只匹配同一群组内的近期 DELETE 消息"""
+    index = NearDuplicateIndex(max_distance=10)
+    index.add(-100, SPAM)
+    assert index.find(-100, SPAM_VARIANT) is not None
+    assert index.find(-100, NORMAL) is None
+    assert index.find(-200, SPAM_VARIANT) is None, "其他群组不应命中"
+    assert index.find(-100, "short spam") is None, "过短消息不参与近似匹配"
+    assert index.hits == 1
+    print("   ✅ 按群组匹配正常")
+
+
+def test_window_bounds():
+    """测试窗口容量与时间上限"""
+    index = NearDuplicateIndex(window_size=2)
+    index.add(-100, SPAM)
+    index.add(-100, NORMAL)
+    index.add(-100, "A completely different announcement about the weekly community meetup schedule")
+    assert len(index) == 2
+    assert index.find(-100, SPAM_VARIANT) is None, "最早的条目应已被淘汰"
+
+    index = NearDuplicateIndex(window_seconds=0.01)
+    index.add(-100, SPAM)
+    time.sleep(0.02)
+    assert index.find(-100, SPAM_VARIANT) is None, "过期条目不应命中"
+    assert len(index) == 0
+    print("   ✅ 窗口淘汰正常")
+
+
+if __name__ == "__main__":
+    test_simhash_distance()
+    test_index_per_group()
+    test_window_bounds()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证删除权限表、权限判定、有限并发对账与管理员名单缓存
+"""
+
+import asyncio
+
+from telegram import ChatMemberAdministrator, ChatMemberMember, ChatMemberOwner, User
+
+from permissions import AdminRosterCache, PermissionTable, member_can_delete, reconcile
+
+BOT = User(id=1, first_name="bot", is_bot=True)
+
+
+def make_admin(can_delete):
+    return ChatMemberAdministrator(
+        user=BOT, can_be_edited=False, is_anonymous=False, can_manage_chat=True,
+        can_delete_messages=can_delete, can_manage_video_chats=False, can_restrict_members=True,
+        can_promote_members=False, can_change_info=False, can_invite_users=True,
+        can_post_stories=False, can_edit_stories=False, can_delete_stories=False,
+    )
+
+
+def test_member_can_delete():
+    """测试群主、管理员与普通成员的删除权限判定"""
+    assert member_can_delete(ChatMemberOwner(user=BOT, is_anonymous=False))
+    assert member_can_delete(make_admin(True))
+    assert not member_can_delete(make_admin(False))
+    assert not member_can_delete(ChatMemberMember(user=BOT))
+
+
+def test_permission_table_stale():
+    """测试权限更新返回旧值，并只把长时间未确认的群组列为待对账"""
+    table = PermissionTable()
+    assert table.update(-100, True, checked_at=1000) is None
+    assert table.update(-100, False, checked_at=5000) is True
+    table.update(-200, True, checked_at=1000)
+
+    assert table.get(-100) is False
+    assert table.stale([-100, -200, -300], max_age=3600, now=6000) == [-200, -300]
+    table.forget(-200)
+    assert -200 not in table
+
+
+def test_reconcile_bounded_concurrency():
+    """测试对账时并发数不超过上限，异常作为结果返回"""
+    running = 0
+    peak = 0
+
+    async def check(chat_id):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        if chat_id == -3:
+            raise RuntimeError("boom")
+        return chat_id % 2 == 0
+
+    results = asyncio.run(reconcile([-1, -2, -3, -4, -5, -6], check, concurrency=2))
+    assert peak == 2
+    assert results[-2] is True and results[-1] is False
+    assert isinstance(results[-3], RuntimeError)
+
+
+def test_admin_roster_cache_ttl_and_invalidate():
+    """测试管理员名单缓存命中、并发未命中只请求一次、失效后重新请求"""
+    calls = []
+
+    async def fetch(chat_id):
+        calls.append(chat_id)
+        await asyncio.sleep(0.01)
+        return [ChatMemberOwner(user=User(id=7, first_name="owner", is_bot=False), is_anonymous=False),
+                make_admin(True), ChatMemberMember(user=User(id=9, first_name="user", is_bot=False))]
+
+    async def run():
+        cache = AdminRosterCache(ttl=60)
+        results = await asyncio.gather(*(cache.is_admin(-100, 7, fetch) for _ in range(5)))
+        assert all(results) and calls == [-100]
+        assert await cache.is_admin(-100, BOT.id, fetch)
+        assert not await cache.is_admin(-100, 9, fetch)
+        assert calls == [-100]
+        cache.invalidate(-100)
+        assert member_can_delete(await cache.member(-100, BOT.id, fetch))
+        assert calls == [-100, -100]
+        cache.ttl = 0
+        cache.invalidate(-100)
+        await cache.is_admin(-100, 7, fetch)
+        await cache.is_admin(-100, 7, fetch)
+        assert len(calls) == 4
+
+    asyncio.run(run())
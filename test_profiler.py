@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证剖析会话区分墙钟与 CPU 时间、输出折叠栈与 cProfile 文件，未开启时不记录
+"""
+
+import asyncio
+import json
+import os
+import pstats
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from profiler import Profiler, format_timings
+
+
+def burn(seconds):
+    deadline = time.thread_time() + seconds
+    total = 0
+    while time.thread_time() < deadline:
+        total += 1
+    return total
+
+
+async def slow_io_handler(update, context):
+    await asyncio.sleep(0.2)
+    burn(0.05)
+    return "done"
+
+
+async def background_cpu(stop):
+    # 与被测处理器并发运行的 CPU 负载，不应计入处理器的 CPU 时间
+    while not stop.is_set():
+        burn(0.01)
+        await asyncio.sleep(0)
+
+
+def test_wall_and_cpu_time_are_separated(tmp_path):
+    """测试等待时间只计入墙钟时间，其他任务占用的 CPU 不计入处理器"""
+    profiler = Profiler(str(tmp_path), interval=0.002)
+    handler = SimpleNamespace(callback=slow_io_handler)
+    profiler.instrument_handlers(SimpleNamespace(handlers={0: [handler]}))
+
+    @profiler.job
+    async def failing_job(context):
+        await asyncio.sleep(0)
+        raise RuntimeError("boom")
+
+    async def run():
+        # 未开启时直接调用，不记录
+        assert await handler.callback(None, None) == "done"
+        assert profiler.timings() == {}
+
+        profiler.start("sample")
+        stop = asyncio.Event()
+        noise = asyncio.get_running_loop().create_task(background_cpu(stop))
+        assert await handler.callback(None, None) == "done"
+        with pytest.raises(RuntimeError):
+            await failing_job(None)
+        stop.set()
+        await noise
+        return await profiler.stop()
+
+    report = asyncio.run(run())
+    entry = report["timings"]["slow_io_handler"]
+    assert entry["kind"] == "handler" and entry["calls"] == 1
+    assert entry["wall"] >= 0.25
+    assert 0.04 <= entry["cpu"] <= 0.12
+    assert report["timings"]["failing_job"]["kind"] == "job"
+    assert report["samples"] > 0
+
+    folded = [path for path in report["files"] if path.endswith(".folded")]
+    assert len(folded) == 1
+    with open(folded[0], encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+    assert any("burn (test_profiler.py:" in line for line in lines)
+    with open(next(p for p in report["files"] if p.endswith("-timings.json")), encoding="utf-8") as f:
+        assert json.load(f)["timings"]["slow_io_handler"]["calls"] == 1
+    assert format_timings(report["timings"], limit=1)[0].startswith("slow_io_handler [handler]: 1 calls")
+
+
+def test_cprofile_mode_writes_pstats(tmp_path):
+    """测试 cProfile 模式写出可由 pstats 读取的文件，同一时间只能有一个会话"""
+    profiler = Profiler(str(tmp_path))
+
+    async def run():
+        profiler.start("cprofile")
+        with pytest.raises(RuntimeError):
+            profiler.start("sample")
+        burn(0.02)
+        return await profiler.stop()
+
+    report = asyncio.run(run())
+    prof = next(path for path in report["files"] if path.endswith(".prof"))
+    stats = pstats.Stats(prof)
+    assert any(func[2] == "burn" for func in stats.stats)
+    assert os.path.exists(prof[:-len(".prof")] + ".txt")
+    assert not profiler.active
+    with pytest.raises(ValueError):
+        profiler.start("perf")
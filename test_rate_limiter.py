@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证出站请求限流的令牌桶、优先级与 RetryAfter 重试
+"""
+
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from rate_limiter import PRIORITY_BATCH, PRIORITY_INTERACTIVE, PriorityRateLimiter, TokenBucket
+
+
+def test_token_bucket():
+    """测试令牌耗尽后的等待时间"""
+    bucket = TokenBucket(rate=10, capacity=2)
+    now = time.monotonic()
+    assert bucket.delay(now) == 0
+    bucket.consume()
+    bucket.consume()
+    assert 0.09 <= bucket.delay(now) <= 0.11
+    print("   ✅ 令牌桶计算正确")
+
+
+def test_per_chat_limit_and_priority():
+    """测试每聊天限速，以及高优先级请求插队"""
+    limiter = PriorityRateLimiter(overall_per_second=1000, chat_per_second=20, chat_burst=1)
+    order = []
+
+    async def call(tag):
+        order.append(tag)
+        return True
+
+    async def run():
+        try:
+            start = time.monotonic()
+            tasks = [
+                asyncio.ensure_future(limiter.process_request(
+                    call, (f"batch{i}",), {}, "deleteMessage", {"chat_id": -1}, {"priority": PRIORITY_BATCH}))
+                for i in range(3)
+            ]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.ensure_future(limiter.process_request(
+                call, ("interactive",), {}, "deleteMessage", {"chat_id": -1}, {"priority": PRIORITY_INTERACTIVE})))
+            await asyncio.gather(*tasks)
+            return time.monotonic() - start
+        finally:
+            await limiter.shutdown()
+
+    elapsed = asyncio.run(run())
+    # 桶容量为 1：首个批量请求立即放行，之后交互式请求优先
+    assert order[0] == "batch0"
+    assert order[1] == "interactive"
+    assert elapsed >= 0.14, f"4 个请求在 20/s 下至少需要 0.15s，实际 {elapsed:.3f}s"
+    print("   ✅ 每聊天限速与优先级正常")
+
+
+def test_retry_after():
+    """测试 RetryAfter 后暂停该聊天并自动重试"""
+    limiter = PriorityRateLimiter(overall_per_second=1000, chat_per_second=1000, chat_burst=10)
+    attempts = []
+
+    async def flaky():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise RetryAfter(0)
+        return True
+
+    async def run():
+        try:
+            return await limiter.process_request(flaky, (), {}, "sendMessage", {"chat_id": -1}, None)
+        finally:
+            await limiter.shutdown()
+
+    assert asyncio.run(run()) is True
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= 0.09, "重试前应至少等待 retry_after + 0.1 秒"
+    assert limiter.retry_after_count == 1
+    print("   ✅ RetryAfter 重试正常")
+
+
+def test_retry_after_pauses_chat_bucket():
+    """测试群组发消息触发 RetryAfter 时暂停该聊天的桶，而不是群组发消息桶或全局桶"""
+    limiter = PriorityRateLimiter(overall_per_second=1000, chat_per_second=1000, chat_burst=10)
+
+    async def flood():
+        raise RetryAfter(1)
+
+    async def ok():
+        return True
+
+    async def run():
+        try:
+            try:
+                await limiter.process_request(flood, (), {}, "sendMessage", {"chat_id": -1}, None)
+            except RetryAfter:
+                pass
+            now = time.monotonic()
+            chat_bucket = limiter._chat_buckets[-1]
+            assert chat_bucket.blocked_until > now + 0.5
+            assert limiter._group_send_buckets[-1].blocked_until <= now
+            assert limiter._overall.blocked_until <= now
+            # 其他聊天不受影响
+            started = time.monotonic()
+            assert await limiter.process_request(ok, (), {}, "deleteMessage", {"chat_id": -2}, None)
+            assert time.monotonic() - started < 0.5
+            # 没有聊天的请求暂停全局桶
+            try:
+                await limiter.process_request(flood, (), {}, "getUpdates", {}, None)
+            except RetryAfter:
+                pass
+            assert limiter._overall.blocked_until > time.monotonic() + 0.5
+        finally:
+            await limiter.shutdown()
+
+    limiter.max_retries = 0
+    asyncio.run(run())
+    print("   ✅ RetryAfter 按聊天暂停")
+
+
+def test_idle_chat_buckets_evicted():
+    """测试空闲的聊天桶被定期清除，被暂停的桶保留"""
+    limiter = PriorityRateLimiter(overall_per_second=1000, chat_per_second=1000, chat_burst=10)
+
+    async def ok():
+        return True
+
+    async def run():
+        try:
+            for chat_id in range(-1, -51, -1):
+                await limiter.process_request(ok, (), {}, "sendMessage", {"chat_id": chat_id}, None)
+            limiter._chat_buckets[-1].blocked_until = time.monotonic() + 60
+            assert len(limiter._chat_buckets) == 50
+            await asyncio.sleep(0.05)
+            limiter.SWEEP_INTERVAL = 0
+            await limiter.process_request(ok, (), {}, "deleteMessage", {"chat_id": -999}, None)
+            assert set(limiter._chat_buckets) == {-1, -999}
+        finally:
+            await limiter.shutdown()
+
+    asyncio.run(run())
+    print("   ✅ 空闲聊天桶被清除")
+
+
+if __name__ == "__main__":
+    test_token_bucket()
+    test_per_chat_limit_and_priority()
+    test_retry_after()
+    test_retry_after_pauses_chat_bucket()
+    test_idle_chat_buckets_evicted()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证消息标记的后台发送、退避重试、不可重试错误与按群组合并
+"""
+
+import asyncio
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from reaction_marker import ReactionMarker
+
+
+class FakeBot:
+    def __init__(self, failures=0, error=NetworkError("reset")):
+        self.failures = failures
+        self.error = error
+        self.calls = []
+
+    async def set_message_reaction(self, chat_id, message_id, reaction, rate_limit_args=None):
+        self.calls.append((chat_id, message_id, reaction))
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        await asyncio.sleep(0)
+        return True
+
+
+async def mark_and_drain(marker, bot, chat_id, message_id):
+    await marker.mark(bot, chat_id, message_id)
+    while marker._workers:
+        await asyncio.sleep(0.001)
+
+
+def test_retry_with_backoff():
+    """测试临时错误按退避重试直到成功"""
+    bot = FakeBot(failures=2)
+    marker = ReactionMarker(retry_base_delay=0.001)
+    asyncio.run(mark_and_drain(marker, bot, -100, 1))
+    assert len(bot.calls) == 3
+    assert marker.marked == 1 and marker.failed == 0
+
+
+def test_bad_request_not_retried():
+    """测试消息已删除等 BadRequest 不重试"""
+    bot = FakeBot(failures=5, error=BadRequest("Message to react not found"))
+    marker = ReactionMarker(retry_base_delay=0.001)
+    asyncio.run(mark_and_drain(marker, bot, -100, 1))
+    assert len(bot.calls) == 1
+    assert marker.failed == 1
+
+
+def test_gives_up_after_max_retries():
+    """测试超过最大重试次数后放弃"""
+    bot = FakeBot(failures=10)
+    marker = ReactionMarker(max_retries=2, retry_base_delay=0.001)
+    asyncio.run(mark_and_drain(marker, bot, -100, 1))
+    assert len(bot.calls) == 3
+    assert marker.failed == 1
+
+
+def test_retry_after_left_to_rate_limiter():
+    """测试 RetryAfter 不在标记器中重复重试（限流器已处理）"""
+    bot = FakeBot(failures=5, error=RetryAfter(1))
+    marker = ReactionMarker(retry_base_delay=0.001)
+    asyncio.run(mark_and_drain(marker, bot, -100, 1))
+    assert len(bot.calls) == 1
+    assert marker.failed == 1
+
+
+def test_mark_does_not_wait_for_send():
+    """测试 mark 只入队返回，发送失败与退避不阻塞调用方"""
+    bot = FakeBot(failures=10)
+    marker = ReactionMarker(max_retries=3, retry_base_delay=10)
+
+    async def run():
+        await asyncio.wait_for(marker.mark(bot, -100, 1), timeout=0.5)
+        assert -100 in marker._workers
+        await marker.close()
+
+    asyncio.run(run())
+
+
+def test_coalesce_dedup_and_shed():
+    """测试重复标记只发送一次，积压过多时丢弃最早的标记"""
+    bot = FakeBot()
+    marker = ReactionMarker(max_pending_per_chat=3)
+
+    async def run():
+        for message_id in [1, 1, 2, 3, 4, 5, 5]:
+            await marker.mark(bot, -100, message_id)
+        await marker.mark(bot, -200, 9)
+        while marker._workers:
+            await asyncio.sleep(0.001)
+
+    asyncio.run(run())
+    sent = [(chat_id, message_id) for chat_id, message_id, _ in bot.calls]
+    assert sorted(sent) == [(-200, 9), (-100, 3), (-100, 4), (-100, 5)]
+    assert marker.dropped == 2
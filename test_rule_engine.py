@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证 Aho-Corasick 自动机与按群组的规则预过滤
+"""
+
+import os
+import re
+import tempfile
+
+from rule_engine import DELETE, KEEP, UNSURE, AhoCorasick, RuleEngine
+
+
+def test_aho_corasick():
+    """测试多模式匹配（含重叠与后缀模式）及增量添加"""
+    automaton = AhoCorasick(["he", "she", "his", "hers"])
+    assert sorted(automaton.iter_matches("ushers")) == ["he", "hers", "she"]
+    assert automaton.search("nothing here") == "he"
+    assert AhoCorasick(["xyz"]).search("abc") is None
+
+    automaton.add("sher")
+    assert "sher" in list(automaton.iter_matches("ushers")), "增量添加的模式应立即生效"
+    print("   ✅ Aho-Corasick 匹配正常")
+
+
+def test_rule_priority_and_groups():
+    """测试 KEEP 优先、按群组隔离、未命中返回 UNSURE"""
+    engine = RuleEngine()
+    engine.add_rule(-100, "delete", "keyword", "t.me/joinchat")
+    engine.add_rule(-100, "delete", "regex", r"(?:free|cheap)\s+usdt")
+    engine.add_rule(-100, "keep", "keyword", "official announcement")
+
+    assert engine.evaluate(-100, "Join T.ME/JoinChat/abc now") == DELETE
+    assert engine.evaluate(-100, "get FREE   usdt today") == DELETE
+    assert engine.evaluate(-100, "Official Announcement: t.me/joinchat/team") == KEEP
+    assert engine.evaluate(-100, "hello world") == UNSURE
+    assert engine.evaluate(-200, "t.me/joinchat/abc") == UNSURE, "其他群组不应受影响"
+    assert engine.hits == {DELETE: 2, KEEP: 1}
+    print("   ✅ 规则优先级与群组隔离正常")
+
+
+def test_add_remove_and_persistence():
+    """测试重复添加、删除、非法正则与持久化"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'rules.json')
+        engine = RuleEngine(path)
+        assert engine.add_rule(-100, "delete", "keyword", "scam")
+        assert not engine.add_rule(-100, "delete", "keyword", "SCAM"), "规范化后重复的关键词不应重复添加"
+        try:
+            engine.add_rule(-100, "delete", "regex", "(unclosed")
+            assert False, "非法正则应抛出异常"
+        except re.error:
+            pass
+        engine.add_rule(-100, "delete", "keyword", "airdrop")
+        assert engine.remove_rule(-100, "delete", "keyword", "scam")
+        assert not engine.remove_rule(-100, "delete", "keyword", "scam")
+        engine.save()
+
+        reloaded = RuleEngine(path)
+        reloaded.load()
+        assert reloaded.evaluate(-100, "free airdrop") == DELETE
+        assert reloaded.evaluate(-100, "scam") == UNSURE
+    print("   ✅ 规则增删与持久化正常")
+
+
+if __name__ == "__main__":
+    test_aho_corasick()
+    test_rule_priority_and_groups()
+    test_add_remove_and_persistence()
+    print("\n🎉 所有测试通过！")
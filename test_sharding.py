@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证分片哈希、数据目录拆分，以及监督进程与工作进程之间的更新路由和配置同步
+"""
+
+import asyncio
+import json
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from telegram import Chat, Message, Update
+
+from sharding import ShardLink, ShardSupervisor, base_data_dir, seed_shards, shard_data_dir, shard_for, verify_shard_dir
+from storage import JsonStorage
+
+
+def test_shard_for_is_stable_and_spread():
+    """测试同一 chat_id 总是落在同一分片，且分布大致均匀"""
+    chat_ids = [-1001000000000 - i for i in range(4000)]
+    counts = [0] * 4
+    for chat_id in chat_ids:
+        assert shard_for(chat_id, 4) == shard_for(chat_id, 4)
+        counts[shard_for(chat_id, 4)] += 1
+    assert min(counts) > 800
+
+
+def write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def test_base_data_dir_honours_env(tmp_path, monkeypatch):
+    """监督进程与分片解析出同一个数据目录，DATA_DIR 环境变量优先"""
+    monkeypatch.delenv("DATA_DIR", raising=False)
+    assert base_data_dir() == os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+    monkeypatch.setenv("DATA_DIR", str(tmp_path / "custom"))
+    assert base_data_dir() == str(tmp_path / "custom")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DATA_DIR", "relative")
+    assert base_data_dir() == str(tmp_path / "relative")
+
+
+def test_seed_shards_splits_groups_and_queue(tmp_path):
+    """测试按群组归属拆分群组与删除队列，全局配置与规则复制到每个分片"""
+    data_dir = str(tmp_path)
+    chat_ids = [-100 - i for i in range(20)]
+    write_json(os.path.join(data_dir, 'groups.json'), [{"id": c, "name": f"g{c}"} for c in chat_ids])
+    write_json(os.path.join(data_dir, 'deletion_queue.json'),
+               [{"chat_id": c, "message_id": m, "date": 1000 + m} for c in chat_ids for m in (1, 2)])
+    write_json(os.path.join(data_dir, 'deletion_config.json'), {"deletion_time": "03:00"})
+    write_json(os.path.join(data_dir, 'rules.json'), {"-100": []})
+
+    seeded = seed_shards(data_dir, 3)
+    assert sum(seeded.values()) == len(chat_ids)
+
+    for index in range(3):
+        shard_dir = shard_data_dir(data_dir, index)
+        verify_shard_dir(shard_dir, index, 3)
+        storage = JsonStorage(
+            os.path.join(shard_dir, 'groups.json'),
+            os.path.join(shard_dir, 'deletion_queue.json'),
+            os.path.join(shard_dir, 'deletion_queue.journal'),
+            os.path.join(shard_dir, 'deletion_config.json'),
+        )
+        groups = storage.load_groups()
+        assert all(shard_for(c, 3) == index for c in groups)
+        assert storage.load_config() == {"deletion_time": "03:00"}
+        storage.load_queue()
+        assert sorted(storage.queue.items()) == sorted(
+            (c, m, 1000 + m) for c in groups for m in (1, 2)
+        )
+        assert os.path.exists(os.path.join(shard_dir, 'rules.json'))
+        storage.close()
+
+    # 已初始化的分片不会被覆盖
+    assert seed_shards(data_dir, 3) == {}
+    with pytest.raises(ValueError):
+        seed_shards(data_dir, 4)
+    with pytest.raises(ValueError):
+        verify_shard_dir(shard_data_dir(data_dir, 0), 0, 4)
+
+
+class FakeProcessor:
+    async def process_update(self, update, coroutine):
+        await coroutine
+
+
+def make_worker_app():
+    processed = []
+
+    async def process_update(update):
+        processed.append((update.effective_chat.id, update.update_id))
+
+    application = SimpleNamespace(bot=None, update_processor=FakeProcessor(), process_update=process_update)
+    return application, processed
+
+
+def make_update(update_id, chat_id):
+    chat = Chat(id=chat_id, type=Chat.SUPERGROUP)
+    return Update(update_id=update_id, message=Message(message_id=update_id, date=datetime.now(), chat=chat, text="x"))
+
+
+def test_routing_and_config_broadcast():
+    """测试更新只路由到所属分片且保序，配置变更转发给其他分片，重连的分片收到最新配置"""
+
+    async def run():
+        supervisor = ShardSupervisor(2)
+        await supervisor.start()
+        address = f"127.0.0.1:{supervisor.port}"
+        workers = []
+        for index in range(2):
+            application, processed = make_worker_app()
+            configs = []
+            link = ShardLink(index, 2, address)
+            task = asyncio.get_running_loop().create_task(link.run(application, configs.append))
+            workers.append((link, task, processed, configs))
+        while len(supervisor._links) < 2:
+            await asyncio.sleep(0.01)
+
+        chat_ids = [-100 - i for i in range(10)]
+        updates = [make_update(n, chat_ids[n % 10]) for n in range(1, 41)]
+        for update in updates:
+            await supervisor.route(update, None)
+
+        workers[0][0].publish_config({"deletion_time": "05:00"})
+        while not workers[1][3] or sum(len(w[2]) for w in workers) < len(updates):
+            await asyncio.sleep(0.01)
+
+        # 分片 1 重新连接后收到离线期间之前最新的配置
+        link, task, _, _ = workers[1]
+        link.close()
+        await task
+        application, _ = make_worker_app()
+        configs = []
+        relink = ShardLink(1, 2, address)
+        retask = asyncio.get_running_loop().create_task(relink.run(application, configs.append))
+        while not configs:
+            await asyncio.sleep(0.01)
+
+        await supervisor.stop()
+        await asyncio.gather(workers[0][1], retask)
+        return supervisor, workers, configs
+
+    supervisor, workers, reconnect_configs = asyncio.run(run())
+    for index, (_, _, processed, _) in enumerate(workers):
+        assert processed
+        assert all(shard_for(chat_id, 2) == index for chat_id, _ in processed)
+        for chat_id in {c for c, _ in processed}:
+            ids = [u for c, u in processed if c == chat_id]
+            assert ids == sorted(ids)
+    assert sum(supervisor.routed) == 40
+    assert workers[1][3] == [{"deletion_time": "05:00"}]
+    assert workers[0][3] == []
+    assert reconnect_configs == [{"deletion_time": "05:00"}]
+
+
+def test_offline_shard_does_not_stall_others():
+    """测试离线分片只积压自己的有界出站队列（满时丢弃最早的更新），其他分片照常处理"""
+
+    async def run():
+        supervisor = ShardSupervisor(2, max_outbound=5)
+        await supervisor.start()
+        address = f"127.0.0.1:{supervisor.port}"
+        application, processed = make_worker_app()
+        link = ShardLink(0, 2, address)
+        task = asyncio.get_running_loop().create_task(link.run(application, lambda cfg: None))
+        while 0 not in supervisor._links:
+            await asyncio.sleep(0.01)
+
+        offline = [c for c in range(-100, -200, -1) if shard_for(c, 2) == 1][:1] * 8
+        online = [c for c in range(-100, -200, -1) if shard_for(c, 2) == 0][:4]
+        chats = offline + online
+        # 分片 1 离线时 route 不等待
+        await asyncio.wait_for(
+            asyncio.gather(*[supervisor.route(make_update(n, c), None) for n, c in enumerate(chats, 1)]), 1
+        )
+        while len(processed) < len(online):
+            await asyncio.sleep(0.01)
+        assert supervisor.outbound_sizes == [0, 5]
+        assert supervisor.dropped == [0, 3]
+
+        late_app, late_processed = make_worker_app()
+        late = ShardLink(1, 2, address)
+        late_task = asyncio.get_running_loop().create_task(late.run(late_app, lambda cfg: None))
+        while len(late_processed) < 5:
+            await asyncio.sleep(0.01)
+        await supervisor.stop()
+        await asyncio.gather(task, late_task)
+        return late_processed
+
+    assert [update_id for _, update_id in asyncio.run(run())] == [4, 5, 6, 7, 8]
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证 JSON 与 SQLite 存储后端及 JSON 导入
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+
+from storage import JsonStorage, SqliteStorage, import_json_files
+
+
+def make_json_storage(temp_dir):
+    return JsonStorage(
+        os.path.join(temp_dir, 'groups.json'),
+        os.path.join(temp_dir, 'deletion_queue.json'),
+        os.path.join(temp_dir, 'deletion_queue.journal'),
+        os.path.join(temp_dir, 'deletion_config.json'),
+    )
+
+
+def exercise_backend(storage):
+    storage.save_groups({-100: {"name": "A"}, -200: {"name": "B"}})
+    storage.save_config({"deletion_time": "03:00", "llm_config": {"model": "m"}})
+    storage.enqueue(-100, 1, 1000)
+    storage.enqueue(-100, 2)
+    storage.enqueue(-200, 3, 3000)
+
+    async def run():
+        assert await storage.pending_count() == 3
+        assert await storage.pending_count(-100) == 2
+        selected = await storage.select_pending(-100)
+        assert selected == [{'chat_id': -100, 'message_id': 1}, {'chat_id': -100, 'message_id': 2}]
+        assert await storage.pending_older_than(2000) == {-100: [1]}
+        assert await storage.pending_summary() == {-100: (2, 1000), -200: (1, 3000)}
+        storage.remove_pending([(-100, 1), (-200, 3)])
+        assert await storage.select_pending() == [{'chat_id': -100, 'message_id': 2}]
+        assert await storage.pending_summary() == {-100: (1, 0)}
+        await storage.flush()
+
+    asyncio.run(run())
+    assert storage.load_groups() == {-100: {"name": "A"}, -200: {"name": "B"}}
+    assert storage.load_config()["llm_config"] == {"model": "m"}
+
+
+def check_select_pending_round_robin(storage):
+    """两个群组共用一批预算：入队很快的群组不会占满整批"""
+    for message_id in range(1, 11):
+        storage.enqueue(-100, message_id)
+    storage.enqueue(-200, 50)
+    storage.enqueue(-200, 51)
+
+    selected = asyncio.run(storage.select_pending(limit=4))
+    assert [(e['chat_id'], e['message_id']) for e in selected] == [(-100, 1), (-200, 50), (-100, 2), (-200, 51)]
+
+
+def test_select_pending_shares_budget_across_chats():
+    """测试两种后端的 select_pending 都按群组轮流返回"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        storage = make_json_storage(temp_dir)
+        storage.load_queue()
+        check_select_pending_round_robin(storage)
+        storage.close()
+
+        storage = SqliteStorage(os.path.join(temp_dir, 'bot.db'))
+        check_select_pending_round_robin(storage)
+        storage.close()
+
+
+def test_json_backend():
+    """测试 JSON 后端的读写与队列操作"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        storage = make_json_storage(temp_dir)
+        exercise_backend(storage)
+        storage.close()
+
+        reopened = make_json_storage(temp_dir)
+        reopened.load_queue()
+        assert reopened.queue.to_list() == [{'chat_id': -100, 'message_id': 2}]
+
+
+def test_json_removals_are_journaled():
+    """测试出队只追加日志、不重写快照，超过阈值后由 flush 压缩"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        storage = make_json_storage(temp_dir)
+        storage.journal.compact_threshold = 6
+        for message_id in range(4):
+            storage.enqueue(-100, message_id)
+        snapshot = os.path.join(temp_dir, 'deletion_queue.json')
+        assert not os.path.exists(snapshot)
+
+        storage.remove_pending([(-100, 0), (-100, 0), (-100, 9)])
+        assert not os.path.exists(snapshot)
+        assert storage.journal.records == 5
+
+        storage.remove_pending([(-100, 1)])
+        asyncio.run(storage.flush())
+        assert storage.journal.records == 0
+        with open(snapshot, 'r', encoding='utf-8') as f:
+            assert json.load(f) == [{'chat_id': -100, 'message_id': 2}, {'chat_id': -100, 'message_id': 3}]
+        storage.remove_pending([(-100, 2)])
+        storage.close()
+
+        reopened = make_json_storage(temp_dir)
+        reopened.load_queue()
+        assert reopened.queue.to_list() == [{'chat_id': -100, 'message_id': 3}]
+
+
+def test_sqlite_backend_and_audit():
+    """测试 SQLite 后端的读写、去重与审计日志"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'bot.db')
+        storage = SqliteStorage(path)
+        exercise_backend(storage)
+        # 同一条消息重复入队只保留一条，也只记录一次 queued 审计
+        storage.enqueue(-100, 2, reason="reaction")
+        storage.enqueue(-100, 5, reason="classifier")
+        storage.enqueue(-100, 5, reason="reaction")
+        storage.log_deletions([(-100, 1, "deleted", "batch")])
+        assert asyncio.run(storage.pending_count(-100)) == 2
+        storage.close()
+
+        conn = sqlite3.connect(path)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("SELECT chat_id, message_id, action, reason FROM deletion_audit ORDER BY id").fetchall() == [
+            (-100, 5, "queued", "classifier"), (-100, 1, "deleted", "batch")
+        ]
+        conn.close()
+
+
+def test_sqlite_save_groups_writes_only_changes():
+    """测试 SQLite 保存群组时只写入变化的群组，移除的群组与配置项被删除"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'bot.db')
+        storage = SqliteStorage(path)
+        groups = {-100: {"name": "A", "deletion_time": "01:00"}, -200: {"name": "B", "bot_can_delete": True}}
+        storage.save_groups(groups)
+
+        posted = []
+        post = storage._db.post
+        storage._db.post = lambda fn: (posted.append(fn), post(fn))
+        storage.save_groups(groups)
+        assert posted == [], "没有变化时不应写入"
+
+        del groups[-100]
+        groups[-200]["name"] = "B2"
+        groups[-200].pop("bot_can_delete")
+        groups[-200]["deletion_time"] = "02:00"
+        groups[-300] = {"name": "C"}
+        storage.save_groups(groups)
+        assert len(posted) == 1
+        asyncio.run(storage.flush())
+        storage.close()
+
+        reopened = SqliteStorage(path)
+        assert reopened.load_groups() == {-200: {"name": "B2", "deletion_time": "02:00"}, -300: {"name": "C"}}
+        reopened.close()
+
+
+def test_import_json_files():
+    """测试把现有 JSON 文件一次性导入 SQLite"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with open(os.path.join(temp_dir, 'groups.json'), 'w', encoding='utf-8') as f:
+            json.dump([{"id": -100, "name": "A"}], f)
+        with open(os.path.join(temp_dir, 'deletion_config.json'), 'w', encoding='utf-8') as f:
+            json.dump({"deletion_time": "01:30"}, f)
+        with open(os.path.join(temp_dir, 'deletion_queue.json'), 'w', encoding='utf-8') as f:
+            json.dump([{"chat_id": -100, "message_id": 7}, {"invalid": True}], f)
+
+        target = SqliteStorage(os.path.join(temp_dir, 'bot.db'))
+        assert target.is_empty()
+        counts = import_json_files(target, make_json_storage(temp_dir))
+        assert counts == {"groups": 1, "config_keys": 1, "pending": 1}
+        assert not target.is_empty()
+        assert target.load_groups() == {-100: {"name": "A"}}
+        assert target.load_config() == {"deletion_time": "01:30"}
+        assert asyncio.run(target.select_pending()) == [{'chat_id': -100, 'message_id': 7}]
+        target.close()
+
+
+def test_sqlite_migrates_old_schema():
+    """测试旧版本数据库自动补齐 message_date 列"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'bot.db')
+        conn = sqlite3.connect(path)
+        conn.execute(
+            "CREATE TABLE pending_deletions (chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, "
+            "enqueued_at REAL NOT NULL, PRIMARY KEY (chat_id, message_id)) WITHOUT ROWID"
+        )
+        conn.execute("INSERT INTO pending_deletions VALUES (-100, 1, 0)")
+        conn.commit()
+        conn.close()
+
+        storage = SqliteStorage(path)
+        storage.enqueue(-100, 2, 500)
+        assert asyncio.run(storage.pending_older_than(1000)) == {-100: [2]}
+        assert asyncio.run(storage.pending_count()) == 2
+        storage.close()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证按聊天分道的并发更新处理（跨聊天并发、聊天内保序、积压背压）
+"""
+
+import asyncio
+from datetime import datetime
+
+from telegram import Chat, Message, Update
+
+from update_processor import BacklogQueue, PerChatUpdateProcessor, lane_key
+
+
+def make_update(update_id, chat_id):
+    chat = Chat(id=chat_id, type=Chat.SUPERGROUP)
+    return Update(update_id=update_id, message=Message(message_id=update_id, date=datetime.now(), chat=chat))
+
+
+def run_updates(processor, updates, delays):
+    log = []
+
+    async def handle(update):
+        log.append(("start", update.update_id))
+        await asyncio.sleep(delays.get(update.update_id, 0.01))
+        log.append(("end", update.update_id))
+
+    async def run():
+        await processor.initialize()
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(*[processor.process_update(u, handle(u)) for u in updates])
+        return asyncio.get_running_loop().time() - start
+
+    return log, asyncio.run(run())
+
+
+def test_same_chat_in_order():
+    """测试同一聊天的更新按顺序执行，即使前一个更慢"""
+    updates = [make_update(i, -100) for i in range(1, 4)]
+    log, _ = run_updates(PerChatUpdateProcessor(max_workers=4), updates, {1: 0.05})
+    assert log == [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 3), ("end", 3)]
+    print("   ✅ 聊天内保序")
+
+
+def test_chats_run_concurrently():
+    """测试不同聊天的慢更新不会互相阻塞"""
+    updates = [make_update(i, -100 - i) for i in range(1, 6)]
+    _, elapsed = run_updates(PerChatUpdateProcessor(max_workers=8), updates, {i: 0.05 for i in range(1, 6)})
+    assert elapsed < 0.15, f"5 个群组应并发处理，实际耗时 {elapsed:.3f}s"
+
+    _, elapsed = run_updates(PerChatUpdateProcessor(max_workers=1), updates, {i: 0.02 for i in range(1, 6)})
+    assert elapsed >= 0.1, "max_workers=1 时应串行执行"
+    print("   ✅ 跨聊天并发与工作数上限正常")
+
+
+def test_lane_key():
+    """测试无法识别聊天的更新没有通道"""
+    assert lane_key(make_update(1, -42)) == -42
+    assert lane_key(Update(update_id=2)) is None
+    assert lane_key("not an update") is None
+    print("   ✅ 通道键正确")
+
+
+def test_order_kept_under_worker_contention():
+    """测试工作槽位全部占满时，同一聊天的更新仍按到达顺序执行"""
+    updates = []
+    for i in range(1, 21):
+        updates.append(make_update(i, -100 if i % 2 else -100 - i))
+    log, _ = run_updates(PerChatUpdateProcessor(max_workers=2, max_backlog=4), updates, {1: 0.03})
+    same_chat = [update_id for event, update_id in log if event == "start" and update_id % 2]
+    assert same_chat == list(range(1, 21, 2))
+    print("   ✅ 槽位竞争下聊天内保序")
+
+
+def test_backlog_queue_blocks_intake():
+    """测试积压已满时写入更新队列被阻塞，处理完成后恢复"""
+
+    async def run():
+        processor = PerChatUpdateProcessor(max_workers=1, max_backlog=2)
+        await processor.initialize()
+        queue = BacklogQueue(processor)
+        release = asyncio.Event()
+        started = []
+
+        async def handle(update):
+            started.append(update.update_id)
+            await release.wait()
+
+        updates = [make_update(i, -100 - i) for i in range(1, 4)]
+        await queue.put(updates[0])
+        await queue.put(updates[1])
+        blocked = asyncio.get_running_loop().create_task(queue.put(updates[2]))
+        await asyncio.sleep(0.01)
+        assert not blocked.done() and queue.qsize() == 2
+
+        tasks = []
+        for _ in range(2):
+            update = await queue.get()
+            tasks.append(asyncio.get_running_loop().create_task(processor.process_update(update, handle(update))))
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        release.set()
+        await asyncio.gather(*tasks)
+        await asyncio.wait_for(blocked, 1)
+        update = await queue.get()
+        await processor.process_update(update, handle(update))
+        # 停止信号等非更新对象不受背压影响
+        await asyncio.wait_for(queue.put(object()), 1)
+        return started
+
+    assert asyncio.run(run()) == [1, 2, 3]
+    print("   ✅ 积压满时阻塞写入")
+
+
+if __name__ == "__main__":
+    test_same_chat_in_order()
+    test_chats_run_concurrently()
+    test_lane_key()
+    test_order_kept_under_worker_contention()
+    test_backlog_queue_blocks_intake()
+    print("\n🎉 所有测试通过！")
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证更新录制的类型过滤、分段轮转与清理，以及未写完分段的读取
+"""
+
+import os
+import time
+from datetime import datetime
+
+from telegram import Chat, Message, Update
+
+from update_recorder import PART_SUFFIX, UpdateRecorder, list_segments, read_segments
+
+
+def make_update(update_id, chat_id=-100, text="hello world"):
+    chat = Chat(id=chat_id, type=Chat.SUPERGROUP)
+    return Update(update_id=update_id, message=Message(message_id=update_id, date=datetime.now(), chat=chat, text=text))
+
+
+def test_record_filters_and_rotates(tmp_path):
+    """测试只录制消息与反应更新，超过分段大小时轮转并按顺序读回"""
+    recorder = UpdateRecorder(str(tmp_path), segment_bytes=2000, max_segments=100)
+    for update_id in range(1, 51):
+        recorder.record(make_update(update_id))
+    recorder.record(Update(update_id=99))
+    recorder.close()
+
+    segments = list_segments(str(tmp_path))
+    assert len(segments) > 1
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(PART_SUFFIX)]
+    records = list(read_segments(segments))
+    assert [update["update_id"] for _, update in records] == list(range(1, 51))
+    assert recorder.recorded == 50
+    times = [t for t, _ in records]
+    assert times == sorted(times)
+
+
+def test_idle_segment_finished_on_time(tmp_path):
+    """测试没有新更新时，当前分段也会在轮转时刻完成，不会一直停留在 .part"""
+    recorder = UpdateRecorder(str(tmp_path), segment_seconds=0.2)
+    recorder.record(make_update(1))
+    deadline = time.time() + 5
+    while not list_segments(str(tmp_path)) and time.time() < deadline:
+        time.sleep(0.05)
+    assert len(list_segments(str(tmp_path))) == 1
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(PART_SUFFIX)]
+    recorder.close()
+    assert len(list_segments(str(tmp_path))) == 1
+
+
+def test_prunes_oldest_segments(tmp_path):
+    """测试只保留最近的 max_segments 个分段"""
+    recorder = UpdateRecorder(str(tmp_path), segment_bytes=1, max_segments=3)
+    for update_id in range(1, 11):
+        recorder.record(make_update(update_id))
+    recorder.close()
+    segments = list_segments(str(tmp_path))
+    assert len(segments) == 3
+    assert [update["update_id"] for _, update in read_segments(segments)] == [8, 9, 10]
+
+
+def test_truncated_segment_reads_complete_lines(tmp_path):
+    """测试进程异常退出留下的截断分段仍能读出完整的行"""
+    recorder = UpdateRecorder(str(tmp_path))
+    for update_id in range(1, 21):
+        recorder.record(make_update(update_id, text="x" * 200))
+    recorder.close()
+    (path,) = list_segments(str(tmp_path))
+    with open(path, "rb") as f:
+        data = f.read()
+    truncated = os.path.join(str(tmp_path), "updates-truncated" + PART_SUFFIX)
+    with open(truncated, "wb") as f:
+        f.write(data[:len(data) // 2])
+    records = list(read_segments([truncated]))
+    assert 0 < len(records) < 20
+    assert [update["update_id"] for _, update in records] == list(range(1, len(records) + 1))
+    assert len(list_segments(str(tmp_path), include_partial=True)) == 2
+    assert list_segments(str(tmp_path)) == [path]
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证分类结论缓存的键规范化、LRU/TTL、并发合并与持久化
+"""
+
+import asyncio
+import os
+import tempfile
+
+from verdict_cache import VerdictCache, config_fingerprint
+
+
+def test_normalized_key_and_fingerprint():
+    """测试大小写/空白差异命中同一条缓存，提示词变化则不命中"""
+    cache = VerdictCache()
+    fp = config_fingerprint("prompt v1", "model-a")
+    cache.put("Buy  CHEAP\ncoins", fp, "DELETE")
+    assert cache.get("buy cheap coins", fp) == "DELETE"
+    assert cache.get("buy cheap coins", config_fingerprint("prompt v2", "model-a")) is None
+    assert cache.get("buy cheap coins", config_fingerprint("prompt v1", "model-b")) is None
+    assert cache.get("buy cheap coins", config_fingerprint("prompt v1", "model-a", "https://other.example/v1")) is None
+    assert cache.hits == 1 and cache.misses == 3
+    print("   ✅ 键规范化与指纹隔离正常")
+
+
+def test_lru_and_ttl():
+    """测试容量淘汰与过期"""
+    cache = VerdictCache(max_size=2, ttl=60)
+    cache.put("a", "fp", "KEEP")
+    cache.put("b", "fp", "KEEP")
+    cache.get("a", "fp")  # a 变为最近使用
+    cache.put("c", "fp", "DELETE")
+    assert cache.get("b", "fp") is None, "最久未使用的 b 应被淘汰"
+    assert cache.get("a", "fp") == "KEEP"
+
+    expiring = VerdictCache(ttl=-1)
+    expiring.put("x", "fp", "DELETE")
+    assert expiring.get("x", "fp") is None, "已过期条目不应命中"
+    print("   ✅ LRU 与 TTL 正常")
+
+
+def test_get_or_compute_coalesces():
+    """测试同一文本的并发请求只调用一次 LLM，合并的请求不计为命中"""
+    cache = VerdictCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "DELETE"
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_compute("same spam", "fp", compute) for _ in range(10)])
+
+    results = asyncio.run(run())
+    assert results == ["DELETE"] * 10
+    assert len(calls) == 1
+    assert cache.misses == 1 and cache.coalesced == 9 and cache.hits == 0
+    assert cache.stats()["hit_rate"] == 0.0
+    print("   ✅ 并发请求合并正常")
+
+
+def test_persistence():
+    """测试保存后重新加载"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'verdict_cache.json')
+        cache = VerdictCache(path=path)
+        cache.put("hello", "fp", "KEEP")
+        cache.save()
+
+        reloaded = VerdictCache(path=path)
+        reloaded.load()
+        assert reloaded.get("hello", "fp") == "KEEP"
+        assert not os.path.exists(path + ".tmp")
+    print("   ✅ 持久化正常")
+
+
+if __name__ == "__main__":
+    test_normalized_key_and_fingerprint()
+    test_lru_and_ttl()
+    test_get_or_compute_coalesces()
+    test_persistence()
+    print("\n🎉 所有测试通过！")
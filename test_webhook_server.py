@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+测试用例：验证 webhook 接收的令牌校验、有界队列背压与更新转交
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook_server import SECRET_HEADER, WebhookServer
+
+
+class FakeProcessor:
+    max_concurrent_updates = 4
+
+    async def process_update(self, update, coroutine):
+        await coroutine
+
+
+def make_application(gate=None):
+    processed = []
+
+    async def process_update(update):
+        if gate is not None:
+            await gate.wait()
+        processed.append(update.update_id)
+
+    application = SimpleNamespace(bot=None, update_processor=FakeProcessor(), process_update=process_update)
+    return application, processed
+
+
+def update_json(update_id):
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "chat": {"id": -100, "type": "supergroup"}, "text": "hi"}
+    }
+
+
+async def post(client, update, token="s3cret"):
+    resp = await client.post("/telegram", json=update, headers={SECRET_HEADER: token})
+    return resp.status
+
+
+def run_with_client(server, scenario):
+    async def run():
+        server._open_intake()
+        async with TestClient(TestServer(server.make_app())) as client:
+            result = await scenario(client)
+        await server.stop()
+        return result
+
+    return asyncio.run(run())
+
+
+def test_rejects_wrong_secret_and_bad_payload():
+    """测试令牌不匹配返回 403，非法内容返回 400"""
+    application, processed = make_application()
+    server = WebhookServer(application, secret_token="s3cret")
+
+    async def scenario(client):
+        statuses = [await post(client, update_json(1), token="wrong"), await post(client, update_json(1), token="")]
+        resp = await client.post("/telegram", data="not json", headers={SECRET_HEADER: "s3cret"})
+        statuses.append(resp.status)
+        statuses.append(await post(client, [1, 2]))
+        return statuses
+
+    assert run_with_client(server, scenario) == [403, 403, 400, 400]
+    assert server.rejected == 2
+    assert processed == []
+
+
+def test_accepts_and_processes_updates():
+    """测试合法更新被接收并交给 Application 处理"""
+    application, processed = make_application()
+    server = WebhookServer(application, secret_token="s3cret")
+
+    async def scenario(client):
+        return [await post(client, update_json(i)) for i in range(1, 4)]
+
+    assert run_with_client(server, scenario) == [200, 200, 200]
+    assert sorted(processed) == [1, 2, 3]
+
+
+def test_backpressure_when_queue_full():
+    """测试处理中与排队的更新都已满时返回 503，放行后积压的更新全部处理完"""
+    gate = asyncio.Event()
+    application, processed = make_application(gate)
+    server = WebhookServer(application, secret_token="s3cret", max_queue=2, max_in_flight=1, enqueue_timeout=0.05)
+
+    async def scenario(client):
+        statuses = []
+        for i in range(1, 6):
+            statuses.append(await post(client, update_json(i)))
+            await asyncio.sleep(0.01)
+        resp = await client.get("/healthz")
+        health = await resp.json()
+        gate.set()
+        return statuses, health
+
+    statuses, health = run_with_client(server, scenario)
+    # 1 条处理中，2 条排队，其余被拒绝
+    assert statuses == [200, 200, 200, 503, 503]
+    assert health == {"status": "ok", "queue": 2, "in_flight": 1}
+    assert server.overloaded == 2
+    assert sorted(processed) == [1, 2, 3]
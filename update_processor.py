@@ -0,0 +1,105 @@
+"""
+按聊天分道的并发更新处理器
+
+不同聊天的更新并发处理，同一聊天内的更新严格按到达顺序依次处理。
+并发执行数受 max_workers 限制，已接收但尚未完成的更新总数受 max_backlog 限制。
+
+同一聊天的顺序由通道保证：更新在进入处理器时（任何等待之前）就排到该聊天上一个更新之后，
+不依赖信号量的唤醒顺序。轮询模式下配合 BacklogQueue 使用：积压已满时 Updater 写入更新会阻塞，
+getUpdates 随之暂停，更新留在 Telegram 服务器端而不是堆积在进程内存里。
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Hashable, Optional, Set
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# 轮询、webhook 与分片监督进程接收相同的更新类型
+ALLOWED_UPDATES = ["message", "edited_channel_post", "callback_query", "message_reaction", "message_reaction_count", "my_chat_member", "chat_member"]
+
+
+def lane_key(update: object) -> Optional[Hashable]:
+    """同一聊天的更新落在同一条通道，无法识别聊天的更新不做排序约束"""
+    if isinstance(update, Update) and update.effective_chat is not None:
+        return update.effective_chat.id
+    return None
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """跨聊天并发、聊天内保序的更新处理器"""
+
+    def __init__(self, max_workers: int = 16, max_backlog: int = 1000) -> None:
+        # 基类信号量限制处理器内的更新总数（排队 + 执行中），即最大积压量
+        super().__init__(max_concurrent_updates=max(2, max_backlog, max_workers))
+        self.max_workers = max(1, max_workers)
+        self._workers: Optional[asyncio.Semaphore] = None
+        # 每个聊天最后一个更新的完成信号，新更新等待它完成后再执行
+        self._lanes: Dict[Hashable, asyncio.Future] = {}
+        # 已由 admit() 预先占用积压名额的更新
+        self._admitted: Set[int] = set()
+
+    @property
+    def active_lanes(self) -> int:
+        return len(self._lanes)
+
+    async def initialize(self) -> None:
+        self._workers = asyncio.Semaphore(self.max_workers)
+
+    async def shutdown(self) -> None:
+        self._lanes.clear()
+        self._admitted.clear()
+
+    async def admit(self, update: object) -> None:
+        """预先占用一个积压名额，积压已满时阻塞调用方；该更新随后的 process_update 不再重复占用"""
+        await self._semaphore.acquire()
+        self._admitted.add(id(update))
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        # 先同步排入聊天通道，再等待积压名额与工作槽位：信号量的唤醒顺序不影响聊天内顺序
+        key = lane_key(update)
+        previous: Optional[asyncio.Future] = None
+        done: Optional[asyncio.Future] = None
+        if key is not None:
+            previous = self._lanes.get(key)
+            done = asyncio.get_running_loop().create_future()
+            self._lanes[key] = done
+        try:
+            if id(update) in self._admitted:
+                self._admitted.discard(id(update))
+            else:
+                await self._semaphore.acquire()
+            try:
+                if previous is not None:
+                    await asyncio.shield(previous)
+                await self.do_process_update(update, coroutine)
+            finally:
+                self._semaphore.release()
+        finally:
+            if done is not None:
+                done.set_result(None)
+                if self._lanes.get(key) is done:
+                    del self._lanes[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        if self._workers is None:
+            self._workers = asyncio.Semaphore(self.max_workers)
+        async with self._workers:
+            await coroutine
+
+
+class BacklogQueue(asyncio.Queue):
+    """Application/Updater 共用的更新队列：写入更新前先向处理器占用积压名额，满时阻塞写入方"""
+
+    def __init__(self, processor: PerChatUpdateProcessor) -> None:
+        super().__init__()
+        self.processor = processor
+
+    async def put(self, item: Any) -> None:
+        # 只对更新做背压；Application.stop() 写入的停止信号不能被阻塞
+        if isinstance(item, Update):
+            await self.processor.admit(item)
+        await super().put(item)
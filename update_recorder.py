@@ -0,0 +1,160 @@
+"""
+更新录制
+
+把收到的消息、具名反应与匿名反应计数更新写成 gzip 压缩的 JSONL 分段，供 loadtest.py --replay
+离线回放。每行形如 {"t": 接收时间, "update": Update.to_dict()}。
+
+事件循环里只做 to_dict 并放入队列，JSON 序列化、压缩和写盘都在后台线程中完成。
+分段按未压缩字节数或时长轮转（空闲时后台线程到期也会自行轮转，不必等下一条更新），
+写入中的分段以 .part 结尾，完成后改名为 .jsonl.gz；
+超过 max_segments 时删除最早的分段。录制内容包含消息原文，请按数据保留要求配置目录与数量。
+"""
+
+import gzip
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+RECORDED_KINDS = ("message", "message_reaction", "message_reaction_count")
+SEGMENT_SUFFIX = ".jsonl.gz"
+PART_SUFFIX = SEGMENT_SUFFIX + ".part"
+
+_STOP = object()
+
+
+class UpdateRecorder:
+    """后台线程写入的更新录制器"""
+
+    def __init__(self, directory: str, segment_bytes: int = 64 * 1024 * 1024, segment_seconds: float = 3600,
+                 max_segments: int = 48, kinds: Iterable[str] = RECORDED_KINDS) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+        self.kinds = tuple(kinds)
+        self.recorded = 0
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._file: Optional[gzip.GzipFile] = None
+        self._path = ""
+        self._opened_at = 0.0
+        self._written = 0
+        self._sequence = 0
+
+    def record(self, update: Update) -> None:
+        """只录制 kinds 中的更新类型；不阻塞事件循环"""
+        if not any(getattr(update, kind, None) is not None for kind in self.kinds):
+            return
+        if self._thread is None:
+            self._start()
+        self._queue.put((time.time(), update.to_dict()))
+        self.recorded += 1
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._run, name="update-recorder", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        """写完已排队的更新并关闭当前分段"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            # 有分段打开时最多等到其轮转时刻，空闲时也能按时完成分段
+            timeout = None
+            if self._file is not None:
+                timeout = max(0.0, self._opened_at + self.segment_seconds - time.time())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._rotate_if_due()
+                continue
+            if item is _STOP:
+                break
+            try:
+                self._write(*item)
+            except Exception as e:
+                logger.error(f"[录制] Failed to write update: {e}")
+        self._finish_segment()
+
+    def _rotate_if_due(self) -> None:
+        if self._file is not None and (
+            self._written >= self.segment_bytes or time.time() - self._opened_at >= self.segment_seconds
+        ):
+            try:
+                self._finish_segment()
+            except Exception as e:
+                self._file = None
+                logger.error(f"[录制] Failed to finish segment {self._path}: {e}")
+
+    def _write(self, received_at: float, update: Dict[str, Any]) -> None:
+        self._rotate_if_due()
+        if self._file is None:
+            self._open_segment()
+        line = (json.dumps({"t": received_at, "update": update}, ensure_ascii=False) + "\n").encode("utf-8")
+        self._file.write(line)
+        self._written += len(line)
+
+    def _open_segment(self) -> None:
+        self._sequence += 1
+        name = f"updates-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{self._sequence:04d}{PART_SUFFIX}"
+        self._path = os.path.join(self.directory, name)
+        self._file = gzip.open(self._path, "wb", compresslevel=6)
+        self._opened_at = time.time()
+        self._written = 0
+
+    def _finish_segment(self) -> None:
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        os.replace(self._path, self._path[:-len(".part")])
+        self._prune()
+
+    def _prune(self) -> None:
+        segments = list_segments(self.directory)
+        for path in segments[:max(0, len(segments) - self.max_segments)]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"[录制] Failed to remove old segment {path}: {e}")
+
+
+def list_segments(directory: str, include_partial: bool = False) -> List[str]:
+    """按时间顺序列出目录中的分段"""
+    suffixes = (SEGMENT_SUFFIX, PART_SUFFIX) if include_partial else (SEGMENT_SUFFIX,)
+    names = sorted(name for name in os.listdir(directory) if name.endswith(suffixes))
+    return [os.path.join(directory, name) for name in names]
+
+
+def read_segments(paths: Iterable[str]) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    """依次读取分段中的 (接收时间, 更新)；未写完的分段读到截断处为止"""
+    for path in paths:
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    yield record["t"], record["update"]
+        except (EOFError, gzip.BadGzipFile) as e:
+            logger.warning(f"[录制] Segment {path} is truncated: {e}")
@@ -0,0 +1,163 @@
+"""
+LLM 分类结论缓存
+
+以「规范化消息文本 + 提示词/服务地址/模型指纹」为键缓存 DELETE/KEEP 结论，
+LRU 淘汰并带 TTL，可选持久化到 data/ 目录。
+同一键的并发请求合并为一次 LLM 调用，合并的请求单独计数，不算作缓存命中。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """NFKC 规范化、忽略大小写并合并空白"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+def config_fingerprint(prompt: str, model: str, base_url: str = "") -> str:
+    """当前分类提示词、服务地址与模型的指纹，任一变化都会使旧缓存失效"""
+    return hashlib.sha256(f"{base_url}\0{model}\0{prompt}".encode("utf-8")).hexdigest()[:16]
+
+
+class VerdictCache:
+    """有界 LRU + TTL 的结论缓存"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 86400, path: Optional[str] = None) -> None:
+        self.max_size = max(1, int(max_size))
+        self.ttl = float(ttl)
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        # 加入进行中计算的请求：没有命中缓存，也没有单独调用 LLM
+        self.coalesced = 0
+        # key -> (verdict, 过期时间戳)
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(text: str, fingerprint: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{fingerprint}:{digest}"
+
+    def get(self, text: str, fingerprint: str) -> Optional[str]:
+        """查询缓存并更新命中计数"""
+        verdict = self._lookup(self.make_key(text, fingerprint))
+        if verdict is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return verdict
+
+    def put(self, text: str, fingerprint: str, verdict: str) -> None:
+        self._store(self.make_key(text, fingerprint), verdict)
+
+    async def get_or_compute(self, text: str, fingerprint: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """命中则直接返回；未命中时调用 compute，同键并发请求共享一次结果"""
+        key = self.make_key(text, fingerprint)
+        verdict = self._lookup(key)
+        if verdict is not None:
+            self.hits += 1
+            return verdict
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            verdict = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 避免没有其他等待者时出现 "exception was never retrieved"
+            future.exception()
+            raise
+        else:
+            self._store(key, verdict)
+            future.set_result(verdict)
+            return verdict
+        finally:
+            self._inflight.pop(key, None)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        verdict, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return verdict
+
+    def _store(self, key: str, verdict: str) -> None:
+        self._entries[key] = (verdict, time.time() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """清空缓存（提示词或模型变更时调用）"""
+        self._entries.clear()
+        logger.info("[结论缓存] 缓存已清空")
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def load(self) -> None:
+        """从磁盘加载未过期的缓存条目"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            now = time.time()
+            for key, (verdict, expires_at) in data.items():
+                if expires_at > now:
+                    self._entries[key] = (verdict, expires_at)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            logger.info(f"[结论缓存] 已加载 {len(self._entries)} 条缓存")
+        except Exception as e:
+            logger.warning(f"[结论缓存] 加载缓存失败: {e}")
+
+    def save(self) -> None:
+        """原子写入磁盘，先写临时文件再替换"""
+        if not self.path:
+            return
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(dict(self._entries), f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"[结论缓存] 保存缓存失败: {e}")
@@ -0,0 +1,221 @@
+"""
+Webhook 接收模式
+
+内嵌 aiohttp 服务器接收 Telegram 推送的更新，替代长轮询：
+- 校验 X-Telegram-Bot-Api-Secret-Token，不匹配返回 403
+- 更新先进入有界接收队列，队列满且 enqueue_timeout 秒内没有空位时返回 503，
+  Telegram 会稍后重新投递，积压不会无限增长
+- 消费任务在处理中的更新少于 max_in_flight 时才从队列取出更新，
+  交给 Application 的更新处理器（同一群组保序）
+- GET /healthz 供负载均衡器探活
+"""
+
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """接收更新并以有界队列向 Application 供给"""
+
+    def __init__(self, application: Application, secret_token: str, listen: str = "0.0.0.0",
+                 port: int = 8443, url_path: str = "/telegram", max_queue: int = 1000,
+                 max_in_flight: Optional[int] = None, enqueue_timeout: float = 5.0) -> None:
+        if not secret_token:
+            raise ValueError("Webhook 模式必须设置 secret token")
+        self.application = application
+        self.secret_token = secret_token
+        self.listen = listen
+        self.port = port
+        self.url_path = "/" + url_path.lstrip("/")
+        self.max_queue = max(1, max_queue)
+        self.max_in_flight = max(1, max_in_flight or application.update_processor.max_concurrent_updates)
+        self.enqueue_timeout = enqueue_timeout
+        self.received = 0
+        self.rejected = 0
+        self.overloaded = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def queue_size(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.url_path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        return app
+
+    def _open_intake(self) -> None:
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._consumer = asyncio.get_running_loop().create_task(self._consume())
+
+    async def start(self) -> None:
+        self._open_intake()
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.listen, self.port).start()
+        logger.info(f"[Webhook] Listening on {self.listen}:{self.port}{self.url_path}")
+
+    async def stop(self) -> None:
+        """停止接收新更新，处理完已接收的更新后退出"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._queue is not None:
+            await self._queue.join()
+        if self._consumer is not None:
+            self._consumer.cancel()
+            try:
+                await self._consumer
+            except asyncio.CancelledError:
+                pass
+            self._consumer = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            self.rejected += 1
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            if not isinstance(data, dict):
+                raise ValueError("update is not a JSON object")
+            update = Update.de_json(data, self.application.bot)
+        except (json.JSONDecodeError, ValueError, TypeError, KeyError) as e:
+            logger.warning(f"[Webhook] Invalid update payload: {e}")
+            return web.Response(status=400)
+        try:
+            await asyncio.wait_for(self._queue.put(update), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            # 让 Telegram 稍后重试，而不是无限积压
+            self.overloaded += 1
+            logger.warning(f"[Webhook] Intake queue full ({self.max_queue}), rejecting update {update.update_id}")
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "status": "ok",
+            "queue": self.queue_size,
+            "in_flight": self.in_flight
+        })
+
+    async def _consume(self) -> None:
+        while True:
+            # 先占处理槽位再出队，处理已满时更新留在队列里计入积压
+            await self._slots.acquire()
+            update = await self._queue.get()
+            task = asyncio.get_running_loop().create_task(self._process(update))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _process(self, update: Update) -> None:
+        try:
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update)
+            )
+        except Exception as e:
+            logger.error(f"[Webhook] Failed to process update {update.update_id}: {e}")
+        finally:
+            self._slots.release()
+            self._queue.task_done()
+
+
+def webhook_from_env(application: Application, default_max_queue: int = 1000) -> Tuple[WebhookServer, str, int]:
+    """按 WEBHOOK_* 环境变量创建服务器，返回 (服务器, webhook 地址, 最大连接数)"""
+    webhook_url = os.getenv("WEBHOOK_URL", "")
+    if not webhook_url:
+        raise ValueError("UPDATE_MODE=webhook 需要设置 WEBHOOK_URL 环境变量。")
+    server = WebhookServer(
+        application,
+        # 未配置时每次启动生成随机令牌，set_webhook 会同步给 Telegram
+        secret_token=os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32),
+        listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+        port=int(os.getenv("WEBHOOK_PORT", "8443")),
+        url_path=os.getenv("WEBHOOK_PATH") or urlparse(webhook_url).path or "/telegram",
+        max_queue=int(os.getenv("WEBHOOK_MAX_QUEUE", str(default_max_queue)))
+    )
+    return server, webhook_url, int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+
+def stop_event() -> asyncio.Event:
+    """收到 SIGINT/SIGTERM 时置位的事件（须在事件循环中调用）"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass
+    return stop
+
+
+@asynccontextmanager
+async def running_application(application: Application) -> AsyncIterator[None]:
+    """按 run_polling 的生命周期启动与关闭 Application（不启动 Updater）"""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    try:
+        await application.start()
+        yield
+    finally:
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def serve_webhook(application: Application, server: WebhookServer, webhook_url: str,
+                        allowed_updates: List[str], max_connections: int = 40) -> None:
+    """运行 webhook 服务器直到收到 SIGINT/SIGTERM"""
+    stop = stop_event()
+    async with running_application(application):
+        await server.start()
+        try:
+            await application.bot.set_webhook(
+                url=webhook_url,
+                secret_token=server.secret_token,
+                allowed_updates=allowed_updates,
+                max_connections=max_connections
+            )
+            logger.info(f"[Webhook] Webhook set to {webhook_url}")
+            await stop.wait()
+        finally:
+            await server.stop()
+
+
+def run_webhook(application: Application, server: WebhookServer, webhook_url: str,
+                allowed_updates: List[str], max_connections: int = 40) -> Any:
+    return asyncio.run(serve_webhook(application, server, webhook_url, allowed_updates, max_connections))